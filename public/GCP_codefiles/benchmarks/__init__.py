@@ -0,0 +1,13 @@
+# Offline benchmarks for the Cloud Functions. Run from public/GCP_codefiles, e.g.
+#   python -m benchmarks.quantization
+import os
+import sys
+
+CODEFILES_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+NXS_FUNCTION_DIR = os.path.join(CODEFILES_DIR, 'gcp_nxs-function')
+PDF_FUNCTION_DIR = os.path.join(CODEFILES_DIR, 'gcp_pdf-retrieval-function')
+
+# The shared modules (corpus, vector_index, embedding_store, ...) are identical in
+# both function directories; import them from the nxs copy
+if NXS_FUNCTION_DIR not in sys.path:
+    sys.path.insert(0, NXS_FUNCTION_DIR)
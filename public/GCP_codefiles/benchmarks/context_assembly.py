@@ -0,0 +1,204 @@
+# Prompt tokens the context assembly (context_assembly.py) saves, and what it keeps.
+#
+#   python -m benchmarks.context_assembly
+#   python -m benchmarks.context_assembly --corpus /tmp/nxs_bench --queries 50 --json context.json
+#
+# overlap: pages cut into overlapping word windows, each embedded as the mean of
+#   its words' vectors, so neighbouring windows and same-page windows are close.
+#   Every word of a page is written as its own token ("p3w17"), so repeats are
+#   easy to count. For queries drawn from the pages it compares the assembled
+#   relation context with the top 5 windows as they were: tokens sent, distinct
+#   page words they carry and the share of sent words that repeat others.
+#   Assembled passages must not repeat a word and must keep page order.
+# corpus (with --corpus, a benchmarks.synthetic directory): the relation summary
+#   prompt (pdf_results) and the group summary inputs of the video pipeline, with
+#   assembly on and off, against the fakes; reports the per-request trace counts.
+# Exits non-zero if a check fails.
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from benchmarks.fakes import configure_environment
+
+
+def make_pages(pages, words_per_page, vocabulary, rng):
+    # Each page draws mostly from its own slice of the vocabulary
+    topic_size = vocabulary // pages
+    texts = []
+    for page in range(pages):
+        own = rng.integers(page * topic_size, (page + 1) * topic_size, words_per_page)
+        shared = rng.integers(0, vocabulary, words_per_page)
+        texts.append(np.where(rng.random(words_per_page) < 0.7, own, shared))
+    return texts
+
+
+def window_chunks(pages, window, stride):
+    # (page, start, word ids) for overlapping windows over every page
+    chunks = []
+    for page, words in enumerate(pages):
+        for start in range(0, max(1, len(words) - window + stride), stride):
+            chunks.append((page, start, words[start:start + window]))
+    return chunks
+
+
+def window_text(page, start, word_ids):
+    return " ".join(f"p{page}w{start + k}" for k in range(len(word_ids)))
+
+
+def page_positions(text):
+    return [tuple(int(part) for part in word[1:].split("w")) for word in text.split()]
+
+
+def overlap_scenario(args, rng):
+    from context_assembly import CONTEXT_RELATION_TOKENS, relation_context
+    from summarization import estimate_tokens
+
+    pages = make_pages(args.pages, args.words_per_page, args.vocabulary, rng)
+    chunks = window_chunks(pages, args.window, args.stride)
+    word_vectors = rng.standard_normal((args.vocabulary, args.dim)).astype(np.float32)
+    vectors = np.stack([word_vectors[ids].mean(axis=0) for _, _, ids in chunks])
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    class Corpus:
+        def vectors(self, rows):
+            return vectors[[row for _, row in rows]]
+
+    results = {"queries": args.queries, "naive": {"tokens": 0, "distinct_words": 0, "repeated_words": 0},
+               "assembled": {"tokens": 0, "distinct_words": 0, "repeated_words": 0}, "assembly_ms": []}
+    failures = []
+    for _ in range(args.queries):
+        # A query is a handful of words from one spot of a random page
+        page = int(rng.integers(len(pages)))
+        at = int(rng.integers(0, args.words_per_page - 20))
+        query = word_vectors[pages[page][at:at + 20]].mean(axis=0)
+        query /= np.linalg.norm(query)
+        scores = vectors @ query
+        top = np.argsort(-scores, kind="stable")[:args.top_k]
+        snippets = [{"chunk_text": window_text(*chunks[i]), "page": chunks[i][0], "document_id": "pdf",
+                     "row": int(i), "similarity": float(scores[i])} for i in top]
+
+        started = time.perf_counter()
+        passages = relation_context(snippets, Corpus())
+        results["assembly_ms"].append((time.perf_counter() - started) * 1000)
+
+        for name, texts in (("naive", [snippet["chunk_text"] for snippet in snippets[:5]]), ("assembled", passages)):
+            positions = [page_positions(text) for text in texts]
+            sent = [position for passage in positions for position in passage]
+            if name == "assembled" and any(passage != sorted(set(passage)) for passage in positions):
+                failures.append("an assembled passage repeats words or is out of page order")
+            totals = results[name]
+            totals["tokens"] += sum(estimate_tokens(text) for text in texts)
+            totals["distinct_words"] += len(set(sent))
+            totals["repeated_words"] += len(sent) - len(set(sent))
+        if sum(estimate_tokens(text) for text in passages) > CONTEXT_RELATION_TOKENS:
+            failures.append("assembled context over the token budget")
+
+    naive, assembled = results["naive"], results["assembled"]
+    if assembled["tokens"] >= naive["tokens"]:
+        failures.append(f"assembly sent {assembled['tokens']} tokens, the top 5 {naive['tokens']}")
+    if assembled["repeated_words"] > naive["repeated_words"]:
+        failures.append("assembled contexts repeat more words than the top 5")
+    if assembled["distinct_words"] / assembled["tokens"] <= naive["distinct_words"] / naive["tokens"]:
+        failures.append("assembled contexts carry no more distinct words per token than the top 5")
+    timings = np.array(results.pop("assembly_ms"))
+    results["assembly_p50_ms"] = round(float(np.percentile(timings, 50)), 3)
+    results["assembly_p95_ms"] = round(float(np.percentile(timings, 95)), 3)
+    return results, sorted(set(failures))
+
+
+def corpus_scenario(args):
+    from benchmarks.fakes import install_fakes
+    from context_assembly import group_context
+    import context_assembly
+    from corpus import get_corpus
+    from pdf_search import pdf_results
+    from retrieval_key import retrieve
+    from timeline import rank_groups
+    from tracing import start_trace
+
+    model = install_fakes(os.path.join(args.corpus, "gcs"), llm_latency=0.0, llm_jitter=0.0)
+    with open(os.path.join(args.corpus, "queries.json")) as f:
+        queries = json.load(f)[:args.queries]
+
+    results = {}
+    for enabled in (False, True):
+        context_assembly.CONTEXT_ASSEMBLY = enabled
+        model.prompt_chars = 0
+        counts = {}
+        for query in queries:
+            with start_trace("context_benchmark") as trace:
+                pdf_results(query)
+                groups = rank_groups(retrieve(query))
+                group_inputs = [group_context(group, get_corpus()) for group in groups]
+            for name, value in trace.counts.items():
+                counts[name] = counts.get(name, 0) + value
+            counts["group_input_tokens"] = counts.get("group_input_tokens", 0) + sum(
+                len(text) // 4 + 1 for text in group_inputs)
+        results["assembled" if enabled else "naive"] = {
+            "relation_prompt_tokens_per_request": round(model.prompt_chars / 4 / len(queries), 1),
+            "group_input_tokens_per_request": round(counts.pop("group_input_tokens") / len(queries), 1),
+            "trace_counts_per_request": {name: round(value / len(queries), 1) for name, value in counts.items()},
+        }
+    context_assembly.CONTEXT_ASSEMBLY = True
+    failures = []
+    if results["assembled"]["relation_prompt_tokens_per_request"] > results["naive"]["relation_prompt_tokens_per_request"]:
+        failures.append("relation prompts got larger")
+    return results, failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tokens saved by MMR context assembly")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--pages", type=int, default=40)
+    parser.add_argument("--words-per-page", type=int, default=600)
+    parser.add_argument("--vocabulary", type=int, default=4000)
+    parser.add_argument("--window", type=int, default=120, help="words per chunk")
+    parser.add_argument("--stride", type=int, default=80, help="words between chunk starts (overlap = window - stride)")
+    parser.add_argument("--top-k", type=int, default=20, help="chunks retrieved per query, as in pdf_results")
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--corpus", help="benchmarks.synthetic directory for the end-to-end comparison")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    overrides = {}
+    if args.corpus:
+        overrides = {"CORPUS_REGISTRY": os.path.join(args.corpus, "registry.json"),
+                     "STORE_CACHE_DIR": os.path.join(args.corpus, "store_cache")}
+    configure_environment(**overrides)
+
+    report, failures = {}, []
+    report["overlap"], failed = overlap_scenario(args, np.random.default_rng(args.seed))
+    failures += failed
+    naive, assembled = report["overlap"]["naive"], report["overlap"]["assembled"]
+    print(f"overlap ({args.queries} queries, {args.window}-word chunks overlapping by {args.window - args.stride}):")
+    for name, totals in (("top 5", naive), ("assembled", assembled)):
+        sent = totals["distinct_words"] + totals["repeated_words"]
+        print(f"    {name:<10} {totals['tokens'] / args.queries:7.1f} tokens/query  "
+              f"{totals['distinct_words'] / args.queries:6.1f} distinct words/query  "
+              f"{totals['repeated_words'] / max(1, sent):6.1%} repeated")
+    print(f"    assembly p50 {report['overlap']['assembly_p50_ms']} ms, p95 {report['overlap']['assembly_p95_ms']} ms")
+
+    if args.corpus:
+        report["corpus"], failed = corpus_scenario(args)
+        failures += failed
+        print(f"corpus ({args.corpus}):")
+        for name, result in report["corpus"].items():
+            print(f"    {name:<10} relation prompt {result['relation_prompt_tokens_per_request']} tokens, "
+                  f"group inputs {result['group_input_tokens_per_request']} tokens per request; "
+                  f"trace counts {result['trace_counts_per_request']}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    for failure in failures:
+        print(f"CHECK FAILED {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
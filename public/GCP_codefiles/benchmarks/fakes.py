@@ -0,0 +1,187 @@
+# Local stand-ins for the Google services the functions call, swapped in through
+# the functions' own set_* hooks: FakeEmbedder for Vertex embeddings,
+# FakeGenerativeModel for Gemini, LocalStorageClient for GCS.
+#
+# Module-level settings of the functions are read from the environment at import,
+# so call configure_environment() before anything imports them.
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+
+# Defaults for offline runs; explicit environment variables still win
+LOCAL_ENVIRONMENT = {
+    "RUNTIME_PREWARM": "0",
+    "CLOUD_LOGGING": "0",
+    "TRACE_EXPORTER": "none",
+    "AUDIT_SINK": "",
+    "SUMMARY_CACHE_PATH": "",
+}
+
+# Batched summary prompts number their snippets like this and ask for a JSON array back
+BATCH_SNIPPET_PATTERN = re.compile(r"^Snippet (\d+):", re.MULTILINE)
+
+FAKE_WORDS = ("this", "segment", "explains", "how", "the", "concept", "relates", "to", "your", "query",
+              "and", "why", "it", "is", "worth", "reviewing", "before", "moving", "on")
+
+
+def configure_environment(**overrides):
+    for name, value in dict(LOCAL_ENVIRONMENT, **overrides).items():
+        os.environ.setdefault(name, str(value))
+
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class ResourceExhausted(Exception):
+    # Same name and code as google.api_core.exceptions.ResourceExhausted (quota / 429)
+    code = 429
+
+
+class ServiceUnavailable(Exception):
+    # Same name and code as google.api_core.exceptions.ServiceUnavailable (503)
+    code = 503
+
+
+class FakeGenerativeModel:
+    # Sleeps latency +/- jitter seconds per call (uniform), then answers with
+    # deterministic text derived from the prompt. Faults, for exercising llm.py:
+    # - failure_rate: that share of calls raise a generic (non-retryable) error
+    # - throttle_rate / unavailable_rate: that share raise ResourceExhausted / ServiceUnavailable
+    # - capacity: calls beyond this many in flight are rejected with ResourceExhausted,
+    #   like a per-project quota, and each call in flight past capacity / 2 adds
+    #   `congestion` x latency, so the model slows down before it starts refusing
+    # - outages: (start, end) seconds after creation during which every call fails
+    #   with ServiceUnavailable
+    def __init__(self, latency=0.8, jitter=0.2, failure_rate=0.0, words=40, seed=0, throttle_rate=0.0,
+                 unavailable_rate=0.0, capacity=None, congestion=0.0, outages=()):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.throttle_rate = throttle_rate
+        self.unavailable_rate = unavailable_rate
+        self.capacity = capacity
+        self.congestion = congestion
+        self.outages = outages
+        self.words = words
+        self.calls = 0
+        # Characters of prompt received, for comparing prompt sizes
+        self.prompt_chars = 0
+        self.failures = 0
+        self.calls_in_outage = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self._created = time.monotonic()
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _next_call(self):
+        # Returns (delay, error to raise after it or None); the caller must call _done()
+        with self._lock:
+            self.calls += 1
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            delay = max(0.0, self.latency + self._rng.uniform(-self.jitter, self.jitter))
+            elapsed = time.monotonic() - self._created
+            roll = self._rng.random()
+            error = None
+            if any(start <= elapsed < end for start, end in self.outages):
+                error = ServiceUnavailable("Injected outage")
+                self.calls_in_outage += 1
+            elif self.capacity is not None and self.in_flight > self.capacity:
+                error, delay = ResourceExhausted("Injected quota exceeded"), 0.05 * delay
+            elif roll < self.failure_rate:
+                error = RuntimeError("Injected generation failure")
+            elif roll < self.failure_rate + self.throttle_rate:
+                error, delay = ResourceExhausted("Injected rate limit"), 0.05 * delay
+            elif roll < self.failure_rate + self.throttle_rate + self.unavailable_rate:
+                error = ServiceUnavailable("Injected unavailability")
+            if self.capacity is not None and self.congestion:
+                delay *= 1 + self.congestion * max(0, self.in_flight - self.capacity / 2)
+            if error is not None:
+                self.failures += 1
+        return delay, error
+
+    def _done(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def _text(self, prompt):
+        rng = random.Random(hashlib.sha256(prompt.encode('utf-8')).digest())
+        sentence = lambda: " ".join(rng.choice(FAKE_WORDS) for _ in range(self.words)).capitalize() + "."
+        if "JSON array" in prompt:
+            ids = [int(number) for number in BATCH_SNIPPET_PATTERN.findall(prompt)]
+            return json.dumps([{"id": i, "summary": sentence()} for i in ids])
+        return sentence()
+
+    def generate_content(self, prompt, generation_config=None, stream=False):
+        delay, error = self._next_call()
+        with self._lock:
+            self.prompt_chars += len(prompt)
+        if stream:
+            return self._stream(prompt, delay, error)
+        try:
+            time.sleep(delay)
+        finally:
+            self._done()
+        if error is not None:
+            raise error
+        return FakeResponse(self._text(prompt))
+
+    def _stream(self, prompt, delay, error):
+        words = self._text(prompt).split(" ")
+        parts = 4
+        try:
+            for i in range(parts):
+                time.sleep(delay / parts)
+                if error is not None and i == parts // 2:
+                    raise error
+                chunk = " ".join(words[i * len(words) // parts:(i + 1) * len(words) // parts])
+                yield FakeResponse(chunk if i == 0 else " " + chunk)
+        finally:
+            self._done()
+
+
+class FakeRequest:
+    # The parts of flask.Request the HTTP handlers use
+    def __init__(self, body, method='POST', headers=None, args=None):
+        self.body = body
+        self.method = method
+        self.headers = headers or {}
+        self.args = args or {}
+
+    def get_json(self, silent=False):
+        return self.body
+
+
+def install_fakes(gcs_root, llm_latency=0.8, llm_jitter=0.2, llm_failure_rate=0.0, embed_latency=0.0,
+                  summary_cache=False, response_cache=False, model_names=("gemini-1.0-pro",), **llm_faults):
+    # Returns the FakeGenerativeModel so callers can read its call counts; llm_faults
+    # are the model's other fault options (throttle_rate, capacity, outages, ...)
+    from embedding_client import EmbeddingClient, FakeEmbedder, set_client
+    from gcs import LocalStorageClient, set_storage_client
+    from llm import LLMClient, set_llm_client
+    from response_cache import ResponseCache, set_response_cache
+    from runtime import set_credentials, set_generative_model
+    from summary_cache import MemoryTier, SummaryCache, set_cache
+
+    # Application default credentials (None) everywhere, so every storage client
+    # lookup lands on the local one
+    set_credentials(None)
+    set_storage_client(LocalStorageClient(gcs_root), None)
+    set_client(EmbeddingClient(FakeEmbedder(latency=embed_latency)))
+    model = FakeGenerativeModel(llm_latency, llm_jitter, llm_failure_rate, **llm_faults)
+    for name in model_names:
+        set_generative_model(name, model)
+    # Fresh limiter, breaker and counters for every run
+    set_llm_client(LLMClient())
+    # Without the summary and response caches every request pays for retrieval and
+    # its LLM calls, which is what a fresh query mix looks like
+    set_cache(SummaryCache(memory=MemoryTier() if summary_cache else MemoryTier(max_entries=0)))
+    set_response_cache(ResponseCache() if response_cache else ResponseCache(max_entries=0))
+    return model
@@ -0,0 +1,178 @@
+# Drives the LLM call layer (llm.py) against the fault-injecting FakeGenerativeModel
+# and compares it with calling the model directly, as the summary functions used to
+# (one attempt, placeholder on any error).
+#
+#   python -m benchmarks.llm_backpressure
+#   python -m benchmarks.llm_backpressure --scenarios burst,outage --callers 64 --json llm.json
+#
+# Scenarios:
+#   burst     more concurrent callers than the fake's quota, which also slows down as it fills
+#   throttle  a share of calls answered with 429s
+#   outage    every call fails for a while, then the model recovers
+#   deadline  a tight per-request deadline while the model is overloaded
+# Exits non-zero if the layer does worse than direct calls where it should do
+# better: success rate under burst and throttle, model calls during the outage, and
+# latency past the deadline.
+import argparse
+import json
+import sys
+import threading
+import time
+
+import numpy as np
+
+from benchmarks.fakes import FakeGenerativeModel
+from llm import AdaptiveLimiter, CircuitBreaker, LLMClient, deadline
+
+PROMPT = "Explain how this segment relates to the query."
+
+
+def direct_call(model):
+    model.generate_content(PROMPT)
+
+
+def run_callers(call, callers, calls_per_caller, request_deadline=None, interval=0.0):
+    # Every caller issues its calls back to back, or one every `interval` seconds
+    # when they return sooner; returns per-call (start, latency, ok)
+    records = []
+    lock = threading.Lock()
+    started = time.monotonic()
+
+    def worker():
+        for _ in range(calls_per_caller):
+            begin = time.monotonic()
+            try:
+                if request_deadline is None:
+                    call()
+                else:
+                    with deadline(request_deadline):
+                        call()
+                ok = True
+            except Exception:
+                ok = False
+            with lock:
+                records.append((begin - started, time.monotonic() - begin, ok))
+            time.sleep(max(0.0, begin + interval - time.monotonic()))
+
+    threads = [threading.Thread(target=worker) for _ in range(callers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return records, time.monotonic() - started
+
+
+def summarize(name, records, seconds, model, client=None):
+    latencies = np.array([latency for _, latency, _ in records]) * 1000
+    result = {
+        "mode": name,
+        "calls": len(records),
+        "success_rate": round(sum(ok for _, _, ok in records) / len(records), 3),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 1),
+        "p95_ms": round(float(np.percentile(latencies, 95)), 1),
+        "max_ms": round(float(latencies.max()), 1),
+        "seconds": round(seconds, 2),
+        "model_calls": model.calls,
+        "model_peak_in_flight": model.peak_in_flight,
+    }
+    if client is not None:
+        result["llm"] = client.stats()
+    return result
+
+
+def layered_client(args, **breaker):
+    return LLMClient(AdaptiveLimiter(initial=args.initial_limit), CircuitBreaker(**breaker),
+                     backoff_base=args.backoff_base, backoff_max=args.backoff_max, seed=0)
+
+
+def scenario(name, args):
+    # Returns (direct result, layered result, check message or None)
+    faults = {
+        "burst": dict(capacity=args.capacity, congestion=0.05),
+        "throttle": dict(throttle_rate=0.3),
+        "outage": dict(outages=((args.outage_start, args.outage_start + args.outage_seconds),)),
+        "deadline": dict(capacity=args.capacity, congestion=0.2),
+    }[name]
+    request_deadline = args.deadline if name == "deadline" else None
+    breaker = dict(failure_threshold=5, reset_timeout=0.5) if name == "outage" else {}
+    # The outage is timed, so its callers pace their calls to span it and the recovery after it
+    calls, interval = args.calls, 0.0
+    if name == "outage":
+        interval = 2 * args.latency
+        calls = int((args.outage_start + args.outage_seconds + 1.0) / interval)
+
+    model = FakeGenerativeModel(args.latency, args.jitter, **faults)
+    records, seconds = run_callers(lambda: direct_call(model), args.callers, calls, request_deadline, interval)
+    direct = summarize("direct", records, seconds, model)
+    direct_outage_calls = model.calls_in_outage if name == "outage" else None
+
+    model = FakeGenerativeModel(args.latency, args.jitter, **faults)
+    client = layered_client(args, **breaker)
+    records, seconds = run_callers(lambda: client.generate(model, PROMPT), args.callers, calls, request_deadline,
+                                   interval)
+    layered = summarize("layered", records, seconds, model, client)
+
+    check = None
+    if name in ("burst", "throttle") and layered["success_rate"] < direct["success_rate"]:
+        check = f"{name}: success rate {layered['success_rate']} below direct {direct['success_rate']}"
+    if name == "outage" and model.calls_in_outage > direct_outage_calls:
+        check = f"outage: {model.calls_in_outage} model calls during the outage, direct made {direct_outage_calls}"
+    if name == "deadline":
+        # An attempt started just before the deadline may still run one (congested) call past it
+        allowed_ms = (args.deadline + args.latency * 3 + args.jitter) * 1000
+        if layered["max_ms"] > allowed_ms:
+            check = f"deadline: a call took {layered['max_ms']} ms, more than {allowed_ms:.0f} ms"
+    if name == "outage":
+        direct["model_calls_in_outage"], layered["model_calls_in_outage"] = direct_outage_calls, model.calls_in_outage
+    return direct, layered, check
+
+
+def print_pair(name, direct, layered):
+    print(f"{name}:")
+    for result in (direct, layered):
+        line = (f"    {result['mode']:<8} success {result['success_rate']:.1%}  p50 {result['p50_ms']} ms  "
+                f"p95 {result['p95_ms']} ms  max {result['max_ms']} ms  model calls {result['model_calls']}  "
+                f"peak in flight {result['model_peak_in_flight']}")
+        if "model_calls_in_outage" in result:
+            line += f"  calls during outage {result['model_calls_in_outage']}"
+        print(line)
+    llm = layered["llm"]
+    print(f"    layer: limit {llm['limit']} ({llm['limit_decreases']} decreases), {llm['retries']} retries, "
+          f"{llm['rejected_open']} rejected by the breaker ({llm['breaker_trips']} trips), "
+          f"{llm['deadline_exceeded']} past deadline")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LLM call layer against a fault-injecting fake Gemini")
+    parser.add_argument("--scenarios", default="burst,throttle,outage,deadline")
+    parser.add_argument("--callers", type=int, default=48, help="concurrent callers")
+    parser.add_argument("--calls", type=int, default=10, help="calls per caller")
+    parser.add_argument("--latency", type=float, default=0.1, help="seconds per fake call")
+    parser.add_argument("--jitter", type=float, default=0.02)
+    parser.add_argument("--capacity", type=int, default=12, help="fake quota: calls in flight before 429s")
+    parser.add_argument("--initial-limit", type=int, default=8)
+    parser.add_argument("--backoff-base", type=float, default=0.05)
+    parser.add_argument("--backoff-max", type=float, default=1.0)
+    parser.add_argument("--outage-start", type=float, default=0.5)
+    parser.add_argument("--outage-seconds", type=float, default=1.5)
+    parser.add_argument("--deadline", type=float, default=0.5, help="per-call deadline in the deadline scenario")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    results, failures = [], []
+    for name in args.scenarios.split(","):
+        direct, layered, check = scenario(name, args)
+        print_pair(name, direct, layered)
+        results.append({"scenario": name, "direct": direct, "layered": layered})
+        if check:
+            failures.append(check)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    for failure in failures:
+        print(f"CHECK FAILED {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+# End-to-end load test: drives the HTTP handlers of both Cloud Functions in-process
+# against a synthetic corpus, with fakes standing in for Vertex AI and GCS.
+#
+#   python -m benchmarks.load                                  # 100k chunks, 8 concurrent requests
+#   python -m benchmarks.load --chunks 1000000 --concurrency 32 --requests 500
+#   python -m benchmarks.load --targets input --llm-latency 1.5 --llm-jitter 0.5 --json results.json
+#
+# Targets: input (process_input), query (process_query) and pdf (process_pdf_query).
+# For each target it reports the first (cold) request, throughput and p50/p95/p99
+# latency at fixed concurrency, the busiest stages from the tracing histograms and
+# the process's peak RSS. The corpus is generated with benchmarks.synthetic in a
+# subprocess the first time, so generation does not count towards peak RSS.
+#
+# Needs the functions' own requirements (functions-framework, flask) installed;
+# Google services are never contacted.
+import argparse
+import importlib.util
+import json
+import os
+import resource
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+
+from benchmarks import CODEFILES_DIR, NXS_FUNCTION_DIR, PDF_FUNCTION_DIR
+from benchmarks.fakes import FakeRequest, configure_environment, install_fakes
+
+TARGETS = {
+    "input": ("nxs_main", "process_input"),
+    "query": ("nxs_main", "process_query"),
+    "pdf": ("pdf_main", "process_pdf_query"),
+}
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def current_rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except OSError:
+        return None
+
+
+def load_function(directory, name):
+    # Both entry modules are called main.py; load each under its own module name.
+    # Their shared modules are identical, so both resolve to one set of singletons.
+    if directory not in sys.path:
+        sys.path.append(directory)
+    spec = importlib.util.spec_from_file_location(name, os.path.join(directory, "main.py"))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def ensure_corpus(args):
+    if os.path.exists(os.path.join(args.corpus, "registry.json")):
+        return
+    print(f"Generating {args.chunks} chunk corpus in {args.corpus}")
+    command = [sys.executable, "-m", "benchmarks.synthetic", args.corpus, "--chunks", str(args.chunks),
+               "--chunks-per-document", str(args.chunks_per_document)]
+    if args.mode == "dense":
+        command.append("--no-lexical")
+    subprocess.run(command, cwd=CODEFILES_DIR, check=True)
+
+
+def call(handler, query):
+    started = time.perf_counter()
+    body, status, _ = handler(FakeRequest({"input": query}))
+    return (time.perf_counter() - started) * 1000, status
+
+
+def drive(handler, queries, requests, concurrency):
+    # Fixed concurrency: each worker issues its next request as soon as the last returns
+    latencies = np.zeros(requests)
+    statuses = [None] * requests
+    next_request = [0]
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            with lock:
+                i = next_request[0]
+                next_request[0] += 1
+            if i >= requests:
+                return
+            latencies[i], statuses[i] = call(handler, queries[i % len(queries)])
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, statuses, time.perf_counter() - started
+
+
+def run_target(name, handler, queries, args, model, histogram_snapshot, reset_histograms):
+    calls_before = model.calls
+    cold_ms, cold_status = call(handler, queries[0])
+    for query in queries[1:1 + args.warmup]:
+        call(handler, query)
+    reset_histograms()
+    llm_calls = model.calls
+
+    latencies, statuses, seconds = drive(handler, queries[1 + args.warmup:] or queries, args.requests,
+                                         args.concurrency)
+    stages = histogram_snapshot()
+    stages.pop(TARGETS[name][1], None)
+    return {
+        "target": name,
+        "cold_request_ms": round(cold_ms, 1),
+        "cold_status": cold_status,
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "errors": sum(status != 200 for status in statuses),
+        "throughput_rps": round(args.requests / seconds, 2),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 1),
+        "p95_ms": round(float(np.percentile(latencies, 95)), 1),
+        "p99_ms": round(float(np.percentile(latencies, 99)), 1),
+        "max_ms": round(float(latencies.max()), 1),
+        "llm_calls_per_request": round((model.calls - llm_calls) / args.requests, 2),
+        "warmup_llm_calls": llm_calls - calls_before,
+        "stages": {stage: {"count": h["count"], "p50_ms": h["p50_ms"], "p95_ms": h["p95_ms"]}
+                   for stage, h in stages.items()},
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+def print_result(result):
+    print(f"{result['target']}: cold {result['cold_request_ms']} ms, {result['throughput_rps']} req/s at "
+          f"concurrency {result['concurrency']}, p50 {result['p50_ms']} / p95 {result['p95_ms']} / "
+          f"p99 {result['p99_ms']} ms, {result['errors']} errors, peak RSS {result['peak_rss_mb']} MB")
+    busiest = sorted(result["stages"].items(), key=lambda item: -item[1]["count"] * item[1]["p50_ms"])
+    for stage, h in busiest:
+        print(f"    {stage:<12} n={h['count']:<6} p50<={h['p50_ms']} ms  p95<={h['p95_ms']} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="In-process load test of the Cloud Functions with local fakes")
+    parser.add_argument("--corpus", default="/tmp/nxs_bench", help="synthetic corpus directory (generated if missing)")
+    parser.add_argument("--chunks", type=int, default=100000, help="corpus size when generating")
+    parser.add_argument("--chunks-per-document", type=int, default=50000)
+    parser.add_argument("--targets", default="input,pdf", help="comma-separated: input, query, pdf")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--llm-latency", type=float, default=0.8, help="seconds per fake Gemini call")
+    parser.add_argument("--llm-jitter", type=float, default=0.2)
+    parser.add_argument("--llm-failure-rate", type=float, default=0.0)
+    parser.add_argument("--llm-throttle-rate", type=float, default=0.0, help="share of calls answered with a 429")
+    parser.add_argument("--llm-capacity", type=int, default=None,
+                        help="fake Gemini quota: calls in flight beyond this are rejected with a 429")
+    parser.add_argument("--embed-latency", type=float, default=0.05, help="seconds per fake embedding call")
+    parser.add_argument("--summary-cache", action="store_true", help="keep the in-memory summary cache on")
+    parser.add_argument("--response-cache", action="store_true", help="keep the response cache on")
+    parser.add_argument("--distinct-queries", type=int, default=None,
+                        help="cycle through only this many queries (repeats hit the caches)")
+    parser.add_argument("--mode", choices=("dense", "hybrid", "prefilter"), default="hybrid")
+    parser.add_argument("--max-loaded-mb", type=float, default=None, help="CORPUS_MAX_LOADED_MB for the run")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    ensure_corpus(args)
+    overrides = {
+        "CORPUS_REGISTRY": os.path.join(args.corpus, "registry.json"),
+        "STORE_CACHE_DIR": os.path.join(args.corpus, "store_cache"),
+        "RETRIEVAL_MODE": args.mode,
+    }
+    if args.max_loaded_mb is not None:
+        overrides["CORPUS_MAX_LOADED_MB"] = args.max_loaded_mb
+    configure_environment(**overrides)
+
+    from tracing import histogram_snapshot, reset_histograms
+
+    rss_before = current_rss_mb()
+    started = time.perf_counter()
+    try:
+        modules = {"nxs_main": load_function(NXS_FUNCTION_DIR, "nxs_main"),
+                   "pdf_main": load_function(PDF_FUNCTION_DIR, "pdf_main")}
+    except ImportError as e:
+        sys.exit(f"Cannot import the functions ({e}); install their requirements.txt first")
+    import_ms = (time.perf_counter() - started) * 1000
+    model = install_fakes(os.path.join(args.corpus, "gcs"), args.llm_latency, args.llm_jitter, args.llm_failure_rate,
+                          args.embed_latency, args.summary_cache, args.response_cache,
+                          throttle_rate=args.llm_throttle_rate, capacity=args.llm_capacity)
+
+    with open(os.path.join(args.corpus, "queries.json")) as f:
+        queries = json.load(f)[:args.distinct_queries]
+    print(f"Imported both functions in {import_ms:.0f} ms")
+
+    results = []
+    for name in args.targets.split(","):
+        module_name, handler_name = TARGETS[name]
+        result = run_target(name, getattr(modules[module_name], handler_name), queries, args, model,
+                            histogram_snapshot, reset_histograms)
+        print_result(result)
+        results.append(result)
+
+    from corpus import get_corpus
+    from llm import get_llm_client
+    corpus = get_corpus()
+    summary = {
+        "corpus": args.corpus,
+        "documents": len(corpus.documents),
+        "loaded_mb": round(corpus.loaded_bytes / 2 ** 20, 1),
+        "import_ms": round(import_ms, 1),
+        "rss_before_mb": rss_before and round(rss_before, 1),
+        "rss_after_mb": current_rss_mb() and round(current_rss_mb(), 1),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "llm": get_llm_client().stats(),
+        "results": results,
+    }
+    print(f"{summary['documents']} documents, {summary['loaded_mb']} MB loaded, "
+          f"RSS {summary['rss_before_mb']} -> {summary['rss_after_mb']} MB (peak {summary['peak_rss_mb']} MB)")
+    print(f"LLM layer: {summary['llm']}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+# Checks lexical.preprocess_text against the original implementation and times both.
+#
+#   python -m benchmarks.preprocess_text             # equivalence check + micro-benchmark
+#   python -m benchmarks.preprocess_text --cases 200000
+#
+# Exits non-zero if any input produces different output.
+import argparse
+import random
+import re
+import sys
+import timeit
+import unicodedata
+
+from lexical import preprocess_text
+
+
+def reference_preprocess_text(text):
+    # The original pdf_search/main.py implementation, kept verbatim as the oracle
+    text = unicodedata.normalize('NFKD', text)
+    text = re.sub(r'[\n\t]', ' ', text)
+    text = re.sub(r'\\[a-zA-Z]', '', text)
+    text = re.sub(r'\s+', ' ', text)
+    text = ''.join(char for char in text if unicodedata.category(char)[0] != 'C')
+    return text.strip()
+
+
+# Inputs aimed at the places the two implementations could diverge: escape
+# removal joining whitespace runs, control characters between spaces, Unicode
+# whitespace that is also category C, and compatibility forms NFKD rewrites.
+EDGE_CASES = [
+    "", " ", "\n\t", "plain text", "  leading and trailing  ",
+    "a\\nb", "a \\n b", "a\\\\nb", "\\\\\\n", "\\", "ends with \\", "\\x\\y\\z",
+    "a \x00 b", "\x00a\x00", " \x00 ", "a\x85b", "a\x1cb\x1fc", "a\r\nb", "a\x0b\x0cb",
+    "zero\u200bwidth", "bom\ufeff", "\u2028line\u2029para", "nbsp\xa0here", "ideographic\u3000space",
+    "ligature \ufb01le", "full\uff37idth", "e\u0301", "\u00bd fraction", "private\ue000use",
+    "unassigned\U000e0080", "tab\t\\t\tmix", "\\n\n\\t\t", "a \\n\x00 \\t b",
+]
+
+ALPHABET = (
+    list("abcXYZ019 .,-_") + ["\\"] * 4 + list("ntNT") + ["\n", "\t", "\r", "\x0b", "\x0c", "\x85"]
+    + ["\x00", "\x07", "\x1c", "\x1f", "\x7f", "\u200b", "\u200e", "\ufeff", "\ue000"]
+    + ["\xa0", "\u2003", "\u3000", "\u2028", "\u2029"]
+    + ["\ufb01", "\uff37", "\u00bd", "\u0301", "\u00e9", "\u212b", "\u2460", "\U0001d400", "\U000e0080"]
+)
+
+
+def random_cases(n, seed=0):
+    rng = random.Random(seed)
+    for _ in range(n):
+        yield "".join(rng.choice(ALPHABET) for _ in range(rng.randint(0, 40)))
+
+
+def pdf_like_chunk(rng, words=120):
+    vocabulary = ["gradient", "descent", "kernel", "SVM", "margin", "f\ufb01t", "na\u00efve", "Bayes",
+                  "\u03b8", "x\u00b2", "\\alpha", "\\beta", "p(y|x)", "2.5%", "\u2212", "\u00d7"]
+    parts = []
+    for _ in range(words):
+        parts.append(rng.choice(vocabulary))
+        parts.append(rng.choice([" ", " ", " ", "\n", "  ", "\t", " \x0c"]))
+    return "".join(parts)
+
+
+def check(cases):
+    failures = 0
+    for text in cases:
+        expected = reference_preprocess_text(text)
+        actual = preprocess_text(text)
+        if expected != actual:
+            failures += 1
+            if failures <= 10:
+                print(f"MISMATCH {text!r}: expected {expected!r}, got {actual!r}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Equivalence check and micro-benchmark for preprocess_text")
+    parser.add_argument("--cases", type=int, default=50000, help="random inputs for the equivalence check")
+    parser.add_argument("--chunks", type=int, default=2000, help="PDF-like chunks for the benchmark")
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    chunks = [pdf_like_chunk(rng) for _ in range(args.chunks)]
+    failures = check(EDGE_CASES) + check(random_cases(args.cases)) + check(chunks)
+    print(f"equivalence: {len(EDGE_CASES) + args.cases + len(chunks)} inputs, {failures} mismatches")
+
+    for name, function in (("reference", reference_preprocess_text), ("fast", preprocess_text)):
+        seconds = min(timeit.repeat(lambda: [function(chunk) for chunk in chunks], number=1, repeat=5))
+        print(f"{name:<10} {seconds * 1e6 / len(chunks):8.1f} us/chunk")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+# Memory, load time, query latency and recall of the quantized vector indexes
+# against exact cosine search.
+#
+#   python -m benchmarks.quantization                       # synthetic 20k x 768 corpus
+#   python -m benchmarks.quantization --embeddings transcription_embeddings.json
+#   python -m benchmarks.quantization --embeddings out/cornellLecture.manifest.json
+#
+# Rows compared:
+#   json-lists   the original path: json.loads into float64 lists, cosine per row
+#   flat         current retrieve()/retrieve_pdf_snippets(): float32 matrix, one product
+#   flat-f16     float16 store, memory-mapped
+#   sq8 / pq     quantized codes with exact re-rank against the memory-mapped store
+#   sq8-0 / pq-0 codes only (rerank=0)
+# The last line states the sq8 trade-off: its scan converts uint8 codes to float32
+# block by block, so it is about as fast as a float32 flat scan (not faster) and
+# much faster than a float16 store's, at a quarter of the float32 memory.
+import argparse
+import io
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from vector_index import FlatIndex, build_index, load_index, normalize_rows, recall_at_k, save_index
+
+
+def synthetic_corpus(rows, dim, clusters=200, seed=0):
+    # Clustered vectors, closer to real embeddings than isotropic noise
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim), dtype=np.float32)
+    matrix = centers[rng.integers(0, clusters, rows)] + 0.5 * rng.standard_normal((rows, dim), dtype=np.float32)
+    return normalize_rows(matrix)
+
+
+def load_embeddings(path):
+    if path.endswith('.manifest.json'):
+        return normalize_rows(np.load(path[:-len('.manifest.json')] + '.embeddings.npy'))
+    if path.endswith('.npy'):
+        return normalize_rows(np.load(path))
+    with open(path) as f:
+        return normalize_rows([item['embeddings'] for item in json.load(f)])
+
+
+def make_queries(matrix, n, seed=1):
+    rng = np.random.default_rng(seed)
+    picks = matrix[rng.choice(len(matrix), n, replace=False)]
+    queries = picks + 0.3 * rng.standard_normal(picks.shape, dtype=np.float32) / np.sqrt(matrix.shape[1])
+    return normalize_rows(queries)
+
+
+def latencies_ms(search, queries, k):
+    timings = []
+    for query in queries:
+        started = time.perf_counter()
+        search(query, k)
+        timings.append((time.perf_counter() - started) * 1000)
+    return np.percentile(timings, 50), np.percentile(timings, 95)
+
+
+def recall(found_ids, exact_ids):
+    return np.mean([len(set(found) & set(exact)) / len(exact) for found, exact in zip(found_ids, exact_ids)])
+
+
+class JsonListBaseline:
+    # The pre-corpus retrieval: every embedding a Python list, cosine computed per row
+    def __init__(self, raw):
+        self.embeddings = [np.array(item['embeddings']) for item in json.loads(raw)]
+
+    def search(self, query, k):
+        query_norm = np.linalg.norm(query)
+        scores = [np.dot(query, e) / (query_norm * np.linalg.norm(e)) for e in self.embeddings]
+        return sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)[:k]
+
+    def nbytes(self):
+        # ndarray payload plus per-object overhead (~112 bytes each)
+        return sum(e.nbytes + 112 for e in self.embeddings)
+
+
+def report(name, nbytes, load_seconds, latency, recall_value, results=None):
+    print(f"{name:<11} {nbytes / 2 ** 20:>10.1f} {load_seconds:>9.3f} {latency[0]:>8.2f} {latency[1]:>8.2f} "
+          f"{recall_value:>8.3f}")
+    if results is not None:
+        results[name] = {"memory_mb": nbytes / 2 ** 20, "p50_ms": latency[0]}
+
+
+def trade_off(results):
+    sq8, flat, flat16 = results["sq8"], results["flat"], results["flat-f16"]
+    return (f"sq8 trade-off: {flat['memory_mb'] / sq8['memory_mb']:.1f}x less memory than flat; p50 "
+            f"{sq8['p50_ms']:.2f} ms vs {flat['p50_ms']:.2f} ms flat (speedup {flat['p50_ms'] / sq8['p50_ms']:.2f}x) "
+            f"and {flat16['p50_ms']:.2f} ms flat-f16 (speedup {flat16['p50_ms'] / sq8['p50_ms']:.2f}x)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark quantized vector indexes against exact cosine")
+    parser.add_argument("--embeddings", help="JSON embeddings blob, .npy matrix or store manifest")
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--rerank", type=int, default=100)
+    parser.add_argument("--pq-m", type=int, default=None, help="PQ sub-vectors (default: largest of 96/64/... dividing dim)")
+    parser.add_argument("--skip-json", action="store_true", help="skip the slow json-lists baseline")
+    args = parser.parse_args()
+
+    matrix = load_embeddings(args.embeddings) if args.embeddings else synthetic_corpus(args.rows, args.dim)
+    queries = make_queries(matrix, min(args.queries, len(matrix)))
+    exact = FlatIndex(matrix)
+    exact_ids = [exact.search(query, args.k)[1].tolist() for query in queries]
+    print(f"corpus: {matrix.shape[0]} x {matrix.shape[1]}, {len(queries)} queries, k={args.k}")
+    print(f"{'index':<11} {'memory_MB':>10} {'load_s':>9} {'p50_ms':>8} {'p95_ms':>8} {'recall':>8}")
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        if not args.skip_json:
+            raw = json.dumps([{"embeddings": row} for row in matrix.astype(np.float64).tolist()])
+            started = time.perf_counter()
+            baseline = JsonListBaseline(raw)
+            load_seconds = time.perf_counter() - started
+            found = [baseline.search(query, args.k) for query in queries[:20]]
+            report("json-lists", baseline.nbytes(), load_seconds, latencies_ms(baseline.search, queries[:20], args.k),
+                   recall(found, exact_ids[:20]))
+            del raw, baseline
+
+        stores = {}
+        for dtype in ("float32", "float16"):
+            path = os.path.join(tmp, f"{dtype}.npy")
+            np.save(path, matrix.astype(dtype))
+            stores[dtype] = path
+
+        started = time.perf_counter()
+        flat = FlatIndex(np.load(stores["float32"]))
+        report("flat", flat.nbytes(), time.perf_counter() - started, latencies_ms(flat.search, queries, args.k), 1.0,
+               results)
+
+        started = time.perf_counter()
+        flat16 = FlatIndex(np.load(stores["float16"], mmap_mode='r'))
+        report("flat-f16", flat16.nbytes(), time.perf_counter() - started, latencies_ms(flat16.search, queries, args.k),
+               recall_at_k(flat16, queries, args.k, matrix), results)
+
+        for kind, params in (("sq8", {}), ("pq", {"m": args.pq_m} if args.pq_m else {})):
+            started = time.perf_counter()
+            built = build_index(matrix, kind, rerank=args.rerank, **params)
+            print(f"  ({kind} build {time.perf_counter() - started:.1f}s)")
+            for rerank in (args.rerank, 0):
+                buffer = io.BytesIO()
+                save_index(type(built).from_arrays(matrix, built.arrays(), dict(built.params(), rerank=rerank)), buffer)
+                started = time.perf_counter()
+                index = load_index(buffer.getvalue(), np.load(stores["float16"], mmap_mode='r'))
+                load_seconds = time.perf_counter() - started
+                name = kind if rerank else f"{kind}-0"
+                report(name, index.nbytes(), load_seconds, latencies_ms(index.search, queries, args.k),
+                       recall_at_k(index, queries, args.k, matrix), results)
+    print(trade_off(results))
+
+
+if __name__ == "__main__":
+    main()
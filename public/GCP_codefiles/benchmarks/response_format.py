@@ -0,0 +1,197 @@
+# Payload size and encode/decode time of the process_pdf_query response in the
+# formats response_format.py offers, against the old json.dumps of everything.
+#
+#   python -m benchmarks.response_format
+#   python -m benchmarks.response_format --results 100 --corpus /tmp/nxs_bench --json format.json
+#
+# The response is built like process_pdf_query's: 20 results of 120-word chunks
+# with float64 similarities and PDF coordinates, and a V4-length signed URL on each.
+# Checks (exit non-zero on failure): the fast encoder's output decodes to the same
+# value as json.dumps; following next_cursor visits every result once, in order;
+# compressed bodies decompress to the uncompressed one. With --corpus, real
+# pdf_results answers are paged with fields id+page_number+coordinates and the
+# texts fetched by id must equal the full response's.
+import argparse
+import gzip
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from benchmarks.fakes import FakeRequest, configure_environment
+
+WORDS = ("model", "training", "data", "learning", "the", "of", "a", "function", "loss", "gradient", "network",
+         "input", "output", "layer", "is", "to", "and", "we", "parameters", "examples", "features", "error")
+
+
+def signed_url(document_id, rng):
+    signature = "".join(rng.choice(list("0123456789abcdef"), 512))
+    return (f"https://storage.googleapis.com/nxs_bucket1/{document_id}.pdf?X-Goog-Algorithm=GOOG4-RSA-SHA256"
+            f"&X-Goog-Credential=nxs-service%40nexus-ai.iam.gserviceaccount.com%2F20261018%2Fauto%2Fstorage"
+            f"%2Fgoog4_request&X-Goog-Date=20261018T120000Z&X-Goog-Expires=900&X-Goog-SignedHeaders=host"
+            f"&X-Goog-Signature={signature}")
+
+
+def make_response(results, rng):
+    url = signed_url("pdf-0000", rng)
+    return {
+        "query": "how does gradient descent minimize the loss",
+        "relation_summary": " ".join(rng.choice(WORDS, 70)),
+        "results": [
+            {
+                "id": f"pdf-0000:{int(row)}",
+                "text": " ".join(rng.choice(WORDS, 120)),
+                "page_number": int(row // 6),
+                "coordinates": (rng.random(4) * 600).tolist(),
+                "similarity": float(0.8 - i * 0.01 + rng.random() * 1e-3),
+                "document_id": "pdf-0000",
+                "pdf_url": url,
+            }
+            for i, row in enumerate(rng.choice(2000, results, replace=False))
+        ],
+        "pdf_url": url,
+    }
+
+
+def timed(fn, repeats):
+    started = time.perf_counter()
+    for _ in range(repeats):
+        value = fn()
+    return value, (time.perf_counter() - started) * 1000 / repeats
+
+
+def shaped(response, request_json):
+    from response_format import shape_results
+    return shape_results(dict(response), request_json, response["query"], {}, tuple(response["results"][0]))
+
+
+def variants(response, args):
+    # name -> (request body, Accept-Encoding)
+    compact = {"fields": ["id", "page_number", "coordinates"], "limit": args.page_size}
+    return {
+        "full": ({}, ""),
+        "full gzip": ({}, "gzip"),
+        "full br": ({}, "br"),
+        f"page of {args.page_size}": ({"limit": args.page_size}, ""),
+        "ids+page+bbox": ({"fields": compact["fields"]}, ""),
+        f"ids+page+bbox, page of {args.page_size}": (compact, ""),
+        f"ids+page+bbox, page of {args.page_size}, gzip": (compact, "gzip"),
+    }
+
+
+def measure(response, args):
+    from response_format import brotli, json_response, orjson
+
+    rows = []
+    old, old_ms = timed(lambda: json.dumps(response).encode('utf-8'), args.repeats)
+    _, old_decode_ms = timed(lambda: json.loads(old), args.repeats)
+    rows.append({"format": "json.dumps (before)", "bytes": len(old), "encode_ms": old_ms, "decode_ms": old_decode_ms})
+    for name, (request_json, accept) in variants(response, args).items():
+        if accept == "br" and brotli is None:
+            continue
+        request = FakeRequest(request_json, headers={"Accept-Encoding": accept} if accept else {})
+        (body, _, headers), encode_ms = timed(lambda: json_response(shaped(response, request_json), 200, {}, request),
+                                              args.repeats)
+        encoding = headers.get("Content-Encoding")
+        decode = {"gzip": gzip.decompress, "br": brotli and brotli.decompress}.get(encoding, lambda data: data)
+        _, decode_ms = timed(lambda: json.loads(decode(body)), args.repeats)
+        rows.append({"format": name, "bytes": len(body), "encode_ms": encode_ms, "decode_ms": decode_ms,
+                     "encoding": encoding})
+    encoder = "orjson" if orjson is not None else "json"
+    return rows, encoder
+
+
+def check_encoding(response):
+    from response_format import dumps, json_response
+    failures = []
+    if json.loads(dumps(response)) != json.loads(json.dumps(response)):
+        failures.append("fast encoder output differs from json.dumps")
+    plain = json_response(response, 200, {}, FakeRequest({}))[0]
+    zipped, _, headers = json_response(response, 200, {}, FakeRequest({}, headers={"Accept-Encoding": "gzip, br"}))
+    if headers.get("Content-Encoding") == "gzip" and gzip.decompress(zipped) != plain:
+        failures.append("gzip body does not decompress to the plain body")
+    if headers.get("Content-Encoding") == "br":
+        from response_format import brotli
+        if brotli.decompress(zipped) != plain:
+            failures.append("brotli body does not decompress to the plain body")
+    return failures
+
+
+def walk_pages(response, request_json):
+    # Every page from the first, following next_cursor; returns the results seen
+    seen = []
+    page = shaped(response, request_json)
+    while True:
+        seen += page["results"]
+        cursor = page["page"]["next_cursor"]
+        if cursor is None:
+            return seen
+        page = shaped(response, dict(request_json, cursor=cursor, limit=None, offset=None))
+
+
+def check_pagination(response, page_size):
+    from response_format import round_result
+    expected = [round_result(result) for result in response["results"]]
+    if walk_pages(response, {"limit": page_size}) != expected:
+        return ["following next_cursor does not visit every result once, in order"]
+    return []
+
+
+def check_corpus(args):
+    from benchmarks.fakes import install_fakes
+    from pdf_search import fetch_pdf_chunks, format_pdf_results, pdf_results
+
+    install_fakes(os.path.join(args.corpus, "gcs"), llm_latency=0.0, llm_jitter=0.0, response_cache=True)
+    with open(os.path.join(args.corpus, "queries.json")) as f:
+        queries = json.load(f)[:args.queries]
+    failures = []
+    for query in queries:
+        snippets, summary = pdf_results(query)
+        full = {"query": query, "relation_summary": summary, "results": format_pdf_results(snippets)}
+        compact = walk_pages(full, {"fields": ["id", "page_number", "coordinates"], "limit": args.page_size})
+        fetched = fetch_pdf_chunks([result["id"] for result in compact])
+        if [chunk["text"] for chunk in fetched] != [result["text"] for result in full["results"]]:
+            failures.append("texts fetched by id differ from the full response")
+            break
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Response payload size and serialization time")
+    parser.add_argument("--results", type=int, default=20, help="results in the response")
+    parser.add_argument("--page-size", type=int, default=5)
+    parser.add_argument("--repeats", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--corpus", help="benchmarks.synthetic directory for the fetch-by-id check")
+    parser.add_argument("--queries", type=int, default=20, help="queries for the --corpus check")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    overrides = {}
+    if args.corpus:
+        overrides = {"CORPUS_REGISTRY": os.path.join(args.corpus, "registry.json"),
+                     "STORE_CACHE_DIR": os.path.join(args.corpus, "store_cache")}
+    configure_environment(**overrides)
+
+    response = make_response(args.results, np.random.default_rng(args.seed))
+    rows, encoder = measure(response, args)
+    print(f"process_pdf_query response with {args.results} results (encoder: {encoder}):")
+    for row in rows:
+        print(f"    {row['format']:<36} {row['bytes']:>8} bytes  encode {row['encode_ms']:.3f} ms  "
+              f"decode {row['decode_ms']:.3f} ms")
+
+    failures = check_encoding(response) + check_pagination(response, args.page_size)
+    if args.corpus:
+        failures += check_corpus(args)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({"encoder": encoder, "results": args.results, "formats": rows}, f, indent=2)
+    for failure in failures:
+        print(f"CHECK FAILED {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
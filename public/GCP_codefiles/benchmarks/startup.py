@@ -0,0 +1,98 @@
+# Cold-start import cost of each Cloud Function, measured with `python -X importtime`.
+#
+#   python -m benchmarks.startup                   # both functions, current tree
+#   python -m benchmarks.startup --baseline HEAD~5 # also measure an older commit
+#   python -m benchmarks.startup --top 25
+#
+# Each run imports main.py in a fresh interpreter (prewarm disabled, so only the
+# import itself is timed) and reports the wall time plus the slowest top-level
+# imports. The functions' dependencies must be installed for the import to succeed.
+import argparse
+import io
+import os
+import subprocess
+import sys
+import tarfile
+import tempfile
+
+from benchmarks import CODEFILES_DIR
+
+FUNCTIONS = {
+    "nxs": "gcp_nxs-function",
+    "pdf": "gcp_pdf-retrieval-function",
+}
+
+IMPORT_SNIPPET = (
+    "import time; started = time.perf_counter(); import main; "
+    "print(f'import_seconds={time.perf_counter() - started:.4f}')"
+)
+
+
+def parse_importtime(stderr):
+    # Lines look like "import time:       412 |       1893 |   json"; nesting is the
+    # indentation of the package name. Returns [(cumulative_us, self_us, depth, name)].
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        name = name[1:]
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((int(cumulative_us), int(self_us), depth, name.strip()))
+    return rows
+
+
+def measure(function_dir, repeat):
+    env = dict(os.environ, RUNTIME_PREWARM="0", PYTHONDONTWRITEBYTECODE="1")
+    runs = []
+    for _ in range(repeat):
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", IMPORT_SNIPPET], cwd=function_dir,
+                                env=env, capture_output=True, text=True)
+        if result.returncode != 0:
+            return None, result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "import failed"
+        seconds = float(result.stdout.strip().split("=")[-1])
+        runs.append((seconds, parse_importtime(result.stderr)))
+    # The fastest run is the least disturbed by the rest of the machine
+    return min(runs, key=lambda run: run[0]), None
+
+
+def export_tree(revision, destination):
+    # Extracts the function directories as of `revision` with git archive
+    paths = [os.path.join("public", "GCP_codefiles", directory) for directory in FUNCTIONS.values()]
+    repo_root = subprocess.run(["git", "rev-parse", "--show-toplevel"], cwd=CODEFILES_DIR, capture_output=True,
+                               text=True, check=True).stdout.strip()
+    archive = subprocess.run(["git", "archive", "--format=tar", revision, *paths], cwd=repo_root,
+                             capture_output=True, check=True).stdout
+    with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+        tar.extractall(destination)
+    return os.path.join(destination, "public", "GCP_codefiles")
+
+
+def report(label, codefiles_dir, top, repeat):
+    for name, directory in FUNCTIONS.items():
+        run, error = measure(os.path.join(codefiles_dir, directory), repeat)
+        if error:
+            print(f"[{label}] {name}: {error}")
+            continue
+        seconds, rows = run
+        print(f"[{label}] {name}: import main {seconds * 1000:.1f} ms")
+        top_level = sorted((row for row in rows if row[2] == 0), reverse=True)[:top]
+        for cumulative_us, self_us, _, module in top_level:
+            print(f"    {cumulative_us / 1000:8.1f} ms  {module}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure cold-start import time of the Cloud Functions")
+    parser.add_argument("--baseline", help="git revision to measure as well, e.g. HEAD~5")
+    parser.add_argument("--top", type=int, default=15, help="slowest top-level imports to list")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    report("current", CODEFILES_DIR, args.top, args.repeat)
+    if args.baseline:
+        with tempfile.TemporaryDirectory() as tmp:
+            report(args.baseline, export_tree(args.baseline, tmp), args.top, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+# Synthetic corpus for the load benchmark: transcript and PDF shards in the compact
+# store format (embedding_store.py) under a local directory laid out like GCS,
+# plus the registry that points the functions at them.
+#
+#   python -m benchmarks.synthetic /tmp/nxs_bench --chunks 100000
+#   python -m benchmarks.synthetic /tmp/nxs_bench_10m --chunks 10000000 --no-lexical
+#
+# Output:
+#   <out>/gcs/<bucket>/stores/<document id>.*   one store per document
+#   <out>/registry.json                         CORPUS_REGISTRY for the functions
+#   <out>/queries.json                          query strings drawn from the same topics
+#
+# Vectors are clustered around shared topic centers and each chunk's text mixes
+# its topic's words with common ones, so dense and lexical rankings both have
+# structure. A float16 store takes chunks x dim x 2 bytes (10M x 768 is ~15 GB),
+# and the functions copy stores out of the fake bucket into STORE_CACHE_DIR.
+import argparse
+import importlib.util
+import json
+import logging
+import os
+import time
+
+import numpy as np
+
+from embedding_store import write_store
+from lexical import BM25Index
+from vector_index import normalize_rows
+
+BUCKET_NAME = "nxs_bench"
+SYLLABLES = ("ka", "lo", "mi", "ne", "ru", "ta", "vo", "zi", "pe", "su", "do", "ga", "hi", "ba", "fe", "ro")
+SECONDS_PER_SNIPPET = 5
+
+logging.basicConfig(level=logging.INFO)
+
+
+def make_vocabulary(size, rng):
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(SYLLABLES, rng.integers(2, 5))))
+    return np.array(sorted(words))
+
+
+def chunk_texts(labels, topic_words, common_words, rng, topic_count=10, common_count=30):
+    topic = topic_words[labels[:, None], rng.integers(0, topic_words.shape[1], (len(labels), topic_count))]
+    common = common_words[rng.integers(0, len(common_words), (len(labels), common_count))]
+    return [" ".join(words) for words in np.concatenate([topic, common], axis=1).tolist()]
+
+
+def clock(seconds):
+    return f"{seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+def document_columns(kind, texts):
+    rows = len(texts)
+    if kind == "video":
+        starts = np.arange(rows, dtype=np.int64) * SECONDS_PER_SNIPPET
+        return {
+            "transcript": texts,
+            "start_time": [clock(int(s)) for s in starts],
+            "end_time": [clock(int(s) + SECONDS_PER_SNIPPET) for s in starts],
+            "start_seconds": starts.tolist(),
+            "end_seconds": (starts + SECONDS_PER_SNIPPET).tolist(),
+        }
+    return {
+        "chunk": texts,
+        "page": (np.arange(rows) // 8).tolist(),
+        "coordinates": [[72.0, 72.0 + 80 * (i % 8), 540.0, 140.0 + 80 * (i % 8)] for i in range(rows)],
+    }
+
+
+def generate_corpus(out, chunks, dim=768, chunks_per_document=50000, pdf_fraction=0.5, courses=4, clusters=256,
+                    dtype='float16', lexical=True, queries=200, seed=0, bucket=BUCKET_NAME):
+    rng = np.random.default_rng(seed)
+    vocabulary = make_vocabulary(4000, rng)
+    common_words = vocabulary[:1000]
+    topic_words = rng.choice(vocabulary[1000:], (clusters, 12))
+    centers = rng.standard_normal((clusters, dim), dtype=np.float32)
+
+    pdf_chunks = int(chunks * pdf_fraction)
+    plan = [("video", chunks - pdf_chunks), ("pdf", pdf_chunks)]
+    registry = []
+    for kind, total in plan:
+        for number, start in enumerate(range(0, total, chunks_per_document)):
+            rows = min(chunks_per_document, total - start)
+            document_id = f"{kind}-{number:04d}"
+            started = time.perf_counter()
+            labels = rng.integers(0, clusters, rows)
+            matrix = centers[labels] + 0.5 * rng.standard_normal((rows, dim), dtype=np.float32)
+            texts = chunk_texts(labels, topic_words, common_words, rng)
+            prefix = os.path.join(out, "gcs", bucket, "stores", document_id)
+            # Parquet metadata loads faster at these sizes; the benchmarks read it in this same environment
+            meta_format = "parquet" if importlib.util.find_spec("pyarrow") else "json"
+            write_store(prefix, normalize_rows(matrix), document_columns(kind, texts), kind, dtype, meta_format,
+                        model="synthetic", task="RETRIEVAL_DOCUMENT", source="benchmarks.synthetic",
+                        text_normalized=kind == "pdf")
+            if lexical:
+                with open(f"{prefix}.bm25.npz", 'wb') as f:
+                    BM25Index.build(texts).save(f)
+            registry.append({
+                "id": document_id,
+                "type": kind,
+                "course": f"course-{number % courses}",
+                "bucket": bucket,
+                "media_blob": f"media/{document_id}.{'mp4' if kind == 'video' else 'pdf'}",
+                "store_blob": f"stores/{document_id}",
+            })
+            logging.info(f"Wrote {document_id}: {rows} x {dim} in {time.perf_counter() - started:.1f}s")
+
+    query_labels = rng.integers(0, clusters, queries)
+    query_texts = [" ".join(words) for words in np.concatenate([
+        topic_words[query_labels[:, None], rng.integers(0, topic_words.shape[1], (queries, 3))],
+        common_words[rng.integers(0, len(common_words), (queries, 3))],
+    ], axis=1).tolist()]
+
+    with open(os.path.join(out, "registry.json"), 'w') as f:
+        json.dump({"documents": registry}, f, indent=2)
+    with open(os.path.join(out, "queries.json"), 'w') as f:
+        json.dump(query_texts, f, indent=2)
+    return registry
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic corpus for the load benchmark")
+    parser.add_argument("out", help="output directory")
+    parser.add_argument("--chunks", type=int, default=100000, help="total chunks across all documents")
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--chunks-per-document", type=int, default=50000)
+    parser.add_argument("--pdf-fraction", type=float, default=0.5, help="share of chunks that are PDF chunks")
+    parser.add_argument("--courses", type=int, default=4)
+    parser.add_argument("--clusters", type=int, default=256, help="topics the vectors and texts are drawn from")
+    parser.add_argument("--dtype", choices=("float16", "float32"), default="float16")
+    parser.add_argument("--no-lexical", action="store_true", help="skip the BM25 index (run with RETRIEVAL_MODE=dense)")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    registry = generate_corpus(args.out, args.chunks, args.dim, args.chunks_per_document, args.pdf_fraction,
+                               args.courses, args.clusters, args.dtype, not args.no_lexical, args.queries, args.seed)
+    logging.info(f"Generated {len(registry)} documents in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
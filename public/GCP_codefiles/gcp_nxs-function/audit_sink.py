@@ -0,0 +1,120 @@
+import json
+import logging
+import os
+import queue
+import threading
+import uuid
+
+from gcs import get_bucket
+
+# Where request artifacts (retrieved segments, final output) are persisted:
+# "" disables auditing, "local" writes under AUDIT_DIR, "queue" keeps them in an
+# in-process queue (stand-in for Pub/Sub), "gcs" uploads under AUDIT_PREFIX.
+AUDIT_SINK = os.environ.get('AUDIT_SINK', '')
+AUDIT_DIR = os.environ.get('AUDIT_DIR', '/tmp/nxs_audit')
+AUDIT_BUCKET = os.environ.get('AUDIT_BUCKET', 'nxs_bucket1')
+AUDIT_PREFIX = os.environ.get('AUDIT_PREFIX', 'audit/')
+AUDIT_QUEUE_SIZE = int(os.environ.get('AUDIT_QUEUE_SIZE', '256'))
+
+
+def new_request_id():
+    return uuid.uuid4().hex
+
+
+class LocalFileSink:
+    def __init__(self, directory=AUDIT_DIR):
+        self.directory = directory
+
+    def write(self, request_id, name, data):
+        path = os.path.join(self.directory, request_id)
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, f"{name}.json"), 'w') as f:
+            json.dump(data, f)
+
+
+class QueueSink:
+    def __init__(self, maxsize=0):
+        self.queue = queue.Queue(maxsize)
+
+    def write(self, request_id, name, data):
+        self.queue.put_nowait({"request_id": request_id, "name": name, "data": data})
+
+
+class GCSSink:
+    def __init__(self, bucket_name=AUDIT_BUCKET, prefix=AUDIT_PREFIX, credentials=None):
+        self.bucket_name = bucket_name
+        self.prefix = prefix
+        self.credentials = credentials
+
+    def write(self, request_id, name, data):
+        blob = get_bucket(self.bucket_name, self.credentials).blob(f"{self.prefix}{request_id}/{name}.json")
+        blob.upload_from_string(json.dumps(data), content_type='application/json')
+
+
+class AsyncAuditor:
+    # Hands artifacts to a background thread; record() never blocks the request
+    # and drops artifacts when the backlog is full.
+    def __init__(self, sink, maxsize=AUDIT_QUEUE_SIZE):
+        self.sink = sink
+        self.dropped = 0
+        self._pending = queue.Queue(maxsize)
+        self._worker = threading.Thread(target=self._drain, name="audit-sink", daemon=True)
+        self._worker.start()
+
+    def record(self, request_id, name, data):
+        try:
+            self._pending.put_nowait((request_id, name, data))
+        except queue.Full:
+            self.dropped += 1
+            logging.warning(f"Audit backlog full, dropped {name} for request {request_id}")
+
+    def flush(self, timeout=None):
+        with self._pending.all_tasks_done:
+            self._pending.all_tasks_done.wait_for(lambda: self._pending.unfinished_tasks == 0, timeout)
+
+    def _drain(self):
+        while True:
+            request_id, name, data = self._pending.get()
+            try:
+                self.sink.write(request_id, name, data)
+            except Exception as e:
+                logging.error(f"Audit write failed for {request_id}/{name}: {e}")
+            finally:
+                self._pending.task_done()
+
+
+class NullAuditor:
+    def record(self, request_id, name, data):
+        pass
+
+    def flush(self, timeout=None):
+        pass
+
+
+_auditor = None
+_auditor_lock = threading.Lock()
+
+
+def make_sink(kind, credentials=None):
+    if kind == 'local':
+        return LocalFileSink()
+    if kind == 'queue':
+        return QueueSink()
+    if kind == 'gcs':
+        return GCSSink(credentials=credentials)
+    raise ValueError(f"Unknown AUDIT_SINK: {kind}")
+
+
+def get_auditor(credentials=None):
+    global _auditor
+    if _auditor is None:
+        with _auditor_lock:
+            if _auditor is None:
+                _auditor = AsyncAuditor(make_sink(AUDIT_SINK, credentials)) if AUDIT_SINK else NullAuditor()
+    return _auditor
+
+
+def set_auditor(auditor):
+    global _auditor
+    with _auditor_lock:
+        _auditor = auditor
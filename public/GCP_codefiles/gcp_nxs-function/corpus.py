@@ -0,0 +1,454 @@
+# Shared by gcp_nxs-function and gcp_pdf-retrieval-function. Each Cloud Function
+# deploys only its own directory, so keep both copies of this file identical.
+import hashlib
+import heapq
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from embedding_store import fetch_store, read_store, timestamp_seconds
+from gcs import GCSBlobSource, LocalFileSource, get_bucket, signed_url
+from lexical import BM25Index, combine_statistics, preprocess_text, reciprocal_rank_fusion
+from tracing import bind, span
+from vector_index import (HNSW_BUILD_MAX_ROWS, VECTOR_INDEX_TYPE, build_index, load_index, matrix_dot, normalize_query,
+                          normalize_rows)
+
+BUCKET_NAME = "nxs_bucket1"
+# Local path or gs://bucket/blob of the registry JSON; empty uses DEFAULT_DOCUMENTS
+CORPUS_REGISTRY = os.environ.get('CORPUS_REGISTRY', '')
+# Loaded shards are evicted least-recently-used once their total size passes this
+CORPUS_MAX_LOADED_MB = float(os.environ.get('CORPUS_MAX_LOADED_MB', '1024'))
+# Seconds between metadata checks of a loaded shard's source; it is reloaded when the source changes
+CORPUS_REFRESH_SECONDS = float(os.environ.get('CORPUS_REFRESH_SECONDS', '30'))
+CORPUS_SEARCH_WORKERS = int(os.environ.get('CORPUS_SEARCH_WORKERS', '8'))
+# dense: embeddings only; hybrid: dense and BM25 rankings fused by reciprocal rank;
+# prefilter: dense scoring restricted to chunks that share a term with the query
+RETRIEVAL_MODE = os.environ.get('RETRIEVAL_MODE', 'hybrid')
+# Hits taken from each ranking before fusion
+HYBRID_DEPTH = int(os.environ.get('HYBRID_DEPTH', '50'))
+
+DEFAULT_DOCUMENTS = [
+    {
+        "id": "cornellLecture",
+        "type": "video",
+        "course": "default",
+        "bucket": BUCKET_NAME,
+        "media_blob": "cornellLecture.mp4",
+        "embeddings_blob": "transcription_embeddings.json",
+    },
+    {
+        "id": "IntroMLpaper",
+        "type": "pdf",
+        "course": "default",
+        "bucket": BUCKET_NAME,
+        "media_blob": "IntroMLpaper.pdf",
+        "embeddings_blob": "pageCoord_emb_IntroMLpaper.json",
+    },
+]
+
+
+class Document:
+    # `index` picks the vector index backend for this shard (flat/ivf/hnsw) and
+    # `index_params` its build parameters; `index_blob`/`index_path` point at a
+    # prebuilt index saved by vector_index.py so cold instances skip the build
+    # (stores carry theirs as <prefix>.index.npz); hnsw is never built for shards
+    # over HNSW_BUILD_MAX_ROWS rows, which are searched flat without one.
+    # `store_blob`/`store_path` is the prefix of a compact store written by
+    # otherScripts/ingest.py and takes precedence over the JSON embeddings blob.
+    # `lexical_blob`/`lexical_path` is a saved BM25 index (stores carry their own
+    # <prefix>.bm25.npz); without one it is built when the shard loads.
+    def __init__(self, id, type, course=None, bucket=BUCKET_NAME, media_blob=None,
+                 embeddings_blob=None, embeddings_path=None, title=None, index=VECTOR_INDEX_TYPE,
+                 index_params=None, index_blob=None, index_path=None, store_blob=None,
+                 store_path=None, lexical_blob=None, lexical_path=None, **metadata):
+        self.id = id
+        self.type = type
+        self.course = course
+        self.bucket = bucket
+        self.media_blob = media_blob
+        self.embeddings_blob = embeddings_blob
+        self.embeddings_path = embeddings_path
+        self.title = title
+        self.index = index
+        self.index_params = index_params or {}
+        self.index_blob = index_blob
+        self.index_path = index_path
+        self.store_blob = store_blob
+        self.store_path = store_path
+        self.lexical_blob = lexical_blob
+        self.lexical_path = lexical_path
+        self.metadata = metadata
+
+    def source(self, credentials=None):
+        # For compact stores the manifest is rewritten on every ingest, so its
+        # fingerprint stands in for the whole store
+        if self.store_path:
+            return LocalFileSource(f"{self.store_path}.manifest.json")
+        if self.store_blob:
+            return GCSBlobSource(self.bucket, f"{self.store_blob}.manifest.json", credentials)
+        if self.embeddings_path:
+            return LocalFileSource(self.embeddings_path)
+        return GCSBlobSource(self.bucket, self.embeddings_blob, credentials)
+
+    def index_source(self, credentials=None):
+        if self.index_path:
+            return LocalFileSource(self.index_path)
+        if self.index_blob:
+            return GCSBlobSource(self.bucket, self.index_blob, credentials)
+        return None
+
+    def lexical_source(self, credentials=None):
+        if self.lexical_path:
+            return LocalFileSource(self.lexical_path)
+        if self.lexical_blob:
+            return GCSBlobSource(self.bucket, self.lexical_blob, credentials)
+        return None
+
+    def text_key(self):
+        return "transcript" if self.type == "video" else "chunk"
+
+    def __repr__(self):
+        return f"Document({self.id!r}, {self.type!r}, course={self.course!r})"
+
+
+def load_registry(location=CORPUS_REGISTRY, credentials=None):
+    if not location:
+        entries = DEFAULT_DOCUMENTS
+    elif location.startswith('gs://'):
+        bucket_name, blob_name = location[len('gs://'):].split('/', 1)
+        entries = json.loads(get_bucket(bucket_name, credentials).blob(blob_name).download_as_bytes())
+    else:
+        with open(location) as f:
+            entries = json.load(f)
+    if isinstance(entries, dict):
+        entries = entries['documents']
+    return [Document(**entry) for entry in entries]
+
+
+class Shard:
+    # One document's chunks: a vector index over the row-normalized embeddings plus
+    # the chunk records (everything except the embedding) in the same order.
+    # Compact stores pass their memory-mapped matrix with normalized=True so it is
+    # used as-is. Quantized indexes built with rerank=0 keep only their codes.
+    def __init__(self, document, embeddings, records, index_raw=None, normalized=False, lexical_raw=None):
+        self.document = document
+        if normalized:
+            matrix = embeddings
+        else:
+            matrix = normalize_rows(np.asarray(embeddings, dtype=np.float32).reshape(len(records), -1))
+        self.records = records
+        if index_raw:
+            self.index = load_index(index_raw, matrix)
+        elif document.index == 'hnsw' and len(records) > HNSW_BUILD_MAX_ROWS:
+            logging.warning(f"No saved hnsw index for {document.id} ({len(records)} rows), searching it flat; "
+                            f"write one with otherScripts/ingest.py --index hnsw")
+            self.index = build_index(matrix, 'flat')
+        else:
+            self.index = build_index(matrix, document.index, **document.index_params)
+        self.lexical = None
+        if lexical_raw:
+            self.lexical = BM25Index.load(lexical_raw)
+        elif RETRIEVAL_MODE != 'dense':
+            self.lexical = BM25Index.build(self.texts())
+        if isinstance(records, list):
+            self.nbytes = self.index.nbytes() + sum(_record_bytes(record) for record in records)
+        else:
+            self.nbytes = self.index.nbytes() + records.nbytes()
+        if self.lexical is not None:
+            self.nbytes += self.lexical.nbytes()
+
+    def texts(self):
+        key = self.document.text_key()
+        if isinstance(self.records, list):
+            return [record[key] for record in self.records]
+        return self.records.columns[key]
+
+    @classmethod
+    def from_json(cls, document, raw, index_raw=None, lexical_raw=None):
+        items = json.loads(raw)
+        embeddings = [item['embeddings'] for item in items]
+        records = [{key: value for key, value in item.items() if key != 'embeddings'} for item in items]
+        if document.type == 'video':
+            # Parsed once here so grouping never re-parses timestamp strings
+            for record in records:
+                record['start_seconds'] = timestamp_seconds(record['time_stamp']['start_time'])
+                record['end_seconds'] = timestamp_seconds(record['time_stamp']['end_time'])
+        else:
+            # Cleaned once per load instead of on every request that returns the chunk
+            for record in records:
+                record['chunk_text'] = preprocess_text(record['chunk'])
+        return cls(document, embeddings, records, index_raw, lexical_raw=lexical_raw)
+
+    @classmethod
+    def from_store(cls, document, prefix, index_raw=None, lexical_raw=None):
+        matrix, records, manifest = read_store(prefix)
+        if lexical_raw is None and os.path.exists(f"{prefix}.bm25.npz"):
+            with open(f"{prefix}.bm25.npz", 'rb') as f:
+                lexical_raw = f.read()
+        if index_raw is None and os.path.exists(f"{prefix}.index.npz"):
+            with open(f"{prefix}.index.npz", 'rb') as f:
+                index_raw = f.read()
+        return cls(document, matrix, records, index_raw, normalized=True, lexical_raw=lexical_raw)
+
+    def __len__(self):
+        return len(self.records)
+
+    def search(self, query, top_k, candidates=None):
+        # `query` must already be normalized. `candidates` restricts exact scoring
+        # to those rows (needs the float matrix; otherwise the index is searched).
+        matrix = self.index.matrix
+        if candidates is not None and matrix is not None:
+            scores = matrix_dot(matrix[candidates], query)
+            best = np.argsort(-scores, kind="stable")[:top_k]
+            return [(float(scores[i]), int(candidates[i])) for i in best]
+        scores, ids = self.index.search(query, top_k)
+        return [(float(score), int(i)) for score, i in zip(scores, ids)]
+
+    def cosines(self, query, rows):
+        # Scores of just these rows; quantized indexes without a float matrix
+        # approximate them from the rows' codes
+        rows = np.asarray(rows, dtype=np.int64)
+        matrix = self.index.matrix
+        if matrix is None:
+            return self.index.approximate_scores(query, rows)
+        return np.asarray(matrix[rows], dtype=np.float32) @ query
+
+
+def _record_bytes(record):
+    return 64 + sum(len(value) for value in record.values() if isinstance(value, str))
+
+
+class ShardedIndex:
+    def __init__(self, documents, credentials=None, max_loaded_bytes=CORPUS_MAX_LOADED_MB * 1024 * 1024,
+                 refresh_interval=CORPUS_REFRESH_SECONDS):
+        self.documents = OrderedDict((document.id, document) for document in documents)
+        self.credentials = credentials
+        self.max_loaded_bytes = max_loaded_bytes
+        self.refresh_interval = refresh_interval
+        self.loaded_bytes = 0
+        # document id -> [shard, fingerprint, checked_at], least recently used first
+        self._shards = OrderedDict()
+        # document id -> [fingerprint, checked_at] of the latest source seen, loaded or not
+        self._fingerprints = {}
+        self._lock = threading.Lock()
+        self._load_locks = {document_id: threading.Lock() for document_id in self.documents}
+        self._executor = None
+
+    def select(self, doc_type=None, course=None, document_ids=None):
+        return [
+            document for document in self.documents.values()
+            if (doc_type is None or document.type == doc_type)
+            and (course is None or document.course == course)
+            and (document_ids is None or document.id in document_ids)
+        ]
+
+    def _is_fresh(self, document, entry, now):
+        # A loaded shard is reused until its refresh interval passes, or until
+        # version() has seen a newer source for it
+        if entry is None or now - entry[2] >= self.refresh_interval:
+            return False
+        latest = self._fingerprints.get(document.id)
+        return latest is None or latest[0] == entry[1]
+
+    def shard(self, document):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._shards.get(document.id)
+            if entry is not None:
+                self._shards.move_to_end(document.id)
+                if self._is_fresh(document, entry, now):
+                    return entry[0]
+
+        with self._load_locks[document.id]:
+            with self._lock:
+                entry = self._shards.get(document.id)
+            if self._is_fresh(document, entry, time.monotonic()):
+                return entry[0]
+
+            source = document.source(self.credentials)
+            fingerprint = source.fingerprint()
+            self._fingerprints[document.id] = [fingerprint, time.monotonic()]
+            if entry is not None and entry[1] == fingerprint:
+                entry[2] = time.monotonic()
+                return entry[0]
+
+            logging.info(f"Loading shard {document.id} from {source}")
+            shard = self._load_shard(document, source)
+            logging.info(f"Shard {document.id} ready with {len(shard)} rows")
+            with self._lock:
+                previous = self._shards.pop(document.id, None)
+                if previous is not None:
+                    self.loaded_bytes -= previous[0].nbytes
+                self._shards[document.id] = [shard, fingerprint, time.monotonic()]
+                self.loaded_bytes += shard.nbytes
+                self._evict(keep=document.id)
+            return shard
+
+    def _load_shard(self, document, source):
+        with span("gcs_load", document=document.id):
+            index_source = document.index_source(self.credentials)
+            index_raw = index_source.read() if index_source else None
+            lexical_source = document.lexical_source(self.credentials)
+            lexical_raw = lexical_source.read() if lexical_source else None
+            if document.store_path:
+                prefix, raw = document.store_path, None
+            elif document.store_blob:
+                prefix, raw = fetch_store(get_bucket(document.bucket, self.credentials), document.store_blob), None
+            else:
+                prefix, raw = None, source.read()
+        with span("shard_build", document=document.id):
+            if prefix:
+                return Shard.from_store(document, prefix, index_raw, lexical_raw)
+            return Shard.from_json(document, raw, index_raw, lexical_raw)
+
+    def _evict(self, keep):
+        while self.loaded_bytes > self.max_loaded_bytes and len(self._shards) > 1:
+            document_id = next(iter(self._shards))
+            if document_id == keep:
+                self._shards.move_to_end(keep)
+                document_id = next(iter(self._shards))
+            shard = self._shards.pop(document_id)[0]
+            self.loaded_bytes -= shard.nbytes
+            logging.info(f"Evicted shard {document_id}")
+
+    def _search_document(self, document, query, top_k, query_text, mode, statistics=None):
+        # Returns (shard, dense hits, lexical hits); hits are (score, row) pairs
+        shard = self.shard(document)
+        with span("scoring", document=document.id, mode=mode):
+            return self._score_shard(shard, query, top_k, query_text, mode, statistics)
+
+    def _score_shard(self, shard, query, top_k, query_text, mode, statistics=None):
+        if mode == 'dense' or not query_text or shard.lexical is None:
+            return shard, shard.search(query, top_k), []
+        if mode == 'prefilter':
+            candidates = shard.lexical.matching(query_text)
+            # Too few lexical matches to fill top_k: score everything
+            return shard, shard.search(query, top_k, candidates if len(candidates) >= top_k else None), []
+        depth = max(top_k, HYBRID_DEPTH)
+        scores, ids = shard.lexical.search(query_text, depth, statistics)
+        return shard, shard.search(query, depth), [(float(score), int(i)) for score, i in zip(scores, ids)]
+
+    def search(self, query_embedding, top_k, doc_type=None, course=None, document_ids=None, query_text=None,
+               mode=RETRIEVAL_MODE, with_rows=False):
+        # Per-shard top-k in parallel, merged into a global top-k.
+        # Returns (score, document, record) tuples, best first, with the record's row
+        # in its shard appended if with_rows. In hybrid mode the order is the fused
+        # rank and the score is still the chunk's cosine.
+        documents = self.select(doc_type, course, document_ids)
+        query = normalize_query(query_embedding)
+        statistics = None
+        if mode == 'hybrid' and query_text and len(documents) > 1:
+            # The lexical hits of all shards are ranked together below, so every shard
+            # scores BM25 with the IDF and average length of the selected documents
+            shards = self._map(bind(self.shard), documents)
+            statistics = combine_statistics([shard.lexical.statistics(query_text) for shard in shards
+                                             if shard.lexical is not None])
+        search = bind(lambda document: self._search_document(document, query, top_k, query_text, mode, statistics))
+        per_shard = self._map(search, documents)
+
+        dense = [(score, shard, i) for shard, hits, _ in per_shard for score, i in hits]
+        lexical = [(score, shard, i) for shard, _, hits in per_shard for score, i in hits]
+        if not lexical:
+            return [(score, shard.document, shard.records[i]) + ((i,) if with_rows else ())
+                    for score, shard, i in heapq.nlargest(top_k, dense, key=lambda hit: hit[0])]
+
+        dense.sort(key=lambda hit: -hit[0])
+        lexical.sort(key=lambda hit: -hit[0])
+        shards = {shard.document.id: shard for shard, _, _ in per_shard}
+        cosines = {(shard.document.id, i): score for score, shard, i in dense}
+        fused = reciprocal_rank_fusion([
+            [(shard.document.id, i) for _, shard, i in dense],
+            [(shard.document.id, i) for _, shard, i in lexical],
+        ])[:top_k]
+        # Lexical-only hits have no dense score yet: one batched lookup per shard
+        unscored = {}
+        for _, key in fused:
+            if key not in cosines:
+                unscored.setdefault(key[0], []).append(key[1])
+        for document_id, rows in unscored.items():
+            scores = shards[document_id].cosines(query, rows)
+            cosines.update(((document_id, i), float(score)) for i, score in zip(rows, scores))
+        return [(cosines[(document_id, i)], shards[document_id].document, shards[document_id].records[i])
+                + ((i,) if with_rows else ()) for _, (document_id, i) in fused]
+
+    def _map(self, function, documents):
+        # function(document) for every document, on the search pool when there are several
+        if len(documents) <= 1:
+            return [function(document) for document in documents]
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=CORPUS_SEARCH_WORKERS)
+        return list(self._executor.map(function, documents))
+
+    def record(self, document_id, row):
+        # A chunk record by its row, loading the shard if needed
+        document = self.documents.get(document_id)
+        if document is None:
+            raise KeyError(f"Unknown document {document_id}")
+        return self.shard(document).records[row]
+
+    def vectors(self, rows):
+        # Normalized embeddings of (document id, row) pairs from search(with_rows=True),
+        # or None if a shard is no longer loaded or keeps no float matrix
+        with self._lock:
+            shards = {document_id: entry[0] for document_id, entry in self._shards.items()}
+        vectors = []
+        for document_id, row in rows:
+            shard = shards.get(document_id)
+            if shard is None or shard.index.matrix is None or row >= len(shard):
+                return None
+            vectors.append(np.asarray(shard.index.matrix[row], dtype=np.float32))
+        return np.stack(vectors) if vectors else None
+
+    def version(self, doc_type=None, course=None, document_ids=None):
+        # Digest of the selected documents' source fingerprints. Sources are checked
+        # at most once per refresh interval without loading them, so callers that
+        # skip search (the response cache) still notice a re-ingested document.
+        parts = []
+        for document in self.select(doc_type, course, document_ids):
+            latest = self._fingerprints.get(document.id)
+            now = time.monotonic()
+            if latest is None or now - latest[1] >= self.refresh_interval:
+                latest = self._fingerprints[document.id] = [document.source(self.credentials).fingerprint(), now]
+            parts.append(f"{document.id}={latest[0]}")
+        return hashlib.sha256("|".join(parts).encode('utf-8')).hexdigest()[:16]
+
+    def media_url(self, document_id):
+        document = self.documents[document_id]
+        return signed_url(document.bucket, document.media_blob, self.credentials)
+
+    def default_media_url(self, doc_type, course=None, document_ids=None):
+        # URL for responses without hits: the first document matching the filters
+        documents = self.select(doc_type, course, document_ids)
+        return self.media_url(documents[0].id) if documents else None
+
+
+def corpus_filters(request_json):
+    # Optional request fields that narrow the search: {"course": ..., "document_ids": [...]}
+    request_json = request_json or {}
+    return {"course": request_json.get('course'), "document_ids": request_json.get('document_ids')}
+
+
+_corpus = None
+_corpus_lock = threading.Lock()
+
+
+def get_corpus(credentials=None):
+    global _corpus
+    if _corpus is None:
+        with _corpus_lock:
+            if _corpus is None:
+                _corpus = ShardedIndex(load_registry(CORPUS_REGISTRY, credentials), credentials)
+    return _corpus
+
+
+def set_corpus(corpus):
+    global _corpus
+    with _corpus_lock:
+        _corpus = corpus
@@ -0,0 +1,203 @@
+# Shared by gcp_nxs-function and gcp_pdf-retrieval-function. Each Cloud Function
+# deploys only its own directory, so keep both copies of this file identical.
+import hashlib
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional
+
+from runtime import ensure_vertexai
+from tracing import span
+
+EMBEDDING_MODEL = "text-embedding-004"
+EMBEDDING_CACHE_ENTRIES = int(os.environ.get('EMBEDDING_CACHE_ENTRIES', '4096'))
+EMBEDDING_CACHE_TTL_SECONDS = float(os.environ.get('EMBEDDING_CACHE_TTL_SECONDS', '3600'))
+# Concurrent embed calls arriving within this window share one get_embeddings call; 0 disables batching
+EMBEDDING_BATCH_WINDOW_MS = float(os.environ.get('EMBEDDING_BATCH_WINDOW_MS', '0'))
+EMBEDDING_MAX_BATCH = int(os.environ.get('EMBEDDING_MAX_BATCH', '64'))
+# Vertex AI rejects get_embeddings requests with more instances than this
+VERTEX_MAX_INSTANCES = 250
+
+
+def normalize_text(text):
+    return " ".join(text.split())
+
+
+class VertexEmbedder:
+    def __init__(self, model_name=EMBEDDING_MODEL):
+        self.model_name = model_name
+        self._model = None
+        self._lock = threading.Lock()
+
+    def model(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    ensure_vertexai()
+                    from vertexai.language_models import TextEmbeddingModel
+                    self._model = TextEmbeddingModel.from_pretrained(self.model_name)
+        return self._model
+
+    def embed(self, texts, task, dimensionality):
+        from vertexai.language_models import TextEmbeddingInput
+        model = self.model()
+        inputs = [TextEmbeddingInput(text, task) for text in texts]
+        kwargs = dict(output_dimensionality=dimensionality) if dimensionality else {}
+        vectors = []
+        for start in range(0, len(inputs), VERTEX_MAX_INSTANCES):
+            embeddings = model.get_embeddings(inputs[start:start + VERTEX_MAX_INSTANCES], **kwargs)
+            vectors.extend(embedding.values for embedding in embeddings)
+        return vectors
+
+
+class FakeEmbedder:
+    # Deterministic unit vectors seeded from the text; no network access.
+    def __init__(self, dimensionality=768, latency=0.0):
+        self.dimensionality = dimensionality
+        self.latency = latency
+        self.calls = 0
+        self.texts_embedded = 0
+
+    def embed(self, texts, task, dimensionality):
+        self.calls += 1
+        self.texts_embedded += len(texts)
+        if self.latency:
+            time.sleep(self.latency)
+        size = dimensionality or self.dimensionality
+        vectors = []
+        for text in texts:
+            seed = int.from_bytes(hashlib.sha256(f"{task}|{text}".encode('utf-8')).digest()[:8], 'big')
+            rng = random.Random(seed)
+            vector = [rng.gauss(0.0, 1.0) for _ in range(size)]
+            length = sum(v * v for v in vector) ** 0.5 or 1.0
+            vectors.append([v / length for v in vector])
+        return vectors
+
+
+class _PendingBatch:
+    def __init__(self):
+        self.texts = []
+        self.done = threading.Event()
+        self.vectors = None
+        self.error = None
+
+
+class EmbeddingClient:
+    def __init__(self, backend, cache_entries=EMBEDDING_CACHE_ENTRIES, cache_ttl=EMBEDDING_CACHE_TTL_SECONDS,
+                 batch_window_ms=EMBEDDING_BATCH_WINDOW_MS, max_batch=EMBEDDING_MAX_BATCH):
+        self.backend = backend
+        self.cache_entries = cache_entries
+        self.cache_ttl = cache_ttl
+        self.batch_window = batch_window_ms / 1000.0
+        self.max_batch = max_batch
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        self._open_batches = {}
+        self._lock = threading.Lock()
+
+    def embed(self, texts: List[str], task: str = "RETRIEVAL_QUERY",
+              dimensionality: Optional[int] = 768) -> List[List[float]]:
+        normalized = [normalize_text(text) for text in texts]
+        vectors = [None] * len(texts)
+        missing = []
+        now = time.time()
+        with self._lock:
+            for i, text in enumerate(normalized):
+                key = (text, task, dimensionality)
+                entry = self._cache.get(key)
+                if entry is not None and entry[1] > now:
+                    self._cache.move_to_end(key)
+                    vectors[i] = list(entry[0])
+                    self.hits += 1
+                else:
+                    missing.append(i)
+                    self.misses += 1
+
+        if missing:
+            unique = list(dict.fromkeys(normalized[i] for i in missing))
+            with span("embed", texts=len(unique)):
+                if self.batch_window > 0:
+                    computed = self._embed_batched(unique, task, dimensionality)
+                else:
+                    computed = self.backend.embed(unique, task, dimensionality)
+            by_text = dict(zip(unique, computed))
+            expires_at = time.time() + self.cache_ttl
+            with self._lock:
+                for text, vector in by_text.items():
+                    self._cache[(text, task, dimensionality)] = (tuple(vector), expires_at)
+                    self._cache.move_to_end((text, task, dimensionality))
+                while len(self._cache) > self.cache_entries:
+                    self._cache.popitem(last=False)
+            for i in missing:
+                vectors[i] = list(by_text[normalized[i]])
+        return vectors
+
+    def seed(self, texts, vectors, task="RETRIEVAL_QUERY", dimensionality=768):
+        # Adds precomputed embeddings to the cache, e.g. those of the catalogue queries
+        expires_at = time.time() + self.cache_ttl
+        with self._lock:
+            for text, vector in zip(texts, vectors):
+                self._cache[(normalize_text(text), task, dimensionality)] = (tuple(vector), expires_at)
+            while len(self._cache) > self.cache_entries:
+                self._cache.popitem(last=False)
+
+    def embed_one(self, text, task="RETRIEVAL_QUERY", dimensionality=768):
+        return self.embed([text], task, dimensionality)[0]
+
+    def _embed_batched(self, texts, task, dimensionality):
+        # The first caller to open a batch waits out the window, then embeds every
+        # text that joined in the meantime with a single backend call.
+        key = (task, dimensionality)
+        with self._lock:
+            batch = self._open_batches.get(key)
+            leader = batch is None or len(batch.texts) + len(texts) > self.max_batch
+            if leader:
+                batch = _PendingBatch()
+                self._open_batches[key] = batch
+            offset = len(batch.texts)
+            batch.texts.extend(texts)
+
+        if leader:
+            time.sleep(self.batch_window)
+            with self._lock:
+                if self._open_batches.get(key) is batch:
+                    del self._open_batches[key]
+            try:
+                batch.vectors = self.backend.embed(batch.texts, task, dimensionality)
+            except Exception as e:
+                batch.error = e
+            finally:
+                batch.done.set()
+        else:
+            batch.done.wait()
+
+        if batch.error is not None:
+            raise batch.error
+        return batch.vectors[offset:offset + len(texts)]
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "cached": len(self._cache)}
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(model_name=EMBEDDING_MODEL):
+    client = _clients.get(model_name)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(model_name)
+            if client is None:
+                client = _clients[model_name] = EmbeddingClient(VertexEmbedder(model_name))
+    return client
+
+
+def set_client(client, model_name=EMBEDDING_MODEL):
+    # Swap in another client (e.g. one wrapping FakeEmbedder) for tests and benchmarks
+    with _clients_lock:
+        _clients[model_name] = client
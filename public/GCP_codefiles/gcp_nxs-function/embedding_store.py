@@ -0,0 +1,168 @@
+# Shared by gcp_nxs-function and gcp_pdf-retrieval-function. Each Cloud Function
+# deploys only its own directory, so keep both copies of this file identical.
+#
+# Compact on-disk format written by otherScripts/ingest.py. A store is three
+# files sharing one prefix:
+#   <prefix>.embeddings.npy  row-normalized float16/float32 matrix (memory-mappable)
+#   <prefix>.meta.json       columnar chunk metadata (<prefix>.meta.parquet if written with
+#                            meta_format="parquet"; reading it needs pyarrow)
+#   <prefix>.manifest.json   kind, rows, dim, dtype, embedding model/task
+#   <prefix>.bm25.npz        BM25 inverted index over the chunk texts (lexical.py)
+import contextlib
+import json
+import logging
+import os
+from collections.abc import Sequence
+
+import numpy as np
+
+STORE_CACHE_DIR = os.environ.get('STORE_CACHE_DIR', '/tmp/nxs_store')
+STORE_VERSION = 1
+
+STORE_SUFFIXES = ('.manifest.json', '.embeddings.npy', '.meta.parquet', '.meta.json', '.bm25.npz', '.index.npz')
+
+
+def _parquet():
+    # pyarrow is optional (not in the functions' requirements) and slow to import,
+    # so it is only loaded for Parquet reads/writes
+    try:
+        import pyarrow.parquet
+    except ImportError:
+        return None
+    return pyarrow.parquet
+
+
+@contextlib.contextmanager
+def replacing(path):
+    # Yields a temporary path next to `path` and renames it over `path` once the
+    # block completes. Writing in place would truncate a file that a loaded shard
+    # may still have memory-mapped, and reading those pages then raises SIGBUS.
+    tmp = f"{path}.tmp"
+    try:
+        yield tmp
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def write_store(prefix, matrix, columns, kind, dtype='float16', meta_format='json', **manifest):
+    # `matrix` must be row-normalized; `columns` maps column name -> list of values.
+    # The manifest is replaced last, so readers see the new files only once it changes.
+    if meta_format not in ('json', 'parquet'):
+        raise ValueError(f"Unknown metadata format {meta_format}")
+    pq = _parquet() if meta_format == 'parquet' else None
+    if meta_format == 'parquet' and pq is None:
+        raise ImportError("pyarrow is required to write Parquet store metadata")
+    os.makedirs(os.path.dirname(os.path.abspath(prefix)), exist_ok=True)
+    matrix = np.asarray(matrix, dtype=dtype)
+    with replacing(f"{prefix}.embeddings.npy") as tmp, open(tmp, 'wb') as f:
+        np.save(f, matrix)
+    if pq is not None:
+        import pyarrow
+        with replacing(f"{prefix}.meta.parquet") as tmp:
+            pq.write_table(pyarrow.table(columns), tmp)
+    else:
+        with replacing(f"{prefix}.meta.json") as tmp, open(tmp, 'w') as f:
+            json.dump(columns, f)
+    manifest = dict(manifest, version=STORE_VERSION, kind=kind, rows=int(matrix.shape[0]),
+                    dim=int(matrix.shape[1]) if matrix.ndim == 2 else 0, dtype=str(matrix.dtype),
+                    meta_format=meta_format)
+    with replacing(f"{prefix}.manifest.json") as tmp, open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def read_manifest(prefix):
+    with open(f"{prefix}.manifest.json") as f:
+        return json.load(f)
+
+
+def read_columns(prefix, manifest):
+    if manifest['meta_format'] == 'parquet':
+        pq = _parquet()
+        if pq is None:
+            raise ImportError("pyarrow is required to read Parquet store metadata; add it to requirements.txt")
+        return pq.read_table(f"{prefix}.meta.parquet").to_pydict()
+    with open(f"{prefix}.meta.json") as f:
+        return json.load(f)
+
+
+def read_store(prefix, mmap=True):
+    manifest = read_manifest(prefix)
+    matrix = np.load(f"{prefix}.embeddings.npy", mmap_mode='r' if mmap else None)
+    columns = read_columns(prefix, manifest)
+    return matrix, ColumnRecords(manifest['kind'], columns, manifest.get('text_normalized', False)), manifest
+
+
+class ColumnRecords(Sequence):
+    # Presents columnar metadata as the per-chunk dicts the JSON blobs used to hold,
+    # building each dict only when it is accessed. Stores whose PDF chunks were
+    # cleaned with preprocess_text at ingest also expose them as chunk_text.
+    def __init__(self, kind, columns, text_normalized=False):
+        self.kind = kind
+        self.columns = columns
+        self.text_normalized = text_normalized
+        self._length = len(next(iter(columns.values()))) if columns else 0
+        if kind == 'video' and 'start_seconds' not in columns:
+            # Stores written before ingest recorded integer seconds
+            columns['start_seconds'] = [timestamp_seconds(value) for value in columns['start_time']]
+            columns['end_seconds'] = [timestamp_seconds(value) for value in columns['end_time']]
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        columns = self.columns
+        if self.kind == 'video':
+            return {
+                "transcript": columns['transcript'][i],
+                "time_stamp": {"start_time": columns['start_time'][i], "end_time": columns['end_time'][i]},
+                "start_seconds": columns['start_seconds'][i],
+                "end_seconds": columns['end_seconds'][i],
+            }
+        record = {
+            "chunk": columns['chunk'][i],
+            "page": columns['page'][i],
+            "coordinates": columns['coordinates'][i],
+        }
+        if self.text_normalized:
+            record["chunk_text"] = record["chunk"]
+        return record
+
+    def nbytes(self):
+        return sum(len(value) for values in self.columns.values() for value in values if isinstance(value, str))
+
+
+def timestamp_seconds(timestamp):
+    # "HH:MM:SS" or "HH:MM:SS.fff" -> whole seconds
+    h, m, s = timestamp.split(':')
+    return int(int(h) * 3600 + int(m) * 60 + float(s))
+
+
+def fetch_store(bucket, blob_prefix, cache_dir=STORE_CACHE_DIR):
+    # Copies a store from GCS to local disk (needed for mmap), skipping files whose
+    # generation has not changed since the last copy. Returns the local prefix.
+    local_prefix = os.path.join(cache_dir, bucket.name, blob_prefix)
+    os.makedirs(os.path.dirname(local_prefix), exist_ok=True)
+    for suffix in STORE_SUFFIXES:
+        blob = bucket.get_blob(blob_prefix + suffix)
+        if blob is None:
+            continue
+        path = local_prefix + suffix
+        marker = f"{path}.generation"
+        if os.path.exists(path) and os.path.exists(marker):
+            with open(marker) as f:
+                if f.read() == str(blob.generation):
+                    continue
+        logging.info(f"Downloading {blob_prefix + suffix}")
+        # Replace rather than overwrite: a shard loaded earlier may still have the
+        # old file memory-mapped
+        with open(f"{path}.tmp", 'wb') as f:
+            f.write(blob.download_as_bytes())
+        os.replace(f"{path}.tmp", path)
+        with open(marker, 'w') as f:
+            f.write(str(blob.generation))
+    return local_prefix
@@ -0,0 +1,169 @@
+# Shared by gcp_nxs-function and gcp_pdf-retrieval-function. Each Cloud Function
+# deploys only its own directory, so keep both copies of this file identical.
+import datetime
+import hashlib
+import logging
+import os
+import threading
+import time
+
+from tracing import span
+
+SIGNED_URL_EXPIRATION = datetime.timedelta(minutes=15)
+# Cached signed URLs are re-signed once they are this close to expiring
+SIGNED_URL_SAFETY_MARGIN_SECONDS = float(os.environ.get('SIGNED_URL_SAFETY_MARGIN_SECONDS', '120'))
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_storage_client(credentials=None):
+    # One client (and HTTP connection pool) per credentials object for the life of the instance
+    key = id(credentials)
+    entry = _clients.get(key)
+    if entry is None:
+        with _clients_lock:
+            entry = _clients.get(key)
+            if entry is None:
+                from google.cloud import storage
+                logging.info("Creating storage client")
+                entry = _clients[key] = (credentials, storage.Client(credentials=credentials))
+    return entry[1]
+
+
+def set_storage_client(client, credentials=None):
+    # Swap in another client, e.g. LocalStorageClient, for tests and benchmarks
+    with _clients_lock:
+        _clients[id(credentials)] = (credentials, client)
+
+
+def get_bucket(bucket_name, credentials=None):
+    return get_storage_client(credentials).bucket(bucket_name)
+
+
+class SignedUrlCache:
+    def __init__(self, expiration=SIGNED_URL_EXPIRATION, safety_margin=SIGNED_URL_SAFETY_MARGIN_SECONDS):
+        self.expiration = expiration
+        self.safety_margin = safety_margin
+        self._urls = {}
+        self._lock = threading.Lock()
+
+    def get(self, bucket_name, blob_name, credentials=None):
+        key = (bucket_name, blob_name, id(credentials))
+        now = time.time()
+        entry = self._urls.get(key)
+        if entry is not None and now < entry[1] - self.safety_margin:
+            return entry[0]
+        with span("url_sign", blob=blob_name), self._lock:
+            entry = self._urls.get(key)
+            if entry is not None and now < entry[1] - self.safety_margin:
+                return entry[0]
+            logging.info(f"Signing URL for {bucket_name}/{blob_name}")
+            url = get_bucket(bucket_name, credentials).blob(blob_name).generate_signed_url(
+                version="v4",
+                expiration=self.expiration,
+                method="GET",
+            )
+            self._urls[key] = (url, now + self.expiration.total_seconds())
+            return url
+
+
+signed_urls = SignedUrlCache()
+
+
+def signed_url(bucket_name, blob_name, credentials=None):
+    return signed_urls.get(bucket_name, blob_name, credentials)
+
+
+class GCSBlobSource:
+    def __init__(self, bucket_name, blob_name, credentials=None):
+        self.bucket_name = bucket_name
+        self.blob_name = blob_name
+        self.credentials = credentials
+
+    def _bucket(self):
+        return get_bucket(self.bucket_name, self.credentials)
+
+    def fingerprint(self):
+        blob = self._bucket().get_blob(self.blob_name)
+        if blob is None:
+            raise FileNotFoundError(f"gs://{self.bucket_name}/{self.blob_name}")
+        return (blob.generation, blob.etag)
+
+    def read(self):
+        return self._bucket().blob(self.blob_name).download_as_bytes()
+
+    def __repr__(self):
+        return f"gs://{self.bucket_name}/{self.blob_name}"
+
+
+class LocalFileSource:
+    def __init__(self, path):
+        self.path = path
+
+    def fingerprint(self):
+        stat = os.stat(self.path)
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def read(self):
+        with open(self.path, "rb") as f:
+            return f.read()
+
+    def __repr__(self):
+        return self.path
+
+
+class LocalBlob:
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+        self.path = os.path.join(bucket.path, name)
+
+    @property
+    def generation(self):
+        return os.stat(self.path).st_mtime_ns
+
+    @property
+    def etag(self):
+        with open(self.path, 'rb') as f:
+            return hashlib.md5(f.read()).hexdigest()
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def download_as_bytes(self):
+        with open(self.path, 'rb') as f:
+            return f.read()
+
+    download_as_string = download_as_bytes
+
+    def upload_from_string(self, data, content_type=None):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, 'wb') as f:
+            f.write(data.encode('utf-8') if isinstance(data, str) else data)
+
+    def generate_signed_url(self, version="v4", expiration=SIGNED_URL_EXPIRATION, method="GET"):
+        expires = int(time.time() + expiration.total_seconds())
+        return f"file://{os.path.abspath(self.path)}?expires={expires}"
+
+
+class LocalBucket:
+    def __init__(self, root, name):
+        self.name = name
+        self.path = os.path.join(root, name)
+
+    def blob(self, name):
+        return LocalBlob(self, name)
+
+    def get_blob(self, name):
+        blob = LocalBlob(self, name)
+        return blob if blob.exists() else None
+
+
+class LocalStorageClient:
+    # Fake GCS backed by a local directory: <root>/<bucket>/<blob name>
+    def __init__(self, root):
+        self.root = root
+
+    def bucket(self, name):
+        return LocalBucket(self.root, name)
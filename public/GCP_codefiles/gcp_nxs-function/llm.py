@@ -0,0 +1,369 @@
+# Shared by gcp_nxs-function and gcp_pdf-retrieval-function. Each Cloud Function
+# deploys only its own directory, so keep both copies of this file identical.
+#
+# Every Gemini call goes through generate(). Per instance it
+# - bounds the calls in flight with an AIMD limit: it grows by about one per
+#   limit's worth of successful calls and halves on a quota/overload error or a
+#   slow call;
+# - retries retryable errors (429, 500, 503, 504, connection errors) with capped
+#   exponential backoff and full jitter;
+# - gives up once the request deadline (see deadline()) leaves no time for the
+#   next attempt, so summaries that would arrive too late are never started;
+# - stops calling the model after repeated failures (circuit breaker) and fails
+#   fast with CircuitOpenError until a probe call succeeds after a cool-down.
+#   Quota errors (429) are left to the concurrency limit and never open it.
+# Callers keep their own fallbacks: the summary functions turn any exception
+# into their placeholder text.
+import contextlib
+import contextvars
+import logging
+import os
+import random
+import threading
+import time
+
+from tracing import register_metrics, span
+
+LLM_CONCURRENCY_INITIAL = int(os.environ.get('LLM_CONCURRENCY_INITIAL', '8'))
+LLM_CONCURRENCY_MIN = int(os.environ.get('LLM_CONCURRENCY_MIN', '1'))
+LLM_CONCURRENCY_MAX = int(os.environ.get('LLM_CONCURRENCY_MAX', '64'))
+# A successful call slower than this also counts as an overload signal
+LLM_SLOW_CALL_SECONDS = float(os.environ.get('LLM_SLOW_CALL_SECONDS', '10'))
+# Attempts per call, the first included
+LLM_MAX_ATTEMPTS = int(os.environ.get('LLM_MAX_ATTEMPTS', '4'))
+LLM_BACKOFF_BASE_SECONDS = float(os.environ.get('LLM_BACKOFF_BASE_SECONDS', '0.5'))
+LLM_BACKOFF_MAX_SECONDS = float(os.environ.get('LLM_BACKOFF_MAX_SECONDS', '8'))
+# Consecutive failed attempts that open the circuit, and how long it stays open
+LLM_BREAKER_FAILURES = int(os.environ.get('LLM_BREAKER_FAILURES', '5'))
+LLM_BREAKER_RESET_SECONDS = float(os.environ.get('LLM_BREAKER_RESET_SECONDS', '30'))
+# Deadline the HTTP handlers give each request's LLM calls
+LLM_REQUEST_DEADLINE_SECONDS = float(os.environ.get('LLM_REQUEST_DEADLINE_SECONDS', '25'))
+
+# google.api_core exception names and HTTP codes, so classifying needs no Google import
+RETRYABLE_ERRORS = {"ResourceExhausted", "TooManyRequests", "ServiceUnavailable", "InternalServerError",
+                    "GatewayTimeout", "DeadlineExceeded", "Aborted"}
+OVERLOAD_ERRORS = {"ResourceExhausted", "TooManyRequests", "ServiceUnavailable"}
+RETRYABLE_CODES = {429, 500, 502, 503, 504}
+OVERLOAD_CODES = {429, 503}
+
+
+class CircuitOpenError(RuntimeError):
+    pass
+
+
+class DeadlinePassedError(TimeoutError):
+    pass
+
+
+def _error_code(e):
+    code = getattr(e, 'code', None)
+    code = getattr(code, 'value', code)
+    return code if isinstance(code, int) else None
+
+
+def is_retryable(e):
+    if isinstance(e, (CircuitOpenError, DeadlinePassedError)):
+        return False
+    return (type(e).__name__ in RETRYABLE_ERRORS or _error_code(e) in RETRYABLE_CODES
+            or isinstance(e, (ConnectionError, TimeoutError)))
+
+
+def is_overload(e):
+    return type(e).__name__ in OVERLOAD_ERRORS or _error_code(e) in OVERLOAD_CODES
+
+
+def is_service_failure(e):
+    # Errors that count towards opening the circuit. Client errors (4xx: bad request,
+    # blocked prompt) say nothing about the service's health, and quota errors mean
+    # this instance should slow down, not stop.
+    if type(e).__name__ in ("ResourceExhausted", "TooManyRequests"):
+        return False
+    code = _error_code(e)
+    return code is None or not 400 <= code < 500
+
+
+_deadline = contextvars.ContextVar('llm_deadline', default=None)
+
+
+@contextlib.contextmanager
+def deadline(seconds):
+    # LLM calls in this context (and in pool work wrapped with tracing.bind) must
+    # finish within `seconds`; nested deadlines can only shorten it
+    at = time.monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(at if current is None else min(at, current))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def deadline_at():
+    # time.monotonic() value of the current deadline, or None
+    return _deadline.get()
+
+
+def remaining():
+    at = _deadline.get()
+    return None if at is None else at - time.monotonic()
+
+
+class AdaptiveLimiter:
+    # Additive increase, multiplicative decrease, as in TCP congestion control.
+    # Halving happens at most once per decrease_interval, so one burst of 429s
+    # answering many calls in flight counts as a single signal.
+    def __init__(self, initial=LLM_CONCURRENCY_INITIAL, min_limit=LLM_CONCURRENCY_MIN,
+                 max_limit=LLM_CONCURRENCY_MAX, decrease_interval=1.0):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = float(max(min_limit, min(initial, max_limit)))
+        self.decrease_interval = decrease_interval
+        self.in_flight = 0
+        self.decreases = 0
+        self._last_decrease = float('-inf')
+        self._condition = threading.Condition()
+
+    def try_acquire(self):
+        with self._condition:
+            if self.in_flight < int(self.limit):
+                self.in_flight += 1
+                return True
+            return False
+
+    def acquire(self, timeout=None):
+        with self._condition:
+            if not self._condition.wait_for(lambda: self.in_flight < int(self.limit), timeout):
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self, succeeded=True, overloaded=False):
+        with self._condition:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if overloaded:
+                if now - self._last_decrease >= self.decrease_interval:
+                    self.limit = max(self.min_limit, self.limit / 2)
+                    self._last_decrease = now
+                    self.decreases += 1
+            elif succeeded:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+
+class CircuitBreaker:
+    # closed -> open after failure_threshold consecutive failures. Open fails fast
+    # for reset_timeout seconds, then half-open lets one probe through: success
+    # closes the circuit, failure opens it again.
+    def __init__(self, failure_threshold=LLM_BREAKER_FAILURES, reset_timeout=LLM_BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.trips = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = "half_open"
+                self._probing = False
+            if self.state == "half_open" and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record(self, succeeded):
+        with self._lock:
+            if succeeded:
+                if self.state != "closed":
+                    logging.info("LLM circuit closed")
+                self.state = "closed"
+                self.failures = 0
+                self._probing = False
+                return
+            self.failures += 1
+            if self.state == "half_open" or (self.state == "closed" and self.failures >= self.failure_threshold):
+                if self.state == "closed":
+                    self.trips += 1
+                logging.warning(f"LLM circuit open after {self.failures} consecutive failures")
+                self.state = "open"
+                self._opened_at = time.monotonic()
+                self._probing = False
+
+
+class LLMClient:
+    def __init__(self, limiter=None, breaker=None, max_attempts=LLM_MAX_ATTEMPTS, backoff_base=LLM_BACKOFF_BASE_SECONDS,
+                 backoff_max=LLM_BACKOFF_MAX_SECONDS, slow_call=LLM_SLOW_CALL_SECONDS, seed=None):
+        self.limiter = limiter or AdaptiveLimiter()
+        self.breaker = breaker or CircuitBreaker()
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.slow_call = slow_call
+        self.counters = {"calls": 0, "succeeded": 0, "failed": 0, "attempts": 0, "retries": 0, "overloaded": 0,
+                         "rejected_open": 0, "deadline_exceeded": 0}
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self.counters[name] += n
+
+    def backoff(self, attempt):
+        # Full jitter: uniform over [0, capped exponential]
+        return self._rng.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1)))
+
+    def _acquire(self):
+        if self.limiter.try_acquire():
+            return
+        with span("llm_wait"):
+            acquired = self.limiter.acquire(remaining())
+        if not acquired:
+            self._count("deadline_exceeded")
+            raise DeadlinePassedError("Request deadline passed while waiting for an LLM slot")
+
+    def _start(self):
+        # Takes a concurrency permit for one attempt, unless the deadline passed or the circuit is open
+        left = remaining()
+        if left is not None and left <= 0:
+            self._count("deadline_exceeded")
+            raise DeadlinePassedError("Request deadline passed before the LLM call")
+        self._acquire()
+        if not self.breaker.allow():
+            self.limiter.release(succeeded=False)
+            self._count("rejected_open")
+            raise CircuitOpenError("LLM circuit open")
+        self._count("attempts")
+
+    def _finish(self, error=None, seconds=0.0):
+        # Returns the permit and tells the limiter and breaker how the attempt went
+        if error is None:
+            self.limiter.release(overloaded=seconds > self.slow_call)
+            self.breaker.record(True)
+            return
+        overloaded = is_overload(error)
+        self.limiter.release(succeeded=False, overloaded=overloaded)
+        self.breaker.record(not is_service_failure(error))
+        self._count("overloaded", overloaded)
+
+    def _retry_delay(self, error, attempt):
+        # Seconds to wait before the next attempt, or None to give up
+        if not is_retryable(error) or attempt == self.max_attempts:
+            return None
+        delay = self.backoff(attempt)
+        left = remaining()
+        if left is not None and delay >= left:
+            self._count("deadline_exceeded")
+            return None
+        logging.warning(f"LLM call failed ({error}), retrying in {delay:.2f}s")
+        self._count("retries")
+        return delay
+
+    def call(self, fn):
+        # Runs fn() (one model request) with retries; raises the last error, or
+        # CircuitOpenError / DeadlinePassedError when giving up early
+        self._count("calls")
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                self._start()
+            except Exception:
+                self._count("failed")
+                raise
+            started = time.monotonic()
+            try:
+                with span("llm_attempt", attempt=attempt):
+                    result = fn()
+            except Exception as e:
+                self._finish(e)
+                delay = self._retry_delay(e, attempt)
+                if delay is None:
+                    self._count("failed")
+                    raise
+                time.sleep(delay)
+                continue
+            self._finish(seconds=time.monotonic() - started)
+            self._count("succeeded")
+            return result
+
+    def generate(self, model, prompt, generation_config=None):
+        return self.call(lambda: model.generate_content(prompt, generation_config=generation_config))
+
+    def stream(self, model, prompt, generation_config=None):
+        # Yields response chunks. Opening the stream up to its first chunk is retried
+        # like generate(); the permit is held until the stream is consumed or closed.
+        self._count("calls")
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                self._start()
+            except Exception:
+                self._count("failed")
+                raise
+            started = time.monotonic()
+            try:
+                chunks = iter(model.generate_content(prompt, generation_config=generation_config, stream=True))
+                chunk = next(chunks, None)
+            except Exception as e:
+                self._finish(e)
+                delay = self._retry_delay(e, attempt)
+                if delay is None:
+                    self._count("failed")
+                    raise
+                time.sleep(delay)
+                continue
+            error = None
+            try:
+                while chunk is not None:
+                    yield chunk
+                    chunk = next(chunks, None)
+            except GeneratorExit:
+                # The consumer stopped reading (e.g. it timed out); not the service's fault
+                raise
+            except Exception as e:
+                error = e
+                raise
+            finally:
+                self._finish(error, time.monotonic() - started)
+                self._count("failed" if error is not None else "succeeded")
+            return
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self.counters)
+        return dict(counters, limit=round(self.limiter.limit, 2), in_flight=self.limiter.in_flight,
+                    limit_decreases=self.limiter.decreases, breaker_state=self.breaker.state,
+                    breaker_trips=self.breaker.trips)
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_llm_client():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = LLMClient()
+    return _client
+
+
+def set_llm_client(client):
+    global _client
+    with _client_lock:
+        _client = client
+
+
+def generate(model, prompt, generation_config=None):
+    return get_llm_client().generate(model, prompt, generation_config)
+
+
+def generate_stream(model, prompt, generation_config=None):
+    return get_llm_client().stream(model, prompt, generation_config)
+
+
+register_metrics("llm", lambda: get_llm_client().stats())
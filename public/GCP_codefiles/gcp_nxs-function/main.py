@@ -1,192 +1,335 @@
 import functions_framework
-import json
 import logging
-from google.cloud import storage
-from google.cloud import aiplatform
-import vertexai
-from vertexai.generative_models import GenerativeModel, GenerationConfig
-import datetime
-
-# Import the retrieve function from retrieval_key
-from retrieval_key import retrieve
-
-import logging
-import google.cloud.logging
 import os
-from google.oauth2 import service_account
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-credentials = service_account.Credentials.from_service_account_file(
-    os.environ['GOOGLE_APPLICATION_CREDENTIALS'])
-
-# Instantiates a client
-client = google.cloud.logging.Client()
-
-# Connects the logger to the root logging handler
-client.setup_logging()
+# Import the retrieve function from retrieval_key
+from retrieval_key import embed_text, retrieve
+from pdf_search import format_pdf_results, pdf_results
+from context_assembly import group_context
+from corpus import corpus_filters, get_corpus
+from audit_sink import get_auditor, new_request_id
+from streaming import requested_stream_format, stream_response
+from summarization import (
+    SUMMARY_BATCH_CONTEXT_TOKENS,
+    SUMMARY_BATCH_MAX_OUTPUT_TOKENS,
+    SUMMARY_BATCH_MODE,
+    estimate_tokens,
+    parse_summary_array,
+    stream_concurrently,
+    summarize_batched,
+    summarize_concurrently,
+)
+from summary_cache import cache_key, get_cache
+from response_cache import get_response_cache
+from precomputed import PRECOMPUTED_ANSWERS, warm_precomputed
+from response_format import RequestFormatError, json_response, round_result, shape_results
+from timeline import rank_groups, snippet_seconds
+from tracing import bind, requested_timings, span, start_trace
+from llm import LLM_REQUEST_DEADLINE_SECONDS, deadline, generate, generate_stream
+from runtime import (
+    RUNTIME_PREWARM,
+    ensure_vertexai,
+    generative_model,
+    get_credentials,
+    prewarm,
+    setup_cloud_logging,
+)
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 
-# Initialize Vertex AI
-PROJECT_ID = "silver-idea-432502-c0"
-REGION = "us-central1"
 MODEL_NAME = "gemini-1.0-pro"
 BUCKET_NAME_1 = "nxs_bucket1"
 
-vertexai.init(project=PROJECT_ID, location=REGION, credentials=credentials)
-GenAI_modelConfig = GenerationConfig(max_output_tokens=150)
+# Plain dict so building it needs no Vertex AI import; generate_content accepts either form
+GenAI_modelConfig = {"max_output_tokens": 150}
 
-def convert_to_seconds(timestamp):
-    logging.info(f"Converting timestamp: {timestamp}")
-    h, m, s = map(float, timestamp.split(':'))
-    return int(h * 3600 + m * 60 + s)
+# Credentials, Vertex AI and Cloud Logging are initialized on first use (see runtime.py);
+# prewarming starts them in the background so they overlap with the first request
+if RUNTIME_PREWARM:
+    prewarm(setup_cloud_logging, ensure_vertexai)
 
-def group_intervals(snippets, gap=60):
-    logging.info(f"Grouping intervals for {len(snippets)} snippets")
-    grouped_snippets = []
-    current_group = []
-    last_end_time = None
+# Summaries for the selected groups run concurrently, at most SUMMARY_CONCURRENCY at a time
+SUMMARY_CONCURRENCY = int(os.environ.get('SUMMARY_CONCURRENCY', '4'))
+SUMMARY_TIMEOUT_SECONDS = float(os.environ.get('SUMMARY_TIMEOUT_SECONDS', '20'))
+SUMMARY_PLACEHOLDER = "Summary placeholder due to model unavailability."
+# Transcript snippets retrieved per query before they are grouped and ranked
+VIDEO_TOP_K = int(os.environ.get('VIDEO_TOP_K', '14'))
 
-    for snippet in snippets:
-        start_time_sec = convert_to_seconds(snippet['time_stamp']['start_time'])
-        end_time_sec = convert_to_seconds(snippet['time_stamp']['end_time'])
+SUMMARY_PROMPT_TEMPLATE = """You are Nexus.AI- an AI tutor assisting college students in their research process. Your task is to analyze how the contents of this text snippet can help the student understand their query.
 
-        if last_end_time is None or start_time_sec - last_end_time <= gap:
-            current_group.append(snippet)
-        else:
-            grouped_snippets.append(current_group)
-            current_group = [snippet]
+Write 2 sentences explaining how this segment contributes to understanding the topic, without revealing specific answers or key details. Guide the student to understand why this section would be valuable for their research.
 
-        last_end_time = end_time_sec
+The snippet is never not related to the query. If the snippet doesn't answer the query directly, then look at the concepts mentioned in the snippet and how they could be connected. 
 
-    if current_group:
-        grouped_snippets.append(current_group)
+Query: {query}
 
-    logging.info(f"Grouped into {len(grouped_snippets)} groups")
-    return grouped_snippets
+Text snippet: {text_snippet}
 
-def generate_summary(query, text_snippet):
-    logging.info(f"Generating summary for query: {query}")
-    try:
-        model = GenerativeModel(MODEL_NAME)
-        prompt = f"""You are Nexus.AI- an AI tutor assisting college students in their research process. Your task is to analyze how the contents of this text snippet can help the student understand their query.
+YourNXS:"""
 
-Write 2 sentences explaining how this segment contributes to understanding the topic, without revealing specific answers or key details. Guide the student to understand why this section would be valuable for their research.
+# Same instructions as SUMMARY_PROMPT_TEMPLATE for several groups at once, answered as a JSON array
+BATCH_SUMMARY_PROMPT_TEMPLATE = """You are Nexus.AI- an AI tutor assisting college students in their research process. Your task is to analyze how the contents of each numbered text snippet below can help the student understand their query.
 
-The snippet is never not related to the query. If the snippet doesn't answer the query directly, then look at the concepts mentioned in the snippet and how they could be connected. 
+For each snippet, write 2 sentences explaining how this segment contributes to understanding the topic, without revealing specific answers or key details. Guide the student to understand why this section would be valuable for their research.
+
+The snippets are never not related to the query. If a snippet doesn't answer the query directly, then look at the concepts mentioned in the snippet and how they could be connected.
 
 Query: {query}
 
-Text snippet: {text_snippet}
+{snippets_text}
 
-YourNXS:"""
+Respond with only a JSON array holding one object per snippet, in order: [{{"id": 1, "summary": "..."}}, {{"id": 2, "summary": "..."}}]"""
+
+def generate_summary(query, text_snippet, model=None):
+    logging.info(f"Generating summary for query: {query}")
+    key = cache_key(query, text_snippet, MODEL_NAME, GenAI_modelConfig, SUMMARY_PROMPT_TEMPLATE)
+    cached = get_cache().get(key)
+    if cached is not None:
+        logging.info("Summary served from cache")
+        return cached
+    try:
+        model = model or generative_model(MODEL_NAME)
+        prompt = SUMMARY_PROMPT_TEMPLATE.format(query=query, text_snippet=text_snippet)
         
-        response = model.generate_content(prompt, generation_config=GenAI_modelConfig)
+        with span("llm", call="summary"):
+            response = generate(model, prompt, GenAI_modelConfig)
         
+        summary = response.text.strip()
+        get_cache().set(key, summary)
         logging.info("Summary generated successfully")
-        return response.text.strip()
+        return summary
     except Exception as e:
         logging.error(f"Error generating summary: {e}")
-        return "Summary placeholder due to model unavailability."
-
-def load_from_gcs(bucket_name, filename):
-    logging.info(f"Loading from GCS: {bucket_name}/{filename}")
-    storage_client = storage.Client(credentials=credentials)
-    bucket = storage_client.bucket(bucket_name)
-    blob = bucket.blob(filename)
-    data = json.loads(blob.download_as_string())
-    logging.info(f"Loaded data with {len(data)} items")
-    return data
-
-def save_to_gcs(data, bucket_name, filename):
-    logging.info(f"Saving to GCS: {bucket_name}/{filename}")
-    storage_client = storage.Client(credentials=credentials)
-    bucket = storage_client.bucket(bucket_name)
-    blob = bucket.blob(filename)
-    blob.upload_from_string(json.dumps(data, indent=2))
-    logging.info("Data saved successfully")
-
-def process_snippets(query):
+        return SUMMARY_PLACEHOLDER
+
+def generate_summary_batch(query, text_snippets, model=None):
+    # One generate_content call for several snippets; returns a summary or None per snippet
+    model = model or generative_model(MODEL_NAME)
+    snippets_text = "\n\n".join(f"Snippet {i + 1}: {text}" for i, text in enumerate(text_snippets))
+    prompt = BATCH_SUMMARY_PROMPT_TEMPLATE.format(query=query, snippets_text=snippets_text)
+    # Room for every summary plus the JSON around them
+    generation_config = dict(GenAI_modelConfig, max_output_tokens=min(
+        SUMMARY_BATCH_MAX_OUTPUT_TOKENS, GenAI_modelConfig["max_output_tokens"] * len(text_snippets) + 50))
+    with span("llm", call="summary_batch", snippets=len(text_snippets)):
+        response = generate(model, prompt, generation_config)
+    summaries = parse_summary_array(response.text, len(text_snippets))
+    # Keyed by the batch prompt that produced them, so the single-snippet path never serves them
+    for text, summary in zip(text_snippets, summaries):
+        if summary is not None:
+            get_cache().set(cache_key(query, text, MODEL_NAME, GenAI_modelConfig, BATCH_SUMMARY_PROMPT_TEMPLATE),
+                            summary)
+    return summaries
+
+def generate_summaries(query, text_snippets, model=None):
+    # Summaries for all groups, in order. Cached ones are reused; the rest go out in
+    # as few batched calls as the context allows, or one call each without batching.
+    # Batch mode also produces single-prompt summaries (lone groups, groups missing from
+    # the batch answer), so it accepts either; without it only single-prompt ones count
+    templates = [SUMMARY_PROMPT_TEMPLATE]
+    if SUMMARY_BATCH_MODE:
+        templates.insert(0, BATCH_SUMMARY_PROMPT_TEMPLATE)
+    summaries = []
+    for text in text_snippets:
+        summary = None
+        for template in templates:
+            summary = get_cache().get(cache_key(query, text, MODEL_NAME, GenAI_modelConfig, template))
+            if summary is not None:
+                break
+        summaries.append(summary)
+    missing = [i for i, summary in enumerate(summaries) if summary is None]
+    if not missing:
+        return summaries
+    texts = [text_snippets[i] for i in missing]
+    summarize_one = bind(lambda text: generate_summary(query, text, model))
+    if SUMMARY_BATCH_MODE and len(texts) > 1:
+        output_tokens = GenAI_modelConfig["max_output_tokens"]
+        computed = summarize_batched(
+            texts,
+            bind(lambda batch: generate_summary_batch(query, batch, model)),
+            summarize_one,
+            costs=[estimate_tokens(text) + output_tokens for text in texts],
+            fixed_cost=estimate_tokens(BATCH_SUMMARY_PROMPT_TEMPLATE + query),
+            budget=SUMMARY_BATCH_CONTEXT_TOKENS,
+            max_items=max(1, SUMMARY_BATCH_MAX_OUTPUT_TOKENS // output_tokens),
+            max_concurrency=SUMMARY_CONCURRENCY,
+            timeout=SUMMARY_TIMEOUT_SECONDS,
+            placeholder=SUMMARY_PLACEHOLDER,
+        )
+    else:
+        computed = summarize_concurrently(
+            texts,
+            summarize_one,
+            max_concurrency=SUMMARY_CONCURRENCY,
+            timeout=SUMMARY_TIMEOUT_SECONDS,
+            placeholder=SUMMARY_PLACEHOLDER,
+        )
+    for i, summary in zip(missing, computed):
+        summaries[i] = summary
+    return summaries
+
+def generate_summary_stream(query, text_snippet, model=None):
+    # Yields the summary in chunks as Gemini streams it; errors propagate to the caller
+    key = cache_key(query, text_snippet, MODEL_NAME, GenAI_modelConfig, SUMMARY_PROMPT_TEMPLATE)
+    cached = get_cache().get(key)
+    if cached is not None:
+        logging.info("Summary served from cache")
+        yield cached
+        return
+    model = model or generative_model(MODEL_NAME)
+    prompt = SUMMARY_PROMPT_TEMPLATE.format(query=query, text_snippet=text_snippet)
+    parts = []
+    for chunk in generate_stream(model, prompt, GenAI_modelConfig):
+        parts.append(chunk.text)
+        yield chunk.text
+    get_cache().set(key, "".join(parts).strip())
+    logging.info("Summary streamed successfully")
+
+def select_video_groups(query, query_embedding=None, request_id=None, filters=None):
+    # Use the imported retrieve function
+    retrieved_data = retrieve(query, top_k=VIDEO_TOP_K, query_embedding=query_embedding, request_id=request_id,
+                              **(filters or {}))
+    logging.info(f"Retrieved {len(retrieved_data)} snippets")
+
+    # Merge snippets that are close in time, then keep the most relevant groups
+    with span("grouping", snippets=len(retrieved_data)):
+        potential_groups = rank_groups(retrieved_data)
+    logging.info(f"Selected {len(potential_groups)} potential groups")
+
+    # Combine the transcript texts in each group
+    combined_texts = [" ".join([snippet['transcript'] for snippet in group]) for group in potential_groups]
+    return potential_groups, combined_texts
+
+def summary_contexts(potential_groups):
+    # What each group's summary prompt gets: its most relevant, non-repeating snippets within the token budget
+    corpus = get_corpus(get_credentials())
+    return [group_context(group, corpus) for group in potential_groups]
+
+def group_time_stamp(group):
+    # The group starts with its first snippet and ends with whichever snippet ends last
+    last = max(group, key=lambda snippet: snippet_seconds(snippet, 'end'))
+    return {
+        "start_time": group[0]['time_stamp']['start_time'],
+        "end_time": last['time_stamp']['end_time']
+    }
+
+def group_video_url(group):
+    return get_corpus(get_credentials()).media_url(group[0]['document_id'])
+
+def default_video_url(filters=None):
+    return get_corpus(get_credentials()).default_media_url("video", **(filters or {}))
+
+def cached_video_output(query, query_embedding, filters):
+    # Final output of an earlier identical or near-identical query against the same
+    # lectures, with fresh signed URLs. Returns (output or None, query embedding, corpus version).
+    cache = get_response_cache()
+    filters = filters or {}
+    version = get_corpus(get_credentials()).version("video", **filters)
+    cached = cache.get("video", query, filters, version, count_miss=False)
+    if cached is None:
+        if query_embedding is None:
+            query_embedding = embed_text(texts=[query])[0]
+        cached = cache.get("video", query, filters, version, query_embedding)
+    if cached is not None:
+        for item in cached:
+            item["video_url"] = get_corpus(get_credentials()).media_url(item["document_id"])
+    return cached, query_embedding, version
+
+def process_snippets(query, model=None, query_embedding=None, request_id=None, filters=None):
     logging.info(f"Processing snippets for query: {query}")
-    try:
-        # Use the imported retrieve function
-        retrieved_data = retrieve(query)
-        logging.info(f"Retrieved {len(retrieved_data)} snippets")
-        
-        # Sort snippets by start time
-        sorted_snippets = sorted(retrieved_data, key=lambda x: convert_to_seconds(x['time_stamp']['start_time']))
-        logging.info("Snippets sorted")
-
-        # Group snippets based on their timestamps
-        grouped_snippets = group_intervals(sorted_snippets)
-
-        # Get the first 7 groups
-        potential_groups = grouped_snippets[:7]
-        logging.info(f"Selected {len(potential_groups)} potential groups")
-
-        # Create the final output structure, only including relevant groups
-        final_output = []
-        for group in potential_groups:
-            # Combine the transcript texts in the group
-            combined_text = " ".join([snippet['transcript'] for snippet in group])
-
-            # Generate a summary of the combined text
-            summary = generate_summary(query, combined_text)
-            
-            # Only process and store groups that are deemed relevant
-            if summary != "1":
-                # Get the first and last timestamps in the group
-                start_time = group[0]['time_stamp']['start_time']
-                end_time = group[-1]['time_stamp']['end_time']
-
-                # Add relevant group to final output
-                final_output.append({
-                    "summary": summary,
-                    "time_stamp": {
-                        "start_time": start_time,
-                        "end_time": end_time
-                    },
-                    "transcript": combined_text,
-                    "cosine_scores": [snippet['cosine_score'] for snippet in group],
-                })
-            else:
-                logging.info("Skipping irrelevant group")
-
-        logging.info(f"Final output contains {len(final_output)} relevant groups")
-
-        # Save the final output to GCS
-        save_to_gcs(final_output, BUCKET_NAME_1, 'final_output.json')
-
-        logging.info("Final output saved to GCS as final_output.json")
-        return "Processing complete"
-    except Exception as e:
-        logging.error(f"Error in process_snippets: {e}")
-        return f"Error: {str(e)}"
-
-def generate_signed_url(bucket_name, blob_name):
-    logging.info(f"Generating signed URL for {bucket_name}/{blob_name}")
-    storage_client = storage.Client()
-    bucket = storage_client.bucket(bucket_name)
-    blob = bucket.blob(blob_name)
-
-    url = blob.generate_signed_url(
-        version="v4",
-        expiration=datetime.timedelta(minutes=15),
-        method="GET",
+    cached, query_embedding, version = cached_video_output(query, query_embedding, filters)
+    if cached is not None:
+        logging.info("Video results served from response cache")
+        if request_id:
+            get_auditor(get_credentials()).record(request_id, 'final_output', cached)
+        return cached
+
+    potential_groups, combined_texts = select_video_groups(query, query_embedding, request_id, filters)
+
+    # Generate the group summaries, batched into as few calls as possible; order matches potential_groups
+    summaries = generate_summaries(query, summary_contexts(potential_groups), model)
+
+    # Create the final output structure, only including relevant groups
+    final_output = []
+    for group, combined_text, summary in zip(potential_groups, combined_texts, summaries):
+        # Only process and store groups that are deemed relevant
+        if summary != "1":
+            # Add relevant group to final output
+            final_output.append({
+                "summary": summary,
+                "time_stamp": group_time_stamp(group),
+                "transcript": combined_text,
+                "cosine_scores": [snippet['cosine_score'] for snippet in group],
+                "document_id": group[0]['document_id'],
+                "video_url": group_video_url(group),
+            })
+        else:
+            logging.info("Skipping irrelevant group")
+
+    logging.info(f"Final output contains {len(final_output)} relevant groups")
+
+    # Responses with placeholder summaries are not worth replaying
+    if SUMMARY_PLACEHOLDER not in summaries:
+        get_response_cache().set("video", query, filters or {}, version, final_output, query_embedding)
+
+    # Persisting the output is optional and happens off the request path
+    if request_id:
+        get_auditor(get_credentials()).record(request_id, 'final_output', final_output)
+    return final_output
+
+def stream_video_events(query, model=None, query_embedding=None, request_id=None, filters=None):
+    # Ranked groups go out as soon as retrieval finishes; each summary follows as it streams in
+    potential_groups, combined_texts = select_video_groups(query, query_embedding, request_id, filters)
+    groups = [
+        {"index": i, "time_stamp": group_time_stamp(group), "video_url": group_video_url(group)}
+        for i, group in enumerate(potential_groups)
+    ]
+    yield {
+        "type": "groups",
+        "query": query,
+        "groups": groups,
+        "video_url": groups[0]["video_url"] if groups else default_video_url(filters)
+    }
+
+    events = stream_concurrently(
+        summary_contexts(potential_groups),
+        lambda text: generate_summary_stream(query, text, model),
+        max_concurrency=SUMMARY_CONCURRENCY,
+        timeout=SUMMARY_TIMEOUT_SECONDS,
+        placeholder=SUMMARY_PLACEHOLDER,
     )
+    for kind, i, text in events:
+        if kind == "delta":
+            yield {"type": "summary_delta", "index": i, "text": text}
+        elif text == "1":
+            logging.info("Skipping irrelevant group")
+            yield {"type": "skip", "index": i}
+        else:
+            yield {"type": "summary", "index": i, "time_stamp": group_time_stamp(potential_groups[i]), "summary": text}
+    yield {"type": "done"}
 
-    logging.info("Signed URL generated successfully")
-    return url
+# Result fields a process_input request can select
+VIDEO_RESULT_FIELDS = ("time_stamp", "summary", "document_id", "video_url")
+
+def simplify_video_output(final_output):
+    return [{
+        "time_stamp": item["time_stamp"],
+        "summary": item["summary"],
+        "document_id": item["document_id"],
+        "video_url": item["video_url"]
+    } for item in final_output]
 
 @functions_framework.http
 def process_input(request):
+    setup_cloud_logging()
     logging.info("Received request")
     # Set CORS headers for the preflight request
     if request.method == 'OPTIONS':
         headers = {
             'Access-Control-Allow-Origin': '*',
             'Access-Control-Allow-Methods': 'POST',
-            'Access-Control-Allow-Headers': 'Content-Type',
+            'Access-Control-Allow-Headers': 'Content-Type, Accept',
             'Access-Control-Max-Age': '3600'
         }
         return ('', 204, headers)
@@ -201,32 +344,137 @@ def process_input(request):
         query = request_json['input']
         logging.info(f"Received query: {query}")
 
-        # Process the query
-        result = process_snippets(query)
-        logging.info(f"Snippets processing result: {result}")
+        request_id = new_request_id()
+        filters = corpus_filters(request_json)
 
-        # Load the final output from GCS
-        final_output = load_from_gcs(BUCKET_NAME_1, 'final_output.json')
-        logging.info(f"Loaded final output with {len(final_output)} items")
+        stream_format = requested_stream_format(request, request_json)
+        if stream_format:
+            events = stream_video_events(query, request_id=request_id, filters=filters)
+            return stream_response(events, stream_format, headers)
 
-        # Create a simplified version for the website response
-        simplified_output = [{
-            "time_stamp": item["time_stamp"],
-            "summary": item["summary"]
-        } for item in final_output]
+        with start_trace("process_input", request_id=request_id) as trace, deadline(LLM_REQUEST_DEADLINE_SECONDS):
+            # Process the query; results stay in memory
+            final_output = process_snippets(query, request_id=request_id, filters=filters)
 
-        # Add video URL to the response
-        video_url = generate_signed_url(BUCKET_NAME_1, 'cornellLecture.mp4')
-        logging.info(f"Generated video URL: {video_url}")
+            # Create a simplified version for the website response
+            simplified_output = simplify_video_output(final_output)
 
-        response = {
-            "query": query,
-            "results": simplified_output,
-            "video_url": video_url
-        }
+            # Add video URL to the response: the lecture of the first result
+            video_url = simplified_output[0]["video_url"] if simplified_output else default_video_url(filters)
+            logging.info(f"Generated video URL: {video_url}")
+
+            response = {
+                "query": query,
+                "results": simplified_output,
+                "video_url": video_url
+            }
+            # Pagination and field selection as the request asks
+            shape_results(response, request_json, query, filters, VIDEO_RESULT_FIELDS)
+            if requested_timings(request, request_json):
+                response["timings"] = trace.timings()
 
         logging.info("Sending response")
-        return (json.dumps(response), 200, headers)
+        return json_response(response, 200, headers, request)
+    except RequestFormatError as e:
+        return json_response({"error": str(e)}, 400, headers, request)
+    except Exception as e:
+        logging.error(f"Error processing request: {e}")
+        return json_response({"error": str(e)}, 500, headers, request)
+
+def video_section(query, query_embedding=None, request_id=None, filters=None):
+    final_output = process_snippets(query, query_embedding=query_embedding, request_id=request_id, filters=filters)
+    results = simplify_video_output(final_output)
+    return {
+        "results": results,
+        "video_url": results[0]["video_url"] if results else default_video_url(filters)
+    }
+
+def pdf_section(query, query_embedding=None, request_id=None, filters=None):
+    snippets, relation_summary = pdf_results(
+        query, top_k=20, query_embedding=query_embedding, credentials=get_credentials(), **(filters or {}))
+    return {
+        "relation_summary": relation_summary,
+        "results": [round_result(result) for result in format_pdf_results(snippets)],
+        "pdf_url": snippets[0]['pdf_url'] if snippets else get_corpus(get_credentials()).default_media_url("pdf", **(filters or {}))
+    }
+
+def combined_sections(query, filters=None):
+    # Embed once, then run transcript and PDF retrieval+summarization side by side.
+    # Yields (name, section) pairs in completion order.
+    query_embedding = embed_text(texts=[query])[0]
+    request_id = new_request_id()
+    builders = {"video": video_section, "pdf": pdf_section}
+    with ThreadPoolExecutor(max_workers=len(builders)) as executor:
+        futures = {
+            executor.submit(bind(build), query, query_embedding, request_id, filters): name
+            for name, build in builders.items()
+        }
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                yield name, future.result()
+            except Exception as e:
+                logging.error(f"Error building {name} results: {e}")
+                yield name, {"error": str(e)}
+
+@functions_framework.http
+def process_query(request):
+    setup_cloud_logging()
+    logging.info("Received combined request")
+    # Set CORS headers for the preflight request
+    if request.method == 'OPTIONS':
+        headers = {
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Allow-Methods': 'POST',
+            'Access-Control-Allow-Headers': 'Content-Type, Accept',
+            'Access-Control-Max-Age': '3600'
+        }
+        return ('', 204, headers)
+
+    # Set CORS headers for the main request
+    headers = {
+        'Access-Control-Allow-Origin': '*'
+    }
+
+    try:
+        request_json = request.get_json(silent=True)
+        query = request_json['input']
+        logging.info(f"Received query: {query}")
+
+        filters = corpus_filters(request_json)
+
+        stream_format = requested_stream_format(request, request_json)
+        if stream_format:
+            def events():
+                yield {"type": "query", "query": query}
+                for name, section in combined_sections(query, filters):
+                    yield {"type": name, **section}
+                yield {"type": "done"}
+            return stream_response(events(), stream_format, headers)
+
+        with start_trace("process_query") as trace, deadline(LLM_REQUEST_DEADLINE_SECONDS):
+            response = {"query": query}
+            response.update(combined_sections(query, filters))
+            if requested_timings(request, request_json):
+                response["timings"] = trace.timings()
+
+        logging.info("Sending combined response")
+        return json_response(response, 200, headers, request)
     except Exception as e:
         logging.error(f"Error processing request: {e}")
-        return (json.dumps({"error": str(e)}), 500, headers)
\ No newline at end of file
+        return json_response({"error": str(e)}, 500, headers, request)
+
+def answer_catalogue_query(query):
+    # Everything process_input and process_query compute for an unfiltered query;
+    # the results land in the response cache, where precompute() collects them
+    filters = corpus_filters({})
+    query_embedding = embed_text(texts=[query])[0]
+    process_snippets(query, query_embedding=query_embedding, filters=filters)
+    pdf_section(query, query_embedding, filters=filters)
+
+def load_precomputed_answers():
+    warm_precomputed(answer_catalogue_query, credentials=get_credentials())
+
+# Catalogue answers precomputed by otherScripts/warm_cache.py load in the background
+if PRECOMPUTED_ANSWERS:
+    prewarm(load_precomputed_answers)
@@ -0,0 +1,168 @@
+# Shared by gcp_nxs-function and gcp_pdf-retrieval-function. Each Cloud Function
+# deploys only its own directory, so keep both copies of this file identical.
+import logging
+import os
+from typing import List
+from context_assembly import relation_context
+from corpus import get_corpus
+from embedding_client import get_client
+from lexical import preprocess_text
+from response_cache import get_response_cache
+from response_format import RequestFormatError
+from llm import generate
+from runtime import generative_model
+from summary_cache import cache_key, get_cache
+from tracing import span
+
+MODEL_NAME = "gemini-1.0-pro"
+EMBEDDING_MODEL = "text-embedding-004"
+BUCKET_NAME = "nxs_bucket1"
+PDF_BLOB = "IntroMLpaper.pdf"
+
+GenAI_modelConfig = {"max_output_tokens": 250}
+RELATION_SUMMARY_PLACEHOLDER = "Unable to generate relation summary due to an error."
+
+RELATION_PROMPT_TEMPLATE = """
+You are Nexus.AI: an AI tutor assisting college students in their research process.
+Your task is to explain how the following text snippets relate to the student's query.
+Important: Do not answer the query directly. Instead, guide the student towards understanding
+how these snippets are relevant to their question.
+
+Student's Query: {query}
+
+{snippets_text}
+
+Provide a concise explanation (about 3-4 sentences) on how these snippets relate to the query.
+Focus on the relevance of the information and how it might help answer the query, without giving away the answer.
+
+YourNXS:"""
+
+def embed_text(texts: List[str], model_name: str = EMBEDDING_MODEL) -> List[List[float]]:
+    # Same task type and dimensionality as the transcript function, so both share cached query embeddings
+    return get_client(model_name).embed(texts, "RETRIEVAL_QUERY", 768)
+
+def retrieve_pdf_snippets(query, top_k=20, query_embedding=None, course=None, document_ids=None, credentials=None):
+    # Searches every registered PDF (optionally filtered by course/document) and merges the top hits
+    logging.info(f"Retrieving PDF snippets for query: {query}")
+    if query_embedding is None:
+        query_embedding = embed_text([query])[0]
+
+    corpus = get_corpus(credentials)
+    hits = corpus.search(query_embedding, top_k, doc_type="pdf", course=course, document_ids=document_ids,
+                         query_text=query, with_rows=True)
+
+    top_snippets = [
+        {
+            'chunk_text': record['chunk_text'] if 'chunk_text' in record else preprocess_text(record['chunk']),
+            'page': record['page'],
+            'coordinates': record['coordinates'],
+            'similarity': score,
+            'document_id': document.id,
+            'pdf_url': corpus.media_url(document.id),
+            'row': row
+        }
+        for score, document, record, row in hits
+    ]
+    logging.info(f"Retrieved {len(top_snippets)} PDF snippets")
+    return top_snippets
+
+# Result fields a request can select; "id" fetches the text later through fetch_pdf_chunks
+PDF_RESULT_FIELDS = ('id', 'text', 'page_number', 'coordinates', 'similarity', 'document_id', 'pdf_url')
+# Most chunk ids one fetch_pdf_chunks request may ask for
+PDF_MAX_CHUNK_IDS = int(os.environ.get('PDF_MAX_CHUNK_IDS', '100'))
+
+def chunk_id(document_id, row):
+    return f"{document_id}:{row}" if row is not None else None
+
+def format_pdf_results(snippets):
+    return [
+        {
+            'id': chunk_id(snippet['document_id'], snippet.get('row')),
+            'text': snippet['chunk_text'],
+            'page_number': snippet['page'],
+            'coordinates': snippet['coordinates'],
+            'similarity': snippet['similarity'],
+            'document_id': snippet['document_id'],
+            'pdf_url': snippet['pdf_url']
+        }
+        for snippet in snippets
+    ]
+
+def fetch_pdf_chunks(ids, credentials=None):
+    # Text and position of chunks by the ids of an earlier response, for clients
+    # that asked for fewer fields first; no embedding or LLM call
+    if not isinstance(ids, list) or not all(isinstance(chunk, str) for chunk in ids):
+        raise RequestFormatError("chunks must be a list of chunk id strings")
+    if len(ids) > PDF_MAX_CHUNK_IDS:
+        raise RequestFormatError(f"At most {PDF_MAX_CHUNK_IDS} chunks can be fetched at once")
+    corpus = get_corpus(credentials)
+    chunks = []
+    for chunk in ids:
+        document_id, _, row = chunk.rpartition(':')
+        try:
+            document = corpus.documents.get(document_id)
+            if document is None or document.type != 'pdf' or not row.isdigit():
+                raise KeyError(chunk)
+            record = corpus.record(document_id, int(row))
+            chunks.append({
+                'id': chunk,
+                'text': record['chunk_text'] if 'chunk_text' in record else preprocess_text(record['chunk']),
+                'page_number': record['page'],
+                'coordinates': record['coordinates'],
+                'document_id': document_id,
+            })
+        except (KeyError, IndexError, ValueError):
+            raise KeyError(f"Unknown chunk id {chunk}")
+    return chunks
+
+def generate_relation_summary(query, top_snippets, model=None, corpus=None):
+    logging.info(f"Generating relation summary for query: {query}")
+    # Diverse, de-duplicated chunks within the token budget rather than the top 5 as they are
+    passages = relation_context(top_snippets, corpus or get_corpus())
+    snippets_text = "\n\n".join([f"Snippet {i+1}: {text}" for i, text in enumerate(passages)])
+    key = cache_key(query, snippets_text, MODEL_NAME, GenAI_modelConfig, RELATION_PROMPT_TEMPLATE)
+    cached = get_cache().get(key)
+    if cached is not None:
+        logging.info("Relation summary served from cache")
+        return cached
+    try:
+        model = model or generative_model(MODEL_NAME)
+        prompt = RELATION_PROMPT_TEMPLATE.format(query=query, snippets_text=snippets_text)
+
+        with span("llm", call="relation_summary"):
+            response = generate(model, prompt, GenAI_modelConfig)
+
+        summary = response.text.strip()
+        get_cache().set(key, summary)
+        logging.info("Relation summary generated successfully")
+        return summary
+    except Exception as e:
+        logging.error(f"Error generating relation summary: {e}")
+        return RELATION_SUMMARY_PLACEHOLDER
+
+def pdf_results(query, top_k=20, query_embedding=None, course=None, document_ids=None, credentials=None, model=None):
+    # Snippets plus relation summary. A repeated or near-identical query (same
+    # filters, unchanged PDFs) is answered from the response cache without
+    # retrieval or an LLM call; only the signed URLs are refreshed.
+    corpus = get_corpus(credentials)
+    cache = get_response_cache()
+    filters = {"course": course, "document_ids": document_ids}
+    namespace = f"pdf:{top_k}"
+    version = corpus.version("pdf", course, document_ids)
+    cached = cache.get(namespace, query, filters, version, count_miss=False)
+    if cached is None:
+        if query_embedding is None:
+            query_embedding = embed_text([query])[0]
+        cached = cache.get(namespace, query, filters, version, query_embedding)
+    if cached is not None:
+        logging.info("PDF results served from response cache")
+        for snippet in cached["snippets"]:
+            snippet['pdf_url'] = corpus.media_url(snippet['document_id'])
+        return cached["snippets"], cached["relation_summary"]
+
+    snippets = retrieve_pdf_snippets(query, top_k, query_embedding, course, document_ids, credentials)
+    relation_summary = generate_relation_summary(query, snippets, model, corpus)
+    if relation_summary != RELATION_SUMMARY_PLACEHOLDER:
+        cache.set(namespace, query, filters, version, {"snippets": snippets, "relation_summary": relation_summary},
+                  query_embedding)
+    return snippets, relation_summary
@@ -0,0 +1,176 @@
+# Shared by gcp_nxs-function and gcp_pdf-retrieval-function. Each Cloud Function
+# deploys only its own directory, so keep both copies of this file identical.
+#
+# Response encoding for the HTTP handlers. A request can ask for less than the
+# full result list:
+#   {"limit": 5}                       the first 5 results, with "page.next_cursor" if more remain
+#   {"cursor": "<next_cursor>"}        the next page (same size) for the same query and filters
+#   {"offset": 10, "limit": 5}         a page by position
+#   {"fields": ["id", "page_number", "coordinates"]}   only these fields of each result
+# Without them the full list comes back as before. Scores and coordinates are
+# rounded, the body is encoded with orjson when it is installed, and it is gzip or
+# brotli compressed when the client's Accept-Encoding allows and it is big enough.
+import base64
+import gzip
+import hashlib
+import json
+import os
+
+from summary_cache import normalize_query
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+RESPONSE_SCORE_DIGITS = int(os.environ.get('RESPONSE_SCORE_DIGITS', '4'))
+RESPONSE_COORDINATE_DIGITS = int(os.environ.get('RESPONSE_COORDINATE_DIGITS', '2'))
+RESPONSE_MAX_LIMIT = int(os.environ.get('RESPONSE_MAX_LIMIT', '100'))
+RESPONSE_COMPRESSION = os.environ.get('RESPONSE_COMPRESSION', '1') == '1'
+# Smaller bodies gain less from compression than it costs
+RESPONSE_COMPRESS_MIN_BYTES = int(os.environ.get('RESPONSE_COMPRESS_MIN_BYTES', '1024'))
+RESPONSE_GZIP_LEVEL = int(os.environ.get('RESPONSE_GZIP_LEVEL', '6'))
+RESPONSE_BROTLI_QUALITY = int(os.environ.get('RESPONSE_BROTLI_QUALITY', '5'))
+
+SCORE_FIELDS = ('similarity', 'cosine_score')
+COORDINATE_FIELDS = ('coordinates',)
+
+
+class RequestFormatError(ValueError):
+    # Malformed pagination or field selection; the handlers answer it with a 400
+    pass
+
+
+def dumps(value):
+    # JSON as UTF-8 bytes
+    if orjson is not None:
+        return orjson.dumps(value, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(value, separators=(',', ':')).encode('utf-8')
+
+
+def query_fingerprint(query, filters=None):
+    # Ties a cursor to the query and filters it was issued for
+    key = json.dumps([normalize_query(query), filters or {}], sort_keys=True)
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()[:12]
+
+
+def encode_cursor(offset, limit, fingerprint):
+    raw = f"{offset}:{limit}:{fingerprint}".encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, fingerprint):
+    # (offset, limit) of the page the cursor points at
+    try:
+        raw = base64.urlsafe_b64decode(str(cursor) + '=' * (-len(str(cursor)) % 4)).decode('utf-8')
+        offset, limit, issued_for = raw.split(':')
+        offset, limit = int(offset), int(limit)
+    except ValueError:
+        raise RequestFormatError("Invalid cursor")
+    if issued_for != fingerprint:
+        raise RequestFormatError("Cursor was issued for a different query")
+    return offset, limit
+
+
+def requested_page(request_json, fingerprint):
+    # (offset, limit), or None when the request does not paginate
+    request_json = request_json or {}
+    cursor, offset, limit = request_json.get('cursor'), request_json.get('offset'), request_json.get('limit')
+    if cursor is None and offset is None and limit is None:
+        return None
+    if cursor is not None:
+        offset, cursor_limit = decode_cursor(cursor, fingerprint)
+        limit = cursor_limit if limit is None else limit
+    try:
+        offset = int(offset or 0)
+        limit = RESPONSE_MAX_LIMIT if limit is None else int(limit)
+    except (TypeError, ValueError):
+        raise RequestFormatError("offset and limit must be integers")
+    if offset < 0 or not 0 < limit <= RESPONSE_MAX_LIMIT:
+        raise RequestFormatError(f"offset must be >= 0 and limit between 1 and {RESPONSE_MAX_LIMIT}")
+    return offset, limit
+
+
+def requested_fields(request_json, available):
+    # Tuple of result fields to keep, or None for all of them
+    fields = (request_json or {}).get('fields')
+    if fields is None:
+        return None
+    if isinstance(fields, str):
+        fields = [field.strip() for field in fields.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in available]
+    if unknown or not fields:
+        raise RequestFormatError(f"Unknown fields {unknown}; available: {list(available)}")
+    return tuple(fields)
+
+
+def round_result(result):
+    rounded = dict(result)
+    for field in SCORE_FIELDS:
+        if isinstance(rounded.get(field), float):
+            rounded[field] = round(rounded[field], RESPONSE_SCORE_DIGITS)
+    for field in COORDINATE_FIELDS:
+        if isinstance(rounded.get(field), (list, tuple)):
+            rounded[field] = [round(float(value), RESPONSE_COORDINATE_DIGITS) for value in rounded[field]]
+    return rounded
+
+
+def shape_results(response, request_json, query, filters, available):
+    # Applies the request's pagination and field selection to response["results"]
+    # and rounds what is left. A paginated response gets a "page" entry.
+    fingerprint = query_fingerprint(query, filters)
+    page = requested_page(request_json, fingerprint)
+    fields = requested_fields(request_json, available)
+    results = response["results"]
+    if page is not None:
+        offset, limit = page
+        total = len(results)
+        results = results[offset:offset + limit]
+        next_cursor = encode_cursor(offset + limit, limit, fingerprint) if offset + limit < total else None
+        response["page"] = {"offset": offset, "limit": limit, "total": total, "next_cursor": next_cursor}
+    if fields is not None:
+        results = [{field: result.get(field) for field in fields} for result in results]
+    response["results"] = [round_result(result) for result in results]
+    return response
+
+
+def negotiated_encoding(request):
+    # "br" or "gzip" as allowed by Accept-Encoding (q=0 excludes), or None
+    header = (getattr(request, 'headers', None) or {}).get('Accept-Encoding', '')
+    accepted = {}
+    for part in header.split(','):
+        name, _, params = part.strip().partition(';')
+        quality = 1.0
+        if params.strip().startswith('q='):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+    wildcard = accepted.get('*', 0.0)
+    if brotli is not None and accepted.get('br', wildcard) > 0:
+        return 'br'
+    if accepted.get('gzip', wildcard) > 0:
+        return 'gzip'
+    return None
+
+
+def json_response(body, status, headers, request=None):
+    # (body bytes, status, headers) for the functions framework
+    data = dumps(body)
+    headers = dict(headers, **{'Content-Type': 'application/json'})
+    if RESPONSE_COMPRESSION:
+        headers['Vary'] = 'Accept-Encoding'
+        encoding = negotiated_encoding(request) if len(data) >= RESPONSE_COMPRESS_MIN_BYTES else None
+        if encoding == 'br':
+            data = brotli.compress(data, quality=RESPONSE_BROTLI_QUALITY)
+        elif encoding == 'gzip':
+            data = gzip.compress(data, compresslevel=RESPONSE_GZIP_LEVEL, mtime=0)
+        if encoding:
+            headers['Content-Encoding'] = encoding
+    return (data, status, headers)
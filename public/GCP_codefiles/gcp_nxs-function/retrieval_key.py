@@ -1,25 +1,10 @@
-import vertexai
-from vertexai.language_models import TextEmbeddingInput, TextEmbeddingModel
-import json
 from typing import List, Optional
-import numpy as np
-from numpy.linalg import norm
-import pandas as pd
-from google.cloud import storage
-import os
-from google.oauth2 import service_account
+from audit_sink import get_auditor
+from embedding_client import get_client
+from corpus import get_corpus
+from runtime import get_credentials
 
-credentials = service_account.Credentials.from_service_account_file(
-    os.environ['GOOGLE_APPLICATION_CREDENTIALS'])
-
-
-
-PROJECT_ID = "silver-idea-432502-c0"
-REGION = "us-central1"
 MODEL_ID = "text-embedding-004"
-BUCKET_NAME_1 = "nxs_bucket1"
-
-vertexai.init(project=PROJECT_ID, location=REGION, credentials=credentials)
 
 def embed_text(
     texts: List[str],
@@ -27,43 +12,30 @@ def embed_text(
     model_name: str = "text-embedding-004",
     dimensionality: Optional[int] = 768,
 ) -> List[List[float]]:
-    model = TextEmbeddingModel.from_pretrained(model_name)
-    inputs = [TextEmbeddingInput(text, task) for text in texts]
-    kwargs = dict(output_dimensionality=dimensionality) if dimensionality else {}
-    embeddings = model.get_embeddings(inputs, **kwargs)
-    return [embedding.values for embedding in embeddings]
-
-def load_data():
-    storage_client = storage.Client(credentials=credentials)
-    bucket = storage_client.bucket(BUCKET_NAME_1)
-    blob = bucket.blob('transcription_embeddings.json')
-    data = json.loads(blob.download_as_string())
-    return data
-
-def cosine_similarity(vector_a, vector_b):
-    vector_a = np.array(vector_a)
-    vector_b = np.array(vector_b)
-    cosine_score = np.dot(vector_a,vector_b)/(norm(vector_a)*norm(vector_b))
-    return cosine_score
-
-def retrieve(query):
-    data = load_data()
-    embed_query = embed_text(texts=[query])
-    df_data = {
-        "transcript": [transcript["transcript"] for transcript in data],
-        "time_stamp": [time_stamp["time_stamp"] for time_stamp in data],
-        "embeddings": [embedding["embeddings"] for embedding in data]
-    }
-    cosine_scores = [cosine_similarity(embedding["embeddings"], embed_query[0]) for embedding in data]
-    df_data["cosine_score"] = cosine_scores
-    df = pd.DataFrame(df_data)
-    df.sort_values(by=["cosine_score"], ascending=False, inplace=True)
-    
-    top_14 = df[["transcript", "time_stamp", "cosine_score"]].head(14).to_dict('records')
-    
-    storage_client = storage.Client(credentials=credentials)
-    bucket = storage_client.bucket(BUCKET_NAME_1)
-    blob = bucket.blob('retrieved_segments.json')
-    blob.upload_from_string(json.dumps(top_14, indent=2))
+    return get_client(model_name).embed(texts, task, dimensionality)
+
+def retrieve(query, top_k=14, query_embedding=None, request_id=None, course=None, document_ids=None):
+    # Searches every registered lecture (optionally filtered by course/document) and merges the top hits
+    if query_embedding is None:
+        query_embedding = embed_text(texts=[query])[0]
+
+    hits = get_corpus(get_credentials()).search(
+        query_embedding, top_k, doc_type="video", course=course, document_ids=document_ids, query_text=query,
+        with_rows=True)
+    top_14 = [
+        {
+            "transcript": record["transcript"],
+            "time_stamp": record["time_stamp"],
+            "start_seconds": record.get("start_seconds"),
+            "end_seconds": record.get("end_seconds"),
+            "cosine_score": score,
+            "document_id": document.id,
+            "row": row,
+        }
+        for score, document, record, row in hits
+    ]
+
+    if request_id:
+        get_auditor(get_credentials()).record(request_id, 'retrieved_segments', top_14)
 
     return top_14
@@ -0,0 +1,104 @@
+# Shared by gcp_nxs-function and gcp_pdf-retrieval-function. Each Cloud Function
+# deploys only its own directory, so keep both copies of this file identical.
+#
+# Process-wide clients, created on first use. Nothing here imports a Google
+# library or reads the service account key at import time, so loading main.py
+# (the cold start) stays cheap; prewarm() can start the slow parts in the
+# background while the first request is being parsed.
+import logging
+import os
+import threading
+
+PROJECT_ID = "silver-idea-432502-c0"
+REGION = "us-central1"
+CREDENTIALS_FILE = os.environ.get('GOOGLE_APPLICATION_CREDENTIALS', 'nxs-txtembed-sa-key.json')
+# Start Vertex AI and Cloud Logging initialization in a background thread at import
+RUNTIME_PREWARM = os.environ.get('RUNTIME_PREWARM', '1') == '1'
+# Route the root logger to Cloud Logging; off for local runs and benchmarks
+CLOUD_LOGGING = os.environ.get('CLOUD_LOGGING', '1') == '1'
+
+_lock = threading.RLock()
+_credentials = None
+_credentials_loaded = False
+_vertexai_ready = False
+_cloud_logging_ready = False
+_models = {}
+
+
+def get_credentials():
+    global _credentials, _credentials_loaded
+    if not _credentials_loaded:
+        with _lock:
+            if not _credentials_loaded:
+                from google.oauth2 import service_account
+                logging.info(f"Loading credentials from {CREDENTIALS_FILE}")
+                _credentials = service_account.Credentials.from_service_account_file(CREDENTIALS_FILE)
+                _credentials_loaded = True
+    return _credentials
+
+
+def set_credentials(credentials):
+    # Swap in other credentials (None for application default) for tests and benchmarks
+    global _credentials, _credentials_loaded
+    with _lock:
+        _credentials = credentials
+        _credentials_loaded = True
+
+
+def init_vertexai(credentials=None):
+    global _vertexai_ready
+    with _lock:
+        import vertexai
+        vertexai.init(project=PROJECT_ID, location=REGION, credentials=credentials)
+        _vertexai_ready = True
+
+
+def ensure_vertexai():
+    if not _vertexai_ready:
+        with _lock:
+            if not _vertexai_ready:
+                init_vertexai(get_credentials())
+
+
+def setup_cloud_logging():
+    global _cloud_logging_ready
+    if CLOUD_LOGGING and not _cloud_logging_ready:
+        with _lock:
+            if not _cloud_logging_ready:
+                import google.cloud.logging
+                # Connects the logger to the root logging handler
+                google.cloud.logging.Client().setup_logging()
+                _cloud_logging_ready = True
+
+
+def generative_model(model_name):
+    model = _models.get(model_name)
+    if model is None:
+        ensure_vertexai()
+        with _lock:
+            model = _models.get(model_name)
+            if model is None:
+                from vertexai.generative_models import GenerativeModel
+                model = _models[model_name] = GenerativeModel(model_name)
+    return model
+
+
+def set_generative_model(model_name, model):
+    # Swap in another model object (anything with generate_content) for tests and benchmarks
+    with _lock:
+        _models[model_name] = model
+
+
+def prewarm(*steps):
+    # Runs the initialization steps in a daemon thread; callers still go through
+    # the getters above, which wait on the same lock if a step is in progress
+    def run():
+        for step in steps:
+            try:
+                step()
+            except Exception as e:
+                logging.warning(f"Prewarm step {step.__name__} failed: {e}")
+
+    thread = threading.Thread(target=run, name="runtime-prewarm", daemon=True)
+    thread.start()
+    return thread
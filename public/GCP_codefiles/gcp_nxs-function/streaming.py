@@ -0,0 +1,46 @@
+import logging
+
+from flask import Response
+
+from response_format import dumps
+
+STREAM_MIMETYPES = {
+    "ndjson": "application/x-ndjson",
+    "sse": "text/event-stream",
+}
+
+
+def requested_stream_format(request, request_json):
+    # Streaming is opt-in: {"stream": true | "ndjson" | "sse"} in the body, or an Accept header
+    stream = (request_json or {}).get('stream')
+    if stream is True:
+        return "ndjson"
+    if stream in STREAM_MIMETYPES:
+        return stream
+    accept = request.headers.get('Accept', '')
+    for fmt, mimetype in STREAM_MIMETYPES.items():
+        if mimetype in accept:
+            return fmt
+    return None
+
+
+def encode_event(event, fmt):
+    payload = dumps(event).decode('utf-8')
+    if fmt == "sse":
+        return f"event: {event['type']}\ndata: {payload}\n\n"
+    return payload + "\n"
+
+
+def stream_response(events, fmt, headers):
+    def body():
+        try:
+            for event in events:
+                yield encode_event(event, fmt)
+        except Exception as e:
+            logging.error(f"Error while streaming response: {e}")
+            yield encode_event({"type": "error", "error": str(e)}, fmt)
+
+    stream_headers = dict(headers)
+    stream_headers['Cache-Control'] = 'no-cache'
+    stream_headers['X-Accel-Buffering'] = 'no'
+    return Response(body(), status=200, mimetype=STREAM_MIMETYPES[fmt], headers=stream_headers)
@@ -0,0 +1,220 @@
+# Shared by gcp_nxs-function and gcp_pdf-retrieval-function. Each Cloud Function
+# deploys only its own directory, so keep both copies of this file identical.
+import json
+import logging
+import os
+import queue
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from llm import deadline_at
+
+# Summarize several groups/chunks with one generate_content call that returns a JSON array
+SUMMARY_BATCH_MODE = os.environ.get('SUMMARY_BATCH_MODE', '1') == '1'
+# Prompt plus expected output must fit the model context (gemini-1.0-pro: 30720 input tokens)
+SUMMARY_BATCH_CONTEXT_TOKENS = int(os.environ.get('SUMMARY_BATCH_CONTEXT_TOKENS', '30000'))
+# gemini-1.0-pro returns at most 2048 tokens, which caps the summaries per batch
+SUMMARY_BATCH_MAX_OUTPUT_TOKENS = int(os.environ.get('SUMMARY_BATCH_MAX_OUTPUT_TOKENS', '2048'))
+# Rough English average for Gemini's tokenizer; only used to size batches
+CHARS_PER_TOKEN = 4
+
+
+def summarize_concurrently(items, summarize, max_concurrency=4, timeout=20.0, placeholder=None):
+    # Runs summarize(item) for every item on a bounded thread pool. Results keep
+    # the input order; a call that raises or runs longer than `timeout` seconds
+    # (measured from when it starts, not from when it was queued) yields `placeholder`,
+    # as does every call still pending at the request's LLM deadline (llm.deadline)
+    # or queued behind workers that are all stuck in timed-out calls.
+    results = [placeholder] * len(items)
+    if not items:
+        return results
+
+    started = {}
+    request_deadline = deadline_at()
+
+    def run(i, item):
+        started[i] = time.monotonic()
+        return summarize(item)
+
+    workers = max(1, min(max_concurrency, len(items)))
+    executor = ThreadPoolExecutor(max_workers=workers)
+    futures = {executor.submit(run, i, item): i for i, item in enumerate(items)}
+    pending = set(futures)
+    abandoned = set()
+    try:
+        while pending:
+            deadlines = [started[futures[f]] + timeout for f in pending if futures[f] in started]
+            if request_deadline is not None:
+                deadlines.append(request_deadline)
+            wait_for = max(0.0, min(deadlines) - time.monotonic()) if deadlines else timeout
+            done, pending = wait(pending, timeout=wait_for, return_when=FIRST_COMPLETED)
+            for future in done:
+                i = futures[future]
+                try:
+                    results[i] = future.result()
+                except Exception as e:
+                    logging.error(f"Summary {i} failed: {e}")
+
+            now = time.monotonic()
+            if request_deadline is not None and now >= request_deadline:
+                logging.warning(f"Abandoning {len(pending)} summaries at the request deadline")
+                break
+            expired = {f for f in pending if futures[f] in started and now - started[futures[f]] >= timeout}
+            for future in expired:
+                logging.warning(f"Summary {futures[future]} timed out after {timeout}s")
+            pending -= expired
+            # A timed-out call keeps its worker thread until it returns
+            abandoned = {f for f in abandoned | expired if not f.done()}
+            if pending and len(abandoned) >= workers:
+                logging.warning(f"Abandoning {len(pending)} summaries queued behind timed-out calls")
+                break
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    return results
+
+
+def stream_concurrently(items, summarize_stream, max_concurrency=4, timeout=20.0, placeholder=None):
+    # Streaming counterpart of summarize_concurrently. summarize_stream(item) yields
+    # text chunks; this yields ("delta", i, chunk) as chunks arrive and exactly one
+    # ("summary", i, text) per item, in completion order.
+    events = queue.Queue()
+    started = {}
+    returned = set()
+    finished = set()
+
+    def run(i, item):
+        started[i] = time.monotonic()
+        parts = []
+        try:
+            for chunk in summarize_stream(item):
+                parts.append(chunk)
+                events.put(("delta", i, chunk))
+            events.put(("summary", i, "".join(parts).strip()))
+        except Exception as e:
+            logging.error(f"Summary {i} failed: {e}")
+            events.put(("summary", i, placeholder))
+        finally:
+            returned.add(i)
+
+    if not items:
+        return
+    workers = max(1, min(max_concurrency, len(items)))
+    executor = ThreadPoolExecutor(max_workers=workers)
+    for i, item in enumerate(items):
+        executor.submit(run, i, item)
+    try:
+        while len(finished) < len(items):
+            now = time.monotonic()
+            for i, start in list(started.items()):
+                if i not in finished and now - start >= timeout:
+                    logging.warning(f"Summary {i} timed out after {timeout}s")
+                    finished.add(i)
+                    yield "summary", i, placeholder
+            if len(finished) == len(items):
+                break
+            # Every worker is stuck in a timed-out call, so queued items would never start
+            if len([i for i in finished if i in started and i not in returned]) >= workers:
+                for i in range(len(items)):
+                    if i not in finished:
+                        logging.warning(f"Summary {i} abandoned behind timed-out calls")
+                        finished.add(i)
+                        yield "summary", i, placeholder
+                break
+
+            deadlines = [start + timeout for i, start in list(started.items()) if i not in finished]
+            wait_for = max(0.0, min(deadlines) - time.monotonic()) if deadlines else timeout
+            try:
+                kind, i, text = events.get(timeout=wait_for)
+            except queue.Empty:
+                continue
+            if i in finished:
+                continue
+            if kind == "summary":
+                finished.add(i)
+            yield kind, i, text
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def pack_batches(costs, budget, fixed_cost=0, max_items=None):
+    # Greedy, order-preserving split of item indices into batches whose summed cost
+    # plus fixed_cost stays within budget. An item too large on its own gets a batch
+    # to itself.
+    batches = []
+    current, used = [], fixed_cost
+    for i, cost in enumerate(costs):
+        if current and (used + cost > budget or (max_items and len(current) >= max_items)):
+            batches.append(current)
+            current, used = [], fixed_cost
+        current.append(i)
+        used += cost
+    if current:
+        batches.append(current)
+    return batches
+
+
+def parse_summary_array(text, count):
+    # Reads [{"id": 1, "summary": "..."}, ...] (or a bare array of strings) out of a
+    # model response, tolerating code fences and surrounding prose. Returns one entry
+    # per slot, None where the response has no usable summary.
+    results = [None] * count
+    start, end = text.find('['), text.rfind(']')
+    if start < 0 or end < start:
+        return results
+    try:
+        items = json.loads(text[start:end + 1])
+    except ValueError:
+        return results
+    if not isinstance(items, list):
+        return results
+    for position, item in enumerate(items):
+        if isinstance(item, dict):
+            slot, summary = item.get('id', position + 1), item.get('summary')
+        else:
+            slot, summary = position + 1, item
+        if isinstance(slot, str) and slot.strip().isdigit():
+            slot = int(slot)
+        if type(slot) is int and 1 <= slot <= count and isinstance(summary, str) and summary.strip():
+            results[slot - 1] = summary.strip()
+    return results
+
+
+def summarize_batched(items, summarize_batch, summarize_one, costs, fixed_cost=0, budget=SUMMARY_BATCH_CONTEXT_TOKENS,
+                      max_items=None, max_concurrency=4, timeout=20.0, placeholder=None):
+    # Packs items into as few summarize_batch(batch) calls as the token budget
+    # allows; each returns one summary (or None) per item. Items whose batch failed,
+    # timed out or came back without their slot are retried with summarize_one(item).
+    # Results keep the input order, like summarize_concurrently.
+    if not items:
+        return []
+    batches = pack_batches(costs, budget, fixed_cost, max_items)
+    batch_results = summarize_concurrently(
+        batches,
+        lambda batch: summarize_batch([items[i] for i in batch]),
+        max_concurrency=max_concurrency,
+        timeout=timeout,
+        placeholder=None,
+    )
+    results = [None] * len(items)
+    for batch, summaries in zip(batches, batch_results):
+        for i, summary in zip(batch, summaries or []):
+            results[i] = summary
+
+    missing = [i for i, summary in enumerate(results) if summary is None]
+    if missing:
+        logging.warning(f"Batched summaries missing {len(missing)} of {len(items)} items, summarizing them one by one")
+        retried = summarize_concurrently(
+            [items[i] for i in missing],
+            summarize_one,
+            max_concurrency=max_concurrency,
+            timeout=timeout,
+            placeholder=placeholder,
+        )
+        for i, summary in zip(missing, retried):
+            results[i] = summary
+    logging.info(f"Summarized {len(items)} items in {len(batches)} batched calls and {len(missing)} single calls")
+    return results
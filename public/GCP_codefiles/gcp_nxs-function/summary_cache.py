@@ -0,0 +1,185 @@
+# Shared by gcp_nxs-function and gcp_pdf-retrieval-function. Each Cloud Function
+# deploys only its own directory, so keep both copies of this file identical.
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+SUMMARY_CACHE_TTL_SECONDS = float(os.environ.get('SUMMARY_CACHE_TTL_SECONDS', str(7 * 24 * 3600)))
+SUMMARY_CACHE_MEMORY_ENTRIES = int(os.environ.get('SUMMARY_CACHE_MEMORY_ENTRIES', '1024'))
+SUMMARY_CACHE_DISK_ENTRIES = int(os.environ.get('SUMMARY_CACHE_DISK_ENTRIES', '20000'))
+# Empty string disables the persistent tier
+SUMMARY_CACHE_PATH = os.environ.get('SUMMARY_CACHE_PATH', '/tmp/nxs_summary_cache.sqlite3')
+
+
+def normalize_query(query):
+    return " ".join(query.lower().split())
+
+
+def _config_repr(generation_config):
+    if generation_config is None:
+        return None
+    to_dict = getattr(generation_config, 'to_dict', None)
+    if callable(to_dict):
+        return to_dict()
+    return repr(generation_config)
+
+
+def cache_key(query, text, model_name, generation_config, prompt_template):
+    payload = json.dumps(
+        [normalize_query(query), text, model_name, _config_repr(generation_config), prompt_template],
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class MemoryTier:
+    def __init__(self, max_entries=SUMMARY_CACHE_MEMORY_ENTRIES, ttl=SUMMARY_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.time() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteTier:
+    def __init__(self, path=SUMMARY_CACHE_PATH, max_entries=SUMMARY_CACHE_DISK_ENTRIES, ttl=SUMMARY_CACHE_TTL_SECONDS):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS summaries "
+            "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS summaries_accessed ON summaries (accessed_at)")
+        self._conn.commit()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, expires_at FROM summaries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] < now:
+                self._conn.execute("DELETE FROM summaries WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute("UPDATE summaries SET accessed_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            return row[0]
+
+    def set(self, key, value):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO summaries (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, value, now + self.ttl, now),
+            )
+            self._conn.execute("DELETE FROM summaries WHERE expires_at < ?", (now,))
+            self._conn.execute(
+                "DELETE FROM summaries WHERE key IN "
+                "(SELECT key FROM summaries ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            self._conn.commit()
+
+
+class SummaryCache:
+    # `persistent` is any object with get(key) -> str | None and set(key, value),
+    # e.g. SQLiteTier or a GCS-backed tier.
+    def __init__(self, memory=None, persistent=None):
+        self.memory = memory if memory is not None else MemoryTier()
+        self.persistent = persistent
+        self.hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        value = self.memory.get(key)
+        if value is None and self.persistent is not None:
+            try:
+                value = self.persistent.get(key)
+            except Exception as e:
+                logging.error(f"Summary cache read failed: {e}")
+                value = None
+            if value is not None:
+                self.memory.set(key, value)
+                with self._lock:
+                    self.persistent_hits += 1
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self.memory.set(key, value)
+        if self.persistent is not None:
+            try:
+                self.persistent.set(key, value)
+            except Exception as e:
+                logging.error(f"Summary cache write failed: {e}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "persistent_hits": self.persistent_hits,
+                "misses": self.misses,
+                "memory_entries": len(self.memory),
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                persistent = None
+                if SUMMARY_CACHE_PATH:
+                    try:
+                        persistent = SQLiteTier(SUMMARY_CACHE_PATH)
+                    except sqlite3.Error as e:
+                        logging.error(f"Summary cache disabled persistent tier: {e}")
+                _cache = SummaryCache(persistent=persistent)
+    return _cache
+
+
+def set_cache(cache):
+    global _cache
+    with _cache_lock:
+        _cache = cache
@@ -0,0 +1,87 @@
+# Groups retrieved transcript snippets into contiguous intervals and ranks the
+# groups by relevance. Snippets carry integer start_seconds/end_seconds, parsed
+# once when the shard is loaded (or at ingest), so grouping is pure array work.
+import os
+
+import numpy as np
+
+from embedding_store import timestamp_seconds
+
+# Snippets of the same lecture closer than this are merged into one group
+VIDEO_GROUP_GAP_SECONDS = int(os.environ.get('VIDEO_GROUP_GAP_SECONDS', '60'))
+# Number of groups summarized per query
+VIDEO_GROUP_BUDGET = int(os.environ.get('VIDEO_GROUP_BUDGET', '7'))
+# How a group's cosine scores combine into its rank: max, sum or mean
+VIDEO_GROUP_SCORE = os.environ.get('VIDEO_GROUP_SCORE', 'max')
+
+
+def snippet_arrays(snippets):
+    # (document codes, start seconds, end seconds, scores) as parallel arrays
+    codes = {}
+    documents = np.array([codes.setdefault(s.get('document_id'), len(codes)) for s in snippets], dtype=np.int64)
+    starts = np.array([snippet_seconds(s, 'start') for s in snippets], dtype=np.int64)
+    ends = np.array([snippet_seconds(s, 'end') for s in snippets], dtype=np.int64)
+    scores = np.array([s.get('cosine_score', 0.0) for s in snippets], dtype=np.float64)
+    return documents, starts, ends, scores
+
+
+def snippet_seconds(snippet, edge):
+    value = snippet.get(f'{edge}_seconds')
+    return value if value is not None else timestamp_seconds(snippet['time_stamp'][f'{edge}_time'])
+
+
+def merge_intervals(documents, starts, ends, gap=VIDEO_GROUP_GAP_SECONDS):
+    # Returns (order, group_ids): `order` sorts snippets by (document, start) and
+    # group_ids[i] is the group of snippet order[i]. A snippet joins the current
+    # group when it starts within `gap` of the furthest end seen so far.
+    if len(starts) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    order = np.lexsort((starts, documents))
+    # Offsetting each document onto its own stretch of the timeline makes every
+    # document change a gap, so one running maximum covers all documents
+    offset = int(ends.max()) + gap + 1
+    shifted_starts = starts[order] + documents[order] * offset
+    reach = np.maximum.accumulate(ends[order] + documents[order] * offset)
+    breaks = shifted_starts[1:] - reach[:-1] > gap
+    group_ids = np.concatenate([[0], np.cumsum(breaks)])
+    return order, group_ids
+
+
+def group_bounds(group_ids):
+    # Group g covers positions bounds[g]:bounds[g + 1] of the sorted order
+    if len(group_ids) == 0:
+        return np.zeros(1, dtype=np.int64)
+    return np.concatenate([[0], np.flatnonzero(np.diff(group_ids)) + 1, [len(group_ids)]])
+
+
+def group_scores(group_ids, scores, how=VIDEO_GROUP_SCORE):
+    n_groups = int(group_ids[-1]) + 1 if len(group_ids) else 0
+    if how == 'max':
+        return np.maximum.reduceat(scores, group_bounds(group_ids)[:-1]) if n_groups else np.empty(0)
+    totals = np.bincount(group_ids, weights=scores, minlength=n_groups)
+    if how == 'sum':
+        return totals
+    if how == 'mean':
+        return totals / np.bincount(group_ids, minlength=n_groups)
+    raise ValueError(f"Unknown group score: {how}")
+
+
+def rank_groups(snippets, gap=VIDEO_GROUP_GAP_SECONDS, budget=VIDEO_GROUP_BUDGET, how=VIDEO_GROUP_SCORE):
+    # The `budget` best groups, most relevant first; each group in time order
+    documents, starts, ends, scores = snippet_arrays(snippets)
+    order, group_ids = merge_intervals(documents, starts, ends, gap)
+    if len(order) == 0:
+        return []
+    combined = group_scores(group_ids, scores[order], how)
+    bounds = group_bounds(group_ids)
+    # Stable sort keeps earlier groups first among equal scores
+    ranked = np.argsort(-combined, kind='stable')[:budget]
+    return [[snippets[i] for i in order[bounds[g]:bounds[g + 1]]] for g in ranked]
+
+
+def group_in_time_order(snippets, gap=VIDEO_GROUP_GAP_SECONDS):
+    # Every group, in (document, start) order
+    documents, starts, ends, _ = snippet_arrays(snippets)
+    order, group_ids = merge_intervals(documents, starts, ends, gap)
+    bounds = group_bounds(group_ids)
+    return [[snippets[i] for i in order[bounds[g]:bounds[g + 1]]] for g in range(len(bounds) - 1)]
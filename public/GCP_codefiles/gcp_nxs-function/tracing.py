@@ -0,0 +1,328 @@
+# Shared by gcp_nxs-function and gcp_pdf-retrieval-function. Each Cloud Function
+# deploys only its own directory, so keep both copies of this file identical.
+#
+# Per-stage latency spans. A request handler opens a trace with start_trace();
+# code below it wraps each stage in span(name). Spans are no-ops outside a trace,
+# so offline scripts that share these modules pay nothing. Finished traces go to
+# the exporter and every span duration feeds a per-stage histogram.
+import contextvars
+import json
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# json: one structured log line per request; otel: OpenTelemetry spans via the
+# globally configured tracer provider; none: histograms only
+TRACE_EXPORTER = os.environ.get('TRACE_EXPORTER', 'json')
+# Fraction of requests whose trace is exported; timings and histograms cover all of them
+TRACE_SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', '1'))
+# Histogram snapshots are logged by the json exporter at most this often
+TRACE_HISTOGRAM_LOG_SECONDS = float(os.environ.get('TRACE_HISTOGRAM_LOG_SECONDS', '300'))
+
+HISTOGRAM_BOUNDS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+_current_trace = contextvars.ContextVar('nxs_trace', default=None)
+_current_span = contextvars.ContextVar('nxs_span', default=None)
+
+
+class Span:
+    __slots__ = ('name', 'span_id', 'parent_id', 'attributes', 'start', 'start_time', 'duration_ms', 'error')
+
+    def __init__(self, name, parent_id=None, attributes=None):
+        self.name = name
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.attributes = attributes or {}
+        self.start = time.perf_counter()
+        self.start_time = time.time()
+        self.duration_ms = None
+        self.error = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def finish(self):
+        self.duration_ms = (time.perf_counter() - self.start) * 1000.0
+
+    def to_dict(self):
+        entry = {"name": self.name, "span_id": self.span_id, "parent_id": self.parent_id,
+                 "start_time": self.start_time, "duration_ms": round(self.duration_ms, 3)}
+        if self.attributes:
+            entry["attributes"] = self.attributes
+        if self.error:
+            entry["error"] = self.error
+        return entry
+
+
+class Trace:
+    def __init__(self, name, attributes=None):
+        self.trace_id = uuid.uuid4().hex
+        self.root = Span(name, attributes=attributes)
+        self.spans = []
+        # Per-request totals other than durations, e.g. prompt tokens saved
+        self.counts = {}
+        self._lock = threading.Lock()
+
+    @property
+    def name(self):
+        return self.root.name
+
+    def add(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+    def count(self, name, value):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + value
+
+    def timings(self):
+        # Per-stage totals for the response. Stages that run concurrently (shard
+        # searches, summaries) can add up to more than total_ms.
+        stages = {}
+        with self._lock:
+            spans = list(self.spans)
+        for span in spans:
+            stage = stages.setdefault(span.name, {"count": 0, "ms": 0.0, "max_ms": 0.0})
+            stage["count"] += 1
+            stage["ms"] += span.duration_ms
+            stage["max_ms"] = max(stage["max_ms"], span.duration_ms)
+        for stage in stages.values():
+            stage["ms"] = round(stage["ms"], 2)
+            stage["max_ms"] = round(stage["max_ms"], 2)
+        total = self.root.duration_ms
+        if total is None:
+            total = (time.perf_counter() - self.root.start) * 1000.0
+        timings = {"trace_id": self.trace_id, "total_ms": round(total, 2), "stages": stages}
+        if self.counts:
+            timings["counts"] = dict(self.counts)
+        return timings
+
+    def to_dict(self):
+        entry = {"trace": self.name, "trace_id": self.trace_id, "duration_ms": round(self.root.duration_ms, 3),
+                 "attributes": self.root.attributes, "spans": [span.to_dict() for span in self.spans]}
+        if self.counts:
+            entry["counts"] = dict(self.counts)
+        return entry
+
+
+class Histogram:
+    def __init__(self, bounds=HISTOGRAM_BOUNDS_MS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum_ms = 0.0
+
+    def record(self, value_ms):
+        i = 0
+        while i < len(self.bounds) and value_ms > self.bounds[i]:
+            i += 1
+        self.counts[i] += 1
+        self.count += 1
+        self.sum_ms += value_ms
+
+    def quantile(self, q):
+        # Upper bound of the bucket holding the q-th value
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(self.bounds + (float('inf'),), self.counts):
+            seen += count
+            if seen >= target and count:
+                return bound
+        return 0.0
+
+    def snapshot(self):
+        return {"count": self.count, "sum_ms": round(self.sum_ms, 2), "p50_ms": self.quantile(0.5),
+                "p95_ms": self.quantile(0.95), "p99_ms": self.quantile(0.99),
+                "buckets": dict(zip([str(bound) for bound in self.bounds] + ["+inf"], self.counts))}
+
+
+_histograms = {}
+_histograms_lock = threading.Lock()
+
+
+def record_duration(name, duration_ms):
+    with _histograms_lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = Histogram()
+        histogram.record(duration_ms)
+
+
+def histogram_snapshot():
+    with _histograms_lock:
+        return {name: histogram.snapshot() for name, histogram in _histograms.items()}
+
+
+def reset_histograms():
+    with _histograms_lock:
+        _histograms.clear()
+
+
+_metric_sources = {}
+
+
+def register_metrics(name, source):
+    # source() returns a dict of counters/gauges, logged alongside the histograms
+    _metric_sources[name] = source
+
+
+def metrics_snapshot():
+    return {name: source() for name, source in list(_metric_sources.items())}
+
+
+class JsonLogExporter:
+    def __init__(self, histogram_interval=TRACE_HISTOGRAM_LOG_SECONDS):
+        self.histogram_interval = histogram_interval
+        self._last_histograms = time.monotonic()
+
+    def export(self, trace):
+        payload = trace.to_dict()
+        # Cloud Logging's handler turns json_fields into the entry's jsonPayload
+        logging.info(json.dumps(payload), extra={"json_fields": payload})
+        now = time.monotonic()
+        if now - self._last_histograms >= self.histogram_interval:
+            self._last_histograms = now
+            snapshot = {"histograms": histogram_snapshot(), "metrics": metrics_snapshot()}
+            logging.info(json.dumps(snapshot), extra={"json_fields": snapshot})
+
+
+class OpenTelemetryExporter:
+    # Replays finished spans into OpenTelemetry with their recorded start and end
+    # times; the tracer provider and its exporter are configured by the deployment
+    def __init__(self, tracer=None):
+        if tracer is None:
+            from opentelemetry import trace as otel_trace
+            tracer = otel_trace.get_tracer("nexus-ai")
+        self.tracer = tracer
+
+    def export(self, trace):
+        from opentelemetry import trace as otel_trace
+        spans = sorted([trace.root] + trace.spans, key=lambda span: span.start)
+        started = {}
+        for span in spans:
+            parent = started.get(span.parent_id)
+            context = otel_trace.set_span_in_context(parent) if parent is not None else None
+            attributes = {key: value for key, value in span.attributes.items()
+                          if isinstance(value, (str, bool, int, float))}
+            if span is trace.root:
+                attributes.update(trace.counts)
+            started[span.span_id] = self.tracer.start_span(
+                span.name, context=context, attributes=attributes, start_time=int(span.start_time * 1e9))
+        for span in spans:
+            otel_span = started[span.span_id]
+            if span.error:
+                otel_span.set_attribute("error.type", span.error)
+            otel_span.end(end_time=int((span.start_time + span.duration_ms / 1000.0) * 1e9))
+
+
+class NullExporter:
+    def export(self, trace):
+        pass
+
+
+def make_exporter(kind):
+    if kind == 'json':
+        return JsonLogExporter()
+    if kind == 'otel':
+        return OpenTelemetryExporter()
+    if kind in ('', 'none'):
+        return NullExporter()
+    raise ValueError(f"Unknown TRACE_EXPORTER: {kind}")
+
+
+_exporter = None
+_exporter_lock = threading.Lock()
+
+
+def get_exporter():
+    global _exporter
+    if _exporter is None:
+        with _exporter_lock:
+            if _exporter is None:
+                _exporter = make_exporter(TRACE_EXPORTER)
+    return _exporter
+
+
+def set_exporter(exporter):
+    global _exporter
+    with _exporter_lock:
+        _exporter = exporter
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+def count(name, value=1):
+    # Adds to a per-request total of the current trace, if there is one
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.count(name, value)
+
+
+@contextmanager
+def start_trace(name, **attributes):
+    trace = Trace(name, attributes)
+    trace_token = _current_trace.set(trace)
+    span_token = _current_span.set(trace.root)
+    try:
+        yield trace
+    except Exception as e:
+        trace.root.error = type(e).__name__
+        raise
+    finally:
+        _current_span.reset(span_token)
+        _current_trace.reset(trace_token)
+        trace.root.finish()
+        record_duration(name, trace.root.duration_ms)
+        if TRACE_SAMPLE_RATE >= 1 or random.random() < TRACE_SAMPLE_RATE:
+            try:
+                get_exporter().export(trace)
+            except Exception as e:
+                logging.warning(f"Trace export failed: {e}")
+
+
+@contextmanager
+def span(name, **attributes):
+    trace = _current_trace.get()
+    if trace is None:
+        yield None
+        return
+    parent = _current_span.get()
+    current = Span(name, parent.span_id if parent is not None else None, attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except Exception as e:
+        current.error = type(e).__name__
+        raise
+    finally:
+        _current_span.reset(token)
+        current.finish()
+        trace.add(current)
+        record_duration(name, current.duration_ms)
+
+
+def bind(fn):
+    # Context variables do not follow work onto pool threads; wrap the callable
+    # handed to an executor so it runs in a copy of the submitting context: its
+    # spans land in the request's trace and it sees the request's LLM deadline
+    context = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        # One copy per call, since a context cannot be entered by two threads at once
+        return context.copy().run(fn, *args, **kwargs)
+
+    return run
+
+
+def requested_timings(request, request_json):
+    # Opt-in per request: {"timings": true} in the body or ?timings=1
+    if (request_json or {}).get('timings') is True:
+        return True
+    args = getattr(request, 'args', None) or {}
+    return args.get('timings') in ('1', 'true')
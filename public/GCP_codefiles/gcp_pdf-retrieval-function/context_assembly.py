@@ -0,0 +1,198 @@
+# Shared by gcp_nxs-function and gcp_pdf-retrieval-function. Each Cloud Function
+# deploys only its own directory, so keep both copies of this file identical.
+#
+# Builds the retrieved text a summary prompt gets. Retrieval returns more chunks
+# than a prompt needs and neighbouring chunks repeat each other, so the chunks are
+#   1. ordered by maximal marginal relevance: their retrieval score, less their
+#      similarity to chunks already taken (the corpus embeddings of the chunks, or
+#      word overlap when those are not loaded); near-duplicates are dropped
+#   2. taken in that order while they fit the token budget
+#   3. merged with the other taken chunks of the same page (PDFs) or the next
+#      chunk of the same lecture (transcripts), minus the words they repeat
+# Prompt tokens saved against the text the summarizers used to send are added to
+# the request's trace counts and to the "context" metrics.
+import os
+import threading
+
+import numpy as np
+
+from lexical import tokenize
+from summarization import CHARS_PER_TOKEN, estimate_tokens
+from tracing import count, register_metrics, span
+
+CONTEXT_ASSEMBLY = os.environ.get('CONTEXT_ASSEMBLY', '1') == '1'
+# Weight of relevance against novelty in the MMR order: 1 is plain retrieval order
+CONTEXT_MMR_LAMBDA = float(os.environ.get('CONTEXT_MMR_LAMBDA', '0.7'))
+# A chunk at least this similar to one already taken adds nothing and is dropped
+CONTEXT_DUPLICATE_SIMILARITY = float(os.environ.get('CONTEXT_DUPLICATE_SIMILARITY', '0.95'))
+# Token budgets for the PDF relation summary and for each transcript group summary
+CONTEXT_RELATION_TOKENS = int(os.environ.get('CONTEXT_RELATION_TOKENS', '600'))
+CONTEXT_GROUP_TOKENS = int(os.environ.get('CONTEXT_GROUP_TOKENS', '400'))
+# Longest run of words a chunk may repeat from the end of the chunk before it
+CONTEXT_MAX_OVERLAP_WORDS = int(os.environ.get('CONTEXT_MAX_OVERLAP_WORDS', '60'))
+
+_totals = {"assemblies": 0, "chunks_in": 0, "chunks_out": 0, "tokens_in": 0, "tokens_out": 0, "tokens_saved": 0}
+_totals_lock = threading.Lock()
+
+
+def word_similarity(texts):
+    # Jaccard similarity of the texts' word sets
+    words = [set(tokenize(text)) for text in texts]
+    similarity = np.zeros((len(texts), len(texts)), dtype=np.float32)
+    for i in range(len(texts)):
+        for j in range(i + 1, len(texts)):
+            union = len(words[i] | words[j])
+            similarity[i, j] = similarity[j, i] = len(words[i] & words[j]) / union if union else 0.0
+    return similarity
+
+
+def mmr_order(relevance, similarity, mmr_lambda=CONTEXT_MMR_LAMBDA, duplicate=CONTEXT_DUPLICATE_SIMILARITY):
+    # Indices by maximal marginal relevance, leaving out near-duplicates of earlier ones
+    relevance = np.asarray(relevance, dtype=np.float32)
+    remaining = np.ones(len(relevance), dtype=bool)
+    closest = np.zeros(len(relevance), dtype=np.float32)
+    order = []
+    while remaining.any():
+        gain = mmr_lambda * relevance - (1 - mmr_lambda) * closest
+        gain[~remaining] = -np.inf
+        i = int(np.argmax(gain))
+        remaining[i] = False
+        if order and closest[i] >= duplicate:
+            continue
+        order.append(i)
+        closest = np.maximum(closest, similarity[i])
+    return order
+
+
+def trim_to_tokens(text, budget):
+    if estimate_tokens(text) <= budget:
+        return text
+    cut = text[:max(0, budget - 1) * CHARS_PER_TOKEN]
+    return cut.rsplit(' ', 1)[0] if ' ' in cut else cut
+
+
+def overlap_words(first, second, max_words=CONTEXT_MAX_OVERLAP_WORDS):
+    # Length of the longest run of words that ends first and starts second
+    head, tail = first.split(), second.split()
+    for size in range(min(max_words, len(head), len(tail)), 0, -1):
+        if head[-size:] == tail[:size]:
+            return size
+    return 0
+
+
+def join_overlapping(first, second):
+    size = overlap_words(first, second)
+    if not size:
+        return f"{first} {second}"
+    return " ".join(first.split() + second.split()[size:])
+
+
+def added_tokens(i, texts, snippets, taken_rows):
+    # Tokens chunk i adds to the context, less the words it shares with the
+    # neighbouring chunks already taken
+    words = texts[i].split()
+    document_id, row = snippets[i]['document_id'], snippets[i].get('row')
+    front = back = 0
+    if row is not None:
+        before, after = taken_rows.get((document_id, row - 1)), taken_rows.get((document_id, row + 1))
+        if before is not None:
+            front = overlap_words(texts[before], texts[i])
+        if after is not None:
+            back = overlap_words(texts[i], texts[after])
+    return estimate_tokens(" ".join(words[front:max(front, len(words) - back)]))
+
+
+def same_page(a, b):
+    return a['document_id'] == b['document_id'] and a['page'] == b['page']
+
+
+def next_chunk(a, b):
+    return a['document_id'] == b['document_id'] and a.get('row') is not None and b.get('row') == a['row'] + 1
+
+
+def assemble(snippets, text_key, score_key, budget, adjacent, vectors=None, baseline_tokens=None,
+             position_order=False):
+    # Returns the passages to put in the prompt, most relevant first (position_order:
+    # in document order). `vectors` are the snippets' normalized embeddings, if
+    # available; baseline_tokens is what the prompt used to carry, for the report.
+    texts = [snippet[text_key] for snippet in snippets]
+    if baseline_tokens is None:
+        baseline_tokens = sum(estimate_tokens(text) for text in texts)
+    if not snippets:
+        return texts
+
+    with span("context_assembly", chunks=len(snippets)) as current:
+        similarity = vectors @ vectors.T if vectors is not None else word_similarity(texts)
+        taken, taken_rows, used = [], {}, 0
+        for i in mmr_order([snippet[score_key] for snippet in snippets], similarity):
+            cost = added_tokens(i, texts, snippets, taken_rows)
+            if used + cost <= budget:
+                taken.append(i)
+                taken_rows[(snippets[i]['document_id'], snippets[i].get('row'))] = i
+                used += cost
+        if not taken:
+            taken = [int(np.argmax([snippet[score_key] for snippet in snippets]))]
+        rank = {i: position for position, i in enumerate(taken)}
+
+        # Sweep the taken chunks in document order, merging each into the passage before it when adjacent
+        passages = []
+        for i in sorted(taken, key=lambda i: (snippets[i]['document_id'], snippets[i].get('row') or 0, i)):
+            if passages and adjacent(snippets[passages[-1][2]], snippets[i]):
+                passages[-1][0] = join_overlapping(passages[-1][0], texts[i])
+                passages[-1][1] = min(passages[-1][1], rank[i])
+                passages[-1][2] = i
+            else:
+                passages.append([texts[i], rank[i], i])
+        if not position_order:
+            passages.sort(key=lambda passage: passage[1])
+        passages = [trim_to_tokens(text, budget) for text, _, _ in passages]
+
+        tokens = sum(estimate_tokens(text) for text in passages)
+        saved = max(0, baseline_tokens - tokens)
+        if current is not None:
+            current.set(chunks_out=len(taken), passages=len(passages), tokens_in=baseline_tokens,
+                        tokens_out=tokens, tokens_saved=saved)
+    count("context_tokens_in", baseline_tokens)
+    count("context_tokens_out", tokens)
+    count("context_tokens_saved", saved)
+    with _totals_lock:
+        _totals["assemblies"] += 1
+        _totals["chunks_in"] += len(snippets)
+        _totals["chunks_out"] += len(taken)
+        _totals["tokens_in"] += baseline_tokens
+        _totals["tokens_out"] += tokens
+        _totals["tokens_saved"] += saved
+    return passages
+
+
+def snippet_vectors(snippets, corpus):
+    # Embeddings of snippets retrieved with their corpus rows, or None
+    if any(snippet.get('row') is None for snippet in snippets):
+        return None
+    return corpus.vectors([(snippet['document_id'], snippet['row']) for snippet in snippets])
+
+
+def relation_context(snippets, corpus, baseline_count=5, budget=CONTEXT_RELATION_TOKENS):
+    # PDF chunks for the relation summary. It used to get the top baseline_count
+    # chunks as they were, and never gets more tokens than those.
+    baseline = sum(estimate_tokens(snippet['chunk_text']) for snippet in snippets[:baseline_count])
+    if not CONTEXT_ASSEMBLY:
+        return [snippet['chunk_text'] for snippet in snippets[:baseline_count]]
+    return assemble(snippets, 'chunk_text', 'similarity', min(budget, baseline), same_page,
+                    snippet_vectors(snippets, corpus), baseline)
+
+
+def group_context(group, corpus, budget=CONTEXT_GROUP_TOKENS):
+    # One transcript group's text for its summary, in time order; it used to be every snippet joined
+    if not CONTEXT_ASSEMBLY:
+        return " ".join(snippet['transcript'] for snippet in group)
+    return " ".join(assemble(group, 'transcript', 'cosine_score', budget, next_chunk,
+                             snippet_vectors(group, corpus), position_order=True))
+
+
+def context_stats():
+    with _totals_lock:
+        return dict(_totals)
+
+
+register_metrics("context", context_stats)
@@ -0,0 +1,178 @@
+# Shared by gcp_nxs-function and gcp_pdf-retrieval-function. Each Cloud Function
+# deploys only its own directory, so keep both copies of this file identical.
+#
+# BM25 over transcript and PDF chunks, so exact technical terms (algorithm names,
+# acronyms) that embeddings blur still surface. The corpus fuses it with dense
+# search by reciprocal rank.
+import io
+import json
+import re
+import unicodedata
+
+import numpy as np
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+RRF_K = 60
+
+TOKEN_PATTERN = re.compile(r"\w+")
+ESCAPE_PATTERN = re.compile(r'\\[a-zA-Z]')
+
+
+class _ControlCharacterTable(dict):
+    # str.translate table deleting Unicode category C (control, format, surrogate,
+    # private use, unassigned); filled lazily since category C spans most code points
+    def __missing__(self, codepoint):
+        value = None if unicodedata.category(chr(codepoint))[0] == 'C' else codepoint
+        self[codepoint] = value
+        return value
+
+
+CONTROL_CHARACTERS = _ControlCharacterTable()
+
+
+def preprocess_text(text):
+    # NFKD, drop backslash escapes (\n, \t as literal text), collapse whitespace,
+    # drop control characters. Same output as the original four regex passes plus
+    # per-character category filter, in C-level passes only.
+    text = unicodedata.normalize('NFKD', text)
+    if '\\' in text:
+        text = ESCAPE_PATTERN.sub('', text)
+    text = ' '.join(text.split())
+    # After the split every whitespace character is a plain space, so anything
+    # non-printable left is category C
+    if not text.isprintable():
+        text = text.translate(CONTROL_CHARACTERS)
+    return text.strip()
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(preprocess_text(text).lower())
+
+
+class BM25Index:
+    # Postings in CSR form: term t's documents are doc_ids[offsets[t]:offsets[t + 1]]
+    # with matching term frequencies in tfs.
+    def __init__(self, vocabulary, offsets, doc_ids, tfs, doc_lengths, k1=BM25_K1, b=BM25_B):
+        self.vocabulary = vocabulary
+        self.offsets = offsets
+        self.doc_ids = doc_ids
+        self.tfs = tfs
+        self.doc_lengths = doc_lengths
+        self.k1 = k1
+        self.b = b
+        n_docs = len(doc_lengths)
+        df = np.diff(offsets)
+        self.idf = np.log(1 + (n_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+        self.total_length = float(doc_lengths.sum())
+        average = self.total_length / n_docs if n_docs else 0.0
+        # Per-document length normalization, precomputed once
+        self.norms = (k1 * (1 - b + b * doc_lengths / average)).astype(np.float32) if average else \
+            np.full(n_docs, k1, dtype=np.float32)
+
+    @classmethod
+    def build(cls, texts, k1=BM25_K1, b=BM25_B):
+        vocabulary = {}
+        postings = []
+        doc_lengths = np.zeros(len(texts), dtype=np.float32)
+        for doc_id, text in enumerate(texts):
+            counts = {}
+            tokens = tokenize(text)
+            doc_lengths[doc_id] = len(tokens)
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, tf in counts.items():
+                postings.append((vocabulary.setdefault(token, len(vocabulary)), doc_id, tf))
+        postings = np.array(postings, dtype=np.int64).reshape(-1, 3)
+        order = np.lexsort((postings[:, 1], postings[:, 0]))
+        postings = postings[order]
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(postings[:, 0], minlength=len(vocabulary)))])
+        return cls(vocabulary, offsets.astype(np.int64), postings[:, 1].astype(np.int32),
+                   postings[:, 2].astype(np.float32), doc_lengths, k1, b)
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+    def statistics(self, query):
+        # (documents, summed length, document frequency of each query term). Summed
+        # over shards by combine_statistics, they give scores() the corpus-wide IDF
+        # and average length, without which BM25 scores of two shards do not compare.
+        df = {}
+        for token in set(tokenize(query)):
+            term = self.vocabulary.get(token)
+            if term is not None:
+                df[token] = int(self.offsets[term + 1] - self.offsets[term])
+        return len(self), self.total_length, df
+
+    def scores(self, query, statistics=None):
+        # BM25 score of every document; zero where no query term occurs
+        scores = np.zeros(len(self), dtype=np.float32)
+        if statistics is not None:
+            n_docs, total_length, df = statistics
+            average = total_length / n_docs if n_docs else 0.0
+        for token in set(tokenize(query)):
+            term = self.vocabulary.get(token)
+            if term is None:
+                continue
+            start, end = self.offsets[term], self.offsets[term + 1]
+            ids = self.doc_ids[start:end]
+            tfs = self.tfs[start:end]
+            if statistics is None:
+                idf, norms = self.idf[term], self.norms[ids]
+            else:
+                count = df.get(token, end - start)
+                idf = np.float32(np.log(1 + (n_docs - count + 0.5) / (count + 0.5)))
+                norms = self.k1 * (1 - self.b + self.b * self.doc_lengths[ids] / average) if average else self.k1
+            scores[ids] += idf * tfs * (self.k1 + 1) / (tfs + norms)
+        return scores
+
+    def search(self, query, top_k, statistics=None):
+        scores = self.scores(query, statistics)
+        matched = np.flatnonzero(scores)
+        best = matched[np.argsort(-scores[matched], kind="stable")[:top_k]]
+        return scores[best], best
+
+    def matching(self, query):
+        # Ids of documents containing at least one query term
+        terms = [self.vocabulary[token] for token in set(tokenize(query)) if token in self.vocabulary]
+        if not terms:
+            return np.empty(0, dtype=np.int64)
+        return np.unique(np.concatenate([self.doc_ids[self.offsets[t]:self.offsets[t + 1]] for t in terms]))
+
+    def save(self, fileobj):
+        header = json.dumps({"k1": self.k1, "b": self.b, "vocabulary": self.vocabulary})
+        np.savez(fileobj, header=np.array(header), offsets=self.offsets, doc_ids=self.doc_ids, tfs=self.tfs,
+                 doc_lengths=self.doc_lengths)
+
+    @classmethod
+    def load(cls, fileobj):
+        if isinstance(fileobj, (bytes, bytearray)):
+            fileobj = io.BytesIO(fileobj)
+        with np.load(fileobj, allow_pickle=False) as data:
+            header = json.loads(str(data["header"]))
+            return cls(header["vocabulary"], data["offsets"], data["doc_ids"], data["tfs"], data["doc_lengths"],
+                       header["k1"], header["b"])
+
+    def nbytes(self):
+        return self.offsets.nbytes + self.doc_ids.nbytes + self.tfs.nbytes + self.doc_lengths.nbytes + \
+            64 * len(self.vocabulary)
+
+
+def combine_statistics(statistics):
+    # Sums BM25Index.statistics() of several shards for the same query
+    n_docs, total_length, df = 0, 0.0, {}
+    for shard_docs, shard_length, shard_df in statistics:
+        n_docs += shard_docs
+        total_length += shard_length
+        for token, count in shard_df.items():
+            df[token] = df.get(token, 0) + count
+    return n_docs, total_length, df
+
+
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    # rankings: lists of hashable keys, best first. Returns [(fused score, key)], best first.
+    fused = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking):
+            fused[key] = fused.get(key, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(((score, key) for key, score in fused.items()), key=lambda item: -item[0])
@@ -1,60 +1,98 @@
 import json
 import logging
-from google.cloud import storage
-import vertexai
-from vertexai.generative_models import GenerativeModel, GenerationConfig
 import numpy as np
 from typing import List, Dict, Any
-from google.oauth2 import service_account
-import os
+from embedding_client import get_client
+from gcs import get_bucket, signed_url
+from llm import LLM_REQUEST_DEADLINE_SECONDS, deadline, generate
+from runtime import generative_model, get_credentials
+from summarization import (
+    SUMMARY_BATCH_CONTEXT_TOKENS,
+    SUMMARY_BATCH_MAX_OUTPUT_TOKENS,
+    SUMMARY_BATCH_MODE,
+    estimate_tokens,
+    parse_summary_array,
+    summarize_batched,
+)
+from tracing import bind, span, start_trace
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Initialize credentials and Vertex AI
-credentials = service_account.Credentials.from_service_account_file(
-    os.environ['GOOGLE_APPLICATION_CREDENTIALS'])
-
-PROJECT_ID = "silver-idea-432502-c0"
-REGION = "us-central1"
 MODEL_NAME = "gemini-1.0-pro"
 BUCKET_NAME = "nxs_bucket1"
 
-vertexai.init(project=PROJECT_ID, location=REGION, credentials=credentials)
-GenAI_modelConfig = GenerationConfig(max_output_tokens=150)
+GenAI_modelConfig = {"max_output_tokens": 150}
+SUMMARY_PLACEHOLDER = "Summary placeholder due to model unavailability."
+
+SUMMARY_PROMPT_TEMPLATE = """In 2 sentences, explain why the following text snippet is helpful in answering the question posed in the query.
+
+Query: {query}
+
+Text snippet: {text_snippet}
+
+YourNXS:"""
+
+BATCH_SUMMARY_PROMPT_TEMPLATE = """In 2 sentences each, explain why each of the following numbered text snippets is helpful in answering the question posed in the query.
+
+Query: {query}
+
+{snippets_text}
+
+Respond with only a JSON array holding one object per snippet, in order: [{{"id": 1, "summary": "..."}}, {{"id": 2, "summary": "..."}}]"""
 
 def cosine_similarity(a: List[float], b: List[float]) -> float:
     return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
 
 def load_pdf_embeddings() -> Dict[str, Any]:
     logger.info("Loading PDF embeddings")
-    storage_client = storage.Client(credentials=credentials)
-    bucket = storage_client.bucket(BUCKET_NAME)
-    blob = bucket.blob('PDF_embeddings.json')
-    data = json.loads(blob.download_as_string())
+    with span("gcs_load", blob='PDF_embeddings.json'):
+        blob = get_bucket(BUCKET_NAME, get_credentials()).blob('PDF_embeddings.json')
+        data = json.loads(blob.download_as_string())
     logger.info(f"Loaded PDF embeddings with {len(data['chunks'])} chunks")
     return data
 
 def generate_summary(query: str, text_snippet: str) -> str:
     logger.info(f"Generating summary for query: {query}")
     try:
-        model = GenerativeModel(MODEL_NAME)
-        prompt = f"""In 2 sentences, explain why the following text snippet is helpful in answering the question posed in the query.
-
-Query: {query}
-
-Text snippet: {text_snippet}
-
-YourNXS:"""
+        model = generative_model(MODEL_NAME)
+        prompt = SUMMARY_PROMPT_TEMPLATE.format(query=query, text_snippet=text_snippet)
         
-        response = model.generate_content(prompt, generation_config=GenAI_modelConfig)
+        with span("llm", call="summary"):
+            response = generate(model, prompt, GenAI_modelConfig)
         
         logger.info("Summary generated successfully")
         return response.text.strip()
     except Exception as e:
         logger.error(f"Error generating summary: {e}")
-        return "Summary placeholder due to model unavailability."
+        return SUMMARY_PLACEHOLDER
+
+def generate_summary_batch(query: str, text_snippets: List[str]) -> List[Any]:
+    logger.info(f"Generating {len(text_snippets)} summaries in one call for query: {query}")
+    model = generative_model(MODEL_NAME)
+    snippets_text = "\n\n".join(f"Snippet {i + 1}: {text}" for i, text in enumerate(text_snippets))
+    prompt = BATCH_SUMMARY_PROMPT_TEMPLATE.format(query=query, snippets_text=snippets_text)
+    generation_config = dict(GenAI_modelConfig, max_output_tokens=min(
+        SUMMARY_BATCH_MAX_OUTPUT_TOKENS, GenAI_modelConfig["max_output_tokens"] * len(text_snippets) + 50))
+    with span("llm", call="summary_batch", snippets=len(text_snippets)):
+        response = generate(model, prompt, generation_config)
+    return parse_summary_array(response.text, len(text_snippets))
+
+def generate_summaries(query: str, text_snippets: List[str]) -> List[str]:
+    if not SUMMARY_BATCH_MODE or len(text_snippets) <= 1:
+        return [generate_summary(query, text) for text in text_snippets]
+    output_tokens = GenAI_modelConfig["max_output_tokens"]
+    return summarize_batched(
+        text_snippets,
+        bind(lambda batch: generate_summary_batch(query, batch)),
+        bind(lambda text: generate_summary(query, text)),
+        costs=[estimate_tokens(text) + output_tokens for text in text_snippets],
+        fixed_cost=estimate_tokens(BATCH_SUMMARY_PROMPT_TEMPLATE + query),
+        budget=SUMMARY_BATCH_CONTEXT_TOKENS,
+        max_items=max(1, SUMMARY_BATCH_MAX_OUTPUT_TOKENS // output_tokens),
+        placeholder=SUMMARY_PLACEHOLDER,
+    )
 
 def retrieve_pdf_snippets(query: str, top_k: int = 5) -> List[Dict[str, Any]]:
     logger.info(f"Retrieving PDF snippets for query: {query}")
@@ -65,7 +103,7 @@ def retrieve_pdf_snippets(query: str, top_k: int = 5) -> List[Dict[str, Any]]:
     embeddings = pdf_data['embeddings']
     
     # Embed the query
-    query_embedding = vertexai.language_models.TextEmbeddingModel.from_pretrained("text-embedding-004").get_embeddings([query])[0].values
+    query_embedding = get_client("text-embedding-004").embed_one(query)
     
     # Calculate similarities
     similarities = [cosine_similarity(query_embedding, emb) for emb in embeddings]
@@ -73,10 +111,12 @@ def retrieve_pdf_snippets(query: str, top_k: int = 5) -> List[Dict[str, Any]]:
     # Get top-k similar chunks
     top_indices = np.argsort(similarities)[-top_k:][::-1]
     
+    # One batched call for all top-k chunks instead of one call per chunk
+    summaries = generate_summaries(query, [chunks[idx]['text'] for idx in top_indices])
+
     results = []
-    for idx in top_indices:
+    for idx, summary in zip(top_indices, summaries):
         chunk = chunks[idx]
-        summary = generate_summary(query, chunk['text'])
         results.append({
             'text': chunk['text'],
             'page': chunk['page'],
@@ -90,13 +130,11 @@ def retrieve_pdf_snippets(query: str, top_k: int = 5) -> List[Dict[str, Any]]:
 
 def pdf_retrieval(query: str) -> Dict[str, Any]:
     try:
-        snippets = retrieve_pdf_snippets(query)
-        
-        # Generate signed URL for the PDF
-        storage_client = storage.Client(credentials=credentials)
-        bucket = storage_client.bucket(BUCKET_NAME)
-        blob = bucket.blob('IntroMLpaper.pdf')
-        pdf_url = blob.generate_signed_url(expiration=300)  # URL valid for 5 minutes
+        with start_trace("pdf_retrieval"), deadline(LLM_REQUEST_DEADLINE_SECONDS):
+            snippets = retrieve_pdf_snippets(query)
+
+            # Generate signed URL for the PDF
+            pdf_url = signed_url(BUCKET_NAME, 'IntroMLpaper.pdf', get_credentials())
         
         return {
             "query": query,
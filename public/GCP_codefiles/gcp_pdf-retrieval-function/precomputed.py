@@ -0,0 +1,152 @@
+# Shared by gcp_nxs-function and gcp_pdf-retrieval-function. Each Cloud Function
+# deploys only its own directory, so keep both copies of this file identical.
+#
+# Precomputed answers for the course query catalogue, the questions students click
+# in the mind map. otherScripts/warm_cache.py runs every catalogue query through
+# the normal pipeline and saves the response cache entries and query embeddings it
+# produced. At startup each function pins those entries in its response cache, so
+# catalogue queries skip embedding, retrieval and LLM calls. Entries record the
+# corpus version they were computed against and stop matching once it changes;
+# with PRECOMPUTED_ANSWERS_REFRESH the stale ones are recomputed and saved back.
+import gzip
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from corpus import get_corpus
+from embedding_client import get_client
+from gcs import get_bucket
+from response_cache import ResponseCache, get_response_cache, use_response_cache
+from summary_cache import normalize_query
+
+# Local path or gs://bucket/blob of the artifact, gzip-compressed if it ends in .gz; empty disables it
+PRECOMPUTED_ANSWERS = os.environ.get('PRECOMPUTED_ANSWERS', '')
+# Recompute out-of-date catalogue answers at startup and write the artifact back
+PRECOMPUTED_ANSWERS_REFRESH = os.environ.get('PRECOMPUTED_ANSWERS_REFRESH', '0') == '1'
+PRECOMPUTE_WORKERS = int(os.environ.get('PRECOMPUTE_WORKERS', '4'))
+ARTIFACT_FORMAT = 1
+
+
+def read_artifact(location, credentials=None):
+    if location.startswith('gs://'):
+        bucket_name, blob_name = location[len('gs://'):].split('/', 1)
+        data = get_bucket(bucket_name, credentials).blob(blob_name).download_as_bytes()
+    else:
+        with open(location, 'rb') as f:
+            data = f.read()
+    if location.endswith('.gz'):
+        data = gzip.decompress(data)
+    artifact = json.loads(data)
+    if artifact.get("format") != ARTIFACT_FORMAT:
+        raise ValueError(f"Unsupported precomputed answers format {artifact.get('format')} in {location}")
+    return artifact
+
+
+def write_artifact(artifact, location, credentials=None):
+    data = json.dumps(artifact, separators=(',', ':')).encode('utf-8')
+    if location.endswith('.gz'):
+        data = gzip.compress(data)
+    if location.startswith('gs://'):
+        bucket_name, blob_name = location[len('gs://'):].split('/', 1)
+        get_bucket(bucket_name, credentials).blob(blob_name).upload_from_string(data)
+    else:
+        with open(f"{location}.tmp", 'wb') as f:
+            f.write(data)
+        os.replace(f"{location}.tmp", location)
+    logging.info(f"Saved {len(artifact['entries'])} precomputed answers to {location}")
+
+
+def corpus_version(namespace, filters, credentials=None):
+    # Response cache namespaces start with the document type ("video", "pdf:20")
+    return get_corpus(credentials).version(namespace.split(':')[0], filters.get('course'), filters.get('document_ids'))
+
+
+def stale_queries(artifact, namespaces=None, credentials=None):
+    # Catalogue queries with no entry yet or an entry computed against an older
+    # corpus. `namespaces` limits the check to entries whose namespace starts with
+    # one of them, i.e. those the calling function can recompute.
+    answered = set()
+    stale = set()
+    versions = {}
+    for entry in artifact["entries"]:
+        if namespaces is not None and not entry["namespace"].startswith(tuple(namespaces)):
+            continue
+        group = (entry["namespace"], json.dumps(entry["filters"], sort_keys=True))
+        if group not in versions:
+            versions[group] = corpus_version(entry["namespace"], entry["filters"], credentials)
+        answered.add(entry["query"])
+        if entry["version"] != versions[group]:
+            stale.add(entry["query"])
+    return [query for query in artifact["queries"]
+            if normalize_query(query) in stale or normalize_query(query) not in answered]
+
+
+def precompute(queries, answer, max_workers=PRECOMPUTE_WORKERS, known_entries=()):
+    # Runs answer(query) (the function's normal, response-cached pipeline) for every
+    # query against a response cache of its own and collects what it stored there.
+    # Failed queries are logged and left out, so the next refresh retries them.
+    # known_entries that are still current are reused instead of recomputed.
+    collected = ResponseCache(max_entries=max(64, 4 * len(queries)), ttl=float('inf'))
+    collected.pin(known_entries)
+
+    def run(query):
+        try:
+            with use_response_cache(collected):
+                answer(query)
+        except Exception as e:
+            logging.error(f"Precomputing '{query}' failed: {e}")
+
+    started = time.time()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(run, queries))
+    entries = collected.export(queries)
+    embeddings = get_client().embed(list(queries)) if queries else []
+    logging.info(f"Precomputed {len(entries)} answers for {len(queries)} queries in {time.time() - started:.1f}s")
+    return {
+        "format": ARTIFACT_FORMAT,
+        "created_at": time.time(),
+        "queries": list(queries),
+        "entries": entries,
+        "embeddings": dict(zip(queries, embeddings)),
+    }
+
+
+def merge_artifacts(artifact, update):
+    # `update` wins for every (namespace, filters, query) it answers
+    key = lambda entry: (entry["namespace"], json.dumps(entry["filters"], sort_keys=True), entry["query"])
+    entries = {key(entry): entry for entry in artifact["entries"]}
+    entries.update((key(entry), entry) for entry in update["entries"])
+    return dict(artifact, created_at=update["created_at"], entries=list(entries.values()),
+                embeddings=dict(artifact["embeddings"], **update["embeddings"]))
+
+
+def install_artifact(artifact):
+    get_response_cache().pin(artifact["entries"])
+    get_client().seed(list(artifact["embeddings"]), list(artifact["embeddings"].values()))
+
+
+def refresh_artifact(artifact, answer, namespaces=None, credentials=None, max_workers=PRECOMPUTE_WORKERS):
+    stale = stale_queries(artifact, namespaces, credentials)
+    if not stale:
+        return artifact
+    logging.info(f"Recomputing {len(stale)} of {len(artifact['queries'])} catalogue answers")
+    return merge_artifacts(artifact, precompute(stale, answer, max_workers, artifact["entries"]))
+
+
+def warm_precomputed(answer=None, namespaces=None, location=PRECOMPUTED_ANSWERS,
+                     refresh=PRECOMPUTED_ANSWERS_REFRESH, credentials=None):
+    # Startup hook: pins the saved answers, then optionally brings stale ones up to date
+    if not location:
+        return None
+    artifact = read_artifact(location, credentials)
+    install_artifact(artifact)
+    logging.info(f"Loaded {len(artifact['entries'])} precomputed answers from {location}")
+    if refresh and answer is not None:
+        refreshed = refresh_artifact(artifact, answer, namespaces, credentials)
+        if refreshed is not artifact:
+            install_artifact(refreshed)
+            write_artifact(refreshed, location, credentials)
+            artifact = refreshed
+    return artifact
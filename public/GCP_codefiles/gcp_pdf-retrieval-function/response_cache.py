@@ -0,0 +1,223 @@
+# Shared by gcp_nxs-function and gcp_pdf-retrieval-function. Each Cloud Function
+# deploys only its own directory, so keep both copies of this file identical.
+#
+# Whole-response cache in front of retrieval and summarization. Students in one
+# course ask close paraphrases of the same question, so after an exact lookup on
+# the normalized query text misses, the query embedding is compared against the
+# embeddings of recently answered queries. Entries record the corpus version they
+# were computed against and are dropped once it changes.
+#
+# Pinned entries (the precomputed catalogue answers, see precomputed.py) sit
+# outside the LRU: they never expire or get evicted and match exact queries only.
+import contextlib
+import contextvars
+import copy
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from summary_cache import normalize_query
+from vector_index import normalize_query as normalize_embedding
+
+# 0 disables the cache
+RESPONSE_CACHE_ENTRIES = int(os.environ.get('RESPONSE_CACHE_ENTRIES', '512'))
+RESPONSE_CACHE_TTL_SECONDS = float(os.environ.get('RESPONSE_CACHE_TTL_SECONDS', '3600'))
+# Cosine similarity between query embeddings above which a cached response is reused
+RESPONSE_CACHE_SIMILARITY = float(os.environ.get('RESPONSE_CACHE_SIMILARITY', '0.95'))
+
+
+class _Entry:
+    __slots__ = ('value', 'version', 'expires_at', 'slot')
+
+    def __init__(self, value, version, expires_at, slot):
+        self.value = value
+        self.version = version
+        self.expires_at = expires_at
+        self.slot = slot
+
+
+class ResponseCache:
+    # Entries live in an LRU OrderedDict keyed by (namespace, filters, normalized
+    # query). Each one also owns a row ("slot") of a fixed-size embedding matrix,
+    # so the semantic lookup is one matrix-vector product over every cached query.
+    def __init__(self, max_entries=RESPONSE_CACHE_ENTRIES, ttl=RESPONSE_CACHE_TTL_SECONDS,
+                 similarity=RESPONSE_CACHE_SIMILARITY):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity = similarity
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.pinned_hits = 0
+        self._entries = OrderedDict()
+        self._pinned = {}
+        self._vectors = None
+        self._slot_keys = [None] * max_entries
+        self._slot_groups = [None] * max_entries
+        self._free_slots = list(range(max_entries - 1, -1, -1))
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _group(namespace, filters):
+        return namespace, json.dumps(filters or {}, sort_keys=True)
+
+    def get(self, namespace, query, filters, version, query_embedding=None, count_miss=True):
+        # Exact lookup only, unless query_embedding is given. Callers that try the
+        # exact lookup before embedding the query pass count_miss=False to it, so a
+        # query missing both lookups counts as one miss.
+        if not self.max_entries and not self._pinned:
+            return None
+        group = self._group(namespace, filters)
+        key = group + (normalize_query(query),)
+        now = time.time()
+        with self._lock:
+            pinned = self._pinned.get(key)
+            if pinned is not None and pinned.version == version:
+                self.hits += 1
+                self.pinned_hits += 1
+                return copy.deepcopy(pinned.value)
+            entry = self._live_entry(key, version, now)
+            semantic = False
+            if entry is None and query_embedding is not None and self._vectors is not None:
+                key = self._nearest(group, normalize_embedding(query_embedding))
+                entry = self._live_entry(key, version, now) if key is not None else None
+                semantic = entry is not None
+            if entry is None:
+                self.misses += count_miss
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            self.semantic_hits += semantic
+            return copy.deepcopy(entry.value)
+
+    def set(self, namespace, query, filters, version, value, query_embedding=None):
+        if not self.max_entries:
+            return
+        group = self._group(namespace, filters)
+        key = group + (normalize_query(query),)
+        with self._lock:
+            self._remove(key)
+            while len(self._entries) >= self.max_entries:
+                self._remove(next(iter(self._entries)))
+            slot = None
+            if query_embedding is not None:
+                vector = normalize_embedding(query_embedding)
+                if self._vectors is None:
+                    self._vectors = np.zeros((self.max_entries, len(vector)), dtype=np.float32)
+                if len(vector) == self._vectors.shape[1] and self._free_slots:
+                    slot = self._free_slots.pop()
+                    self._vectors[slot] = vector
+                    self._slot_keys[slot] = key
+                    self._slot_groups[slot] = group
+            self._entries[key] = _Entry(copy.deepcopy(value), version, time.time() + self.ttl, slot)
+
+    def _live_entry(self, key, version, now):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.version != version or entry.expires_at < now:
+            self._remove(key)
+            self.invalidations += 1
+            return None
+        return entry
+
+    def _nearest(self, group, vector):
+        if len(vector) != self._vectors.shape[1]:
+            return None
+        slots = [slot for slot, slot_group in enumerate(self._slot_groups) if slot_group == group]
+        if not slots:
+            return None
+        scores = self._vectors[slots] @ vector
+        best = int(np.argmax(scores))
+        return self._slot_keys[slots[best]] if scores[best] >= self.similarity else None
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None and entry.slot is not None:
+            self._slot_keys[entry.slot] = None
+            self._slot_groups[entry.slot] = None
+            self._free_slots.append(entry.slot)
+
+    def pin(self, entries):
+        # Entries as returned by export(); replaces any pinned entry with the same key
+        with self._lock:
+            for entry in entries:
+                key = self._group(entry["namespace"], entry["filters"]) + (normalize_query(entry["query"]),)
+                self._pinned[key] = _Entry(copy.deepcopy(entry["value"]), entry["version"], float('inf'), None)
+
+    def export(self, queries=None):
+        # JSON-serializable copies of the live entries, pinned ones included,
+        # optionally only those answering one of `queries`
+        wanted = None if queries is None else {normalize_query(query) for query in queries}
+        now = time.time()
+        with self._lock:
+            # A regular entry for the same key is at least as recent as the pinned one
+            entries = dict(self._pinned)
+            entries.update(self._entries)
+            exported = []
+            for (namespace, filters, query), entry in entries.items():
+                if entry.expires_at < now or (wanted is not None and query not in wanted):
+                    continue
+                exported.append({
+                    "namespace": namespace,
+                    "filters": json.loads(filters),
+                    "query": query,
+                    "version": entry.version,
+                    "value": copy.deepcopy(entry.value),
+                    "query_embedding": None if entry.slot is None else self._vectors[entry.slot].tolist(),
+                })
+            return exported
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._entries):
+                self._remove(key)
+            self._pinned.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "semantic_hits": self.semantic_hits, "pinned_hits": self.pinned_hits,
+                    "misses": self.misses, "invalidations": self.invalidations, "entries": len(self._entries),
+                    "pinned": len(self._pinned)}
+
+    def __len__(self):
+        return len(self._entries)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+_context_cache = contextvars.ContextVar('response_cache', default=None)
+
+
+def get_response_cache():
+    global _cache
+    cache = _context_cache.get()
+    if cache is not None:
+        return cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResponseCache()
+    return _cache
+
+
+def set_response_cache(cache):
+    global _cache
+    with _cache_lock:
+        _cache = cache
+
+
+@contextlib.contextmanager
+def use_response_cache(cache):
+    # Routes get_response_cache() to `cache` in the current context only, so work
+    # such as precomputing answers does not touch the cache live requests use
+    token = _context_cache.set(cache)
+    try:
+        yield cache
+    finally:
+        _context_cache.reset(token)
@@ -0,0 +1,587 @@
+# Shared by gcp_nxs-function and gcp_pdf-retrieval-function. Each Cloud Function
+# deploys only its own directory, so keep both copies of this file identical.
+#
+# Vector index backends over a row-normalized float32 or float16 matrix (inner
+# product == cosine). All backends share build/search/save/load so the corpus can
+# pick one by configuration:
+#   flat  exact, one matrix-vector product per query (baseline)
+#   ivf   k-means coarse quantizer, scans only the n_probe closest lists
+#   hnsw  hierarchical navigable small-world graph, greedy best-first search
+#   sq8   per-dimension 8-bit scalar quantization, scanned with asymmetric scores
+#   pq    product quantization (m sub-vectors x 256 centroids), asymmetric lookups
+# The quantized backends re-rank their best `rerank` candidates against the float
+# matrix; with rerank=0 they drop the matrix and keep only the codes in memory.
+import argparse
+import heapq
+import io
+import json
+import logging
+import math
+import os
+import time
+
+import numpy as np
+
+VECTOR_INDEX_TYPE = os.environ.get('VECTOR_INDEX_TYPE', 'flat')
+IVF_N_PROBE = int(os.environ.get('IVF_N_PROBE', '8'))
+HNSW_EF_SEARCH = int(os.environ.get('HNSW_EF_SEARCH', '64'))
+QUANTIZED_RERANK = int(os.environ.get('QUANTIZED_RERANK', '100'))
+# Building an HNSW graph is pure Python (about 4.5 s per thousand 768-dim rows), too
+# slow for a shard load: above this many rows a shard without a saved index is
+# searched flat instead (ingest.py --index hnsw writes one next to the store)
+HNSW_BUILD_MAX_ROWS = int(os.environ.get('HNSW_BUILD_MAX_ROWS', '500'))
+
+
+def normalize_rows(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return np.ascontiguousarray(matrix / norms, dtype=np.float32)
+
+
+def normalize_query(query_embedding):
+    query = np.asarray(query_embedding, dtype=np.float32)
+    query_norm = np.linalg.norm(query)
+    return query / query_norm if query_norm else query
+
+
+def matrix_dot(matrix, query, block_bytes=1 << 20):
+    # float16, uint8 (sq8 codes) or memory-mapped matrices are converted a block of
+    # rows at a time into one float32 buffer small enough to stay in cache, so the
+    # product still goes through BLAS without materializing a float32 copy
+    if matrix.dtype == np.float32:
+        return matrix @ query
+    query = np.asarray(query, dtype=np.float32)
+    scores = np.empty(len(matrix), dtype=np.float32)
+    chunk = max(1, block_bytes // (4 * matrix.shape[1]))
+    buffer = np.empty((min(chunk, len(matrix)), matrix.shape[1]), dtype=np.float32)
+    for start in range(0, len(matrix), chunk):
+        rows = matrix[start:start + chunk]
+        block = buffer[:len(rows)]
+        np.copyto(block, rows, casting='unsafe')
+        np.dot(block, query, out=scores[start:start + len(rows)])
+    return scores
+
+
+def top_k_indices(scores, top_k):
+    k = min(top_k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top], kind="stable")]
+
+
+class FlatIndex:
+    kind = "flat"
+
+    def __init__(self, matrix):
+        self.matrix = matrix
+
+    @property
+    def rows(self):
+        return len(self.matrix)
+
+    @classmethod
+    def build(cls, matrix, **params):
+        return cls(matrix)
+
+    def search(self, query, top_k):
+        scores = matrix_dot(self.matrix, query)
+        ids = top_k_indices(scores, top_k)
+        return scores[ids], ids
+
+    def arrays(self):
+        return {}
+
+    @classmethod
+    def from_arrays(cls, matrix, arrays, params):
+        return cls(matrix)
+
+    def params(self):
+        return {}
+
+    def nbytes(self):
+        return self.matrix.nbytes
+
+
+def spherical_kmeans(matrix, n_clusters, n_iter=10, seed=0, sample_size=100000, chunk=65536):
+    # Centroids are fit on a sample; assignment is chunked so memory stays bounded
+    rng = np.random.default_rng(seed)
+    n = len(matrix)
+    sample = matrix if n <= sample_size else matrix[rng.choice(n, sample_size, replace=False)]
+    centroids = sample[rng.choice(len(sample), n_clusters, replace=False)].astype(np.float32)
+    for _ in range(n_iter):
+        assign = assign_clusters(sample, centroids, chunk)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, sample)
+        counts = np.bincount(assign, minlength=n_clusters)
+        empty = counts == 0
+        if empty.any():
+            sums[empty] = sample[rng.choice(len(sample), int(empty.sum()), replace=False)]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        centroids = (sums / norms).astype(np.float32)
+    return centroids
+
+
+def assign_clusters(matrix, centroids, chunk=65536):
+    assign = np.empty(len(matrix), dtype=np.int64)
+    for start in range(0, len(matrix), chunk):
+        assign[start:start + chunk] = np.argmax(matrix[start:start + chunk] @ centroids.T, axis=1)
+    return assign
+
+
+class IVFIndex:
+    kind = "ivf"
+
+    def __init__(self, matrix, centroids, list_ids, list_offsets, n_probe=IVF_N_PROBE):
+        self.matrix = matrix
+        self.centroids = centroids
+        self.list_ids = list_ids
+        self.list_offsets = list_offsets
+        self.n_probe = n_probe
+
+    @property
+    def rows(self):
+        return len(self.matrix)
+
+    @classmethod
+    def build(cls, matrix, n_lists=None, n_iter=10, seed=0, n_probe=IVF_N_PROBE, **params):
+        n_lists = min(n_lists or max(1, int(math.sqrt(len(matrix)))), len(matrix))
+        centroids = spherical_kmeans(matrix, n_lists, n_iter, seed)
+        assign = assign_clusters(matrix, centroids)
+        list_ids = np.argsort(assign, kind="stable")
+        list_offsets = np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=n_lists))])
+        return cls(matrix, centroids, list_ids, list_offsets, n_probe)
+
+    def search(self, query, top_k):
+        probe = top_k_indices(self.centroids @ query, self.n_probe)
+        candidates = np.concatenate([self.list_ids[self.list_offsets[c]:self.list_offsets[c + 1]] for c in probe])
+        scores = self.matrix[candidates].astype(np.float32) @ query
+        best = top_k_indices(scores, top_k)
+        return scores[best], candidates[best]
+
+    def arrays(self):
+        return {"centroids": self.centroids, "list_ids": self.list_ids, "list_offsets": self.list_offsets}
+
+    @classmethod
+    def from_arrays(cls, matrix, arrays, params):
+        return cls(matrix, arrays["centroids"], arrays["list_ids"], arrays["list_offsets"],
+                   params.get("n_probe", IVF_N_PROBE))
+
+    def params(self):
+        return {"n_probe": self.n_probe}
+
+    def nbytes(self):
+        return self.matrix.nbytes + sum(array.nbytes for array in self.arrays().values())
+
+
+class HNSWIndex:
+    kind = "hnsw"
+
+    def __init__(self, matrix, layers, entry_point, m=16, ef_search=HNSW_EF_SEARCH):
+        self.matrix = matrix
+        # layers[level] maps node -> neighbor id array
+        self.layers = layers
+        self.entry_point = entry_point
+        self.m = m
+        self.ef_search = ef_search
+
+    @property
+    def rows(self):
+        return len(self.matrix)
+
+    @classmethod
+    def build(cls, matrix, m=16, ef_construction=100, seed=0, ef_search=HNSW_EF_SEARCH, **params):
+        rng = np.random.default_rng(seed)
+        level_mult = 1 / math.log(m)
+        levels = np.floor(-np.log(rng.random(len(matrix)) + 1e-12) * level_mult).astype(int)
+        index = cls(matrix, [{}], None, m, ef_search)
+        for node in range(len(matrix)):
+            index._insert(node, int(levels[node]), ef_construction)
+        for layer in index.layers:
+            for node, neighbors in layer.items():
+                layer[node] = np.asarray(neighbors, dtype=np.int64)
+        return index
+
+    def _max_neighbors(self, level):
+        return 2 * self.m if level == 0 else self.m
+
+    def _insert(self, node, level, ef_construction):
+        if self.entry_point is None:
+            while len(self.layers) <= level:
+                self.layers.append({})
+            for l in range(level + 1):
+                self.layers[l][node] = []
+            self.entry_point = node
+            return
+
+        query = self.matrix[node]
+        entry = [self.entry_point]
+        top_level = len(self.layers) - 1
+        for l in range(top_level, level, -1):
+            entry = [self._search_layer(query, entry, 1, l)[0][1]]
+        for l in range(min(level, top_level), -1, -1):
+            found = self._search_layer(query, entry, ef_construction, l)
+            neighbors = self._select_neighbors(node, [n for _, n in found], self.m)
+            self.layers[l][node] = neighbors
+            for neighbor in neighbors:
+                links = self.layers[l][neighbor]
+                links.append(node)
+                if len(links) > self._max_neighbors(l):
+                    self.layers[l][neighbor] = self._select_neighbors(neighbor, links, self._max_neighbors(l))
+            entry = [n for _, n in found]
+        if level > top_level:
+            for l in range(top_level + 1, level + 1):
+                self.layers.append({node: []})
+            self.entry_point = node
+
+    def _select_neighbors(self, node, candidates, limit):
+        # Keeps a candidate only if it is closer to `node` than to every neighbor kept
+        # so far, which spreads links across directions (the HNSW heuristic).
+        candidates = np.asarray([c for c in candidates if c != node], dtype=np.int64)
+        if len(candidates) == 0:
+            return []
+        sims = self.matrix[candidates] @ self.matrix[node]
+        order = np.argsort(-sims)
+        kept = []
+        pruned = []
+        for c, sim in zip(candidates[order].tolist(), sims[order].tolist()):
+            if len(kept) >= limit:
+                break
+            if not kept or sim > float(np.max(self.matrix[kept] @ self.matrix[c])):
+                kept.append(c)
+            else:
+                pruned.append(c)
+        # Top up with the closest pruned candidates so nodes keep enough links
+        return kept + pruned[:limit - len(kept)]
+
+    def _search_layer(self, query, entry_points, ef, level):
+        # Returns up to ef (similarity, node) pairs, best first
+        layer = self.layers[level]
+        entry_points = list(entry_points)
+        sims = self.matrix[entry_points] @ query
+        visited = set(entry_points)
+        candidates = [(-float(s), n) for s, n in zip(sims, entry_points)]
+        heapq.heapify(candidates)
+        results = [(float(s), n) for s, n in zip(sims, entry_points)]
+        heapq.heapify(results)
+        while len(results) > ef:
+            heapq.heappop(results)
+        while candidates:
+            neg_sim, node = heapq.heappop(candidates)
+            if -neg_sim < results[0][0] and len(results) >= ef:
+                break
+            fresh = [n for n in layer.get(node, ()) if n not in visited]
+            if not fresh:
+                continue
+            visited.update(fresh)
+            for sim, n in zip((self.matrix[fresh] @ query).tolist(), fresh):
+                if len(results) < ef or sim > results[0][0]:
+                    heapq.heappush(candidates, (-sim, n))
+                    heapq.heappush(results, (sim, n))
+                    if len(results) > ef:
+                        heapq.heappop(results)
+        return sorted(results, reverse=True)
+
+    def search(self, query, top_k):
+        if self.entry_point is None:
+            return np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int64)
+        entry = [self.entry_point]
+        for level in range(len(self.layers) - 1, 0, -1):
+            entry = [self._search_layer(query, entry, 1, level)[0][1]]
+        found = self._search_layer(query, entry, max(self.ef_search, top_k), 0)[:top_k]
+        return (np.array([s for s, _ in found], dtype=np.float32),
+                np.array([n for _, n in found], dtype=np.int64))
+
+    def arrays(self):
+        arrays = {"entry_point": np.array([self.entry_point], dtype=np.int64)}
+        for level, layer in enumerate(self.layers):
+            nodes = np.array(sorted(layer), dtype=np.int64)
+            neighbors = [np.asarray(layer[n], dtype=np.int64) for n in nodes]
+            arrays[f"layer{level}_nodes"] = nodes
+            arrays[f"layer{level}_offsets"] = np.concatenate([[0], np.cumsum([len(x) for x in neighbors])]).astype(np.int64)
+            arrays[f"layer{level}_neighbors"] = np.concatenate(neighbors) if neighbors else np.empty(0, dtype=np.int64)
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, matrix, arrays, params):
+        layers = []
+        level = 0
+        while f"layer{level}_nodes" in arrays:
+            nodes = arrays[f"layer{level}_nodes"]
+            offsets = arrays[f"layer{level}_offsets"]
+            neighbors = arrays[f"layer{level}_neighbors"]
+            layers.append({int(n): neighbors[offsets[i]:offsets[i + 1]] for i, n in enumerate(nodes)})
+            level += 1
+        return cls(matrix, layers, int(arrays["entry_point"][0]), params.get("m", 16),
+                   params.get("ef_search", HNSW_EF_SEARCH))
+
+    def params(self):
+        return {"m": self.m, "ef_search": self.ef_search}
+
+    def nbytes(self):
+        return self.matrix.nbytes + sum(8 * (len(links) + 2) for layer in self.layers for links in layer.values())
+
+
+def kmeans(data, n_clusters, n_iter=10, seed=0, chunk=65536):
+    # Euclidean k-means for the PQ codebooks; returns (centroids, assignments)
+    rng = np.random.default_rng(seed)
+    data = np.ascontiguousarray(data, dtype=np.float32)
+    centroids = data[rng.choice(len(data), n_clusters, replace=False)].copy()
+    assign = np.zeros(len(data), dtype=np.int64)
+    for _ in range(n_iter):
+        assign = nearest_centroids(data, centroids, chunk)
+        counts = np.bincount(assign, minlength=n_clusters)
+        sums = np.stack([np.bincount(assign, weights=data[:, d], minlength=n_clusters)
+                         for d in range(data.shape[1])], axis=1)
+        empty = counts == 0
+        centroids = sums / np.maximum(counts, 1)[:, None]
+        if empty.any():
+            centroids[empty] = data[rng.choice(len(data), int(empty.sum()), replace=False)]
+    return centroids.astype(np.float32), assign
+
+
+def nearest_centroids(data, centroids, chunk=65536):
+    assign = np.empty(len(data), dtype=np.int64)
+    centroid_norms = np.einsum('ij,ij->i', centroids, centroids)
+    for start in range(0, len(data), chunk):
+        block = np.ascontiguousarray(data[start:start + chunk], dtype=np.float32)
+        # |x - c|^2 without the |x|^2 term, which does not change the argmin
+        distances = block @ (-2 * centroids.T)
+        distances += centroid_norms
+        assign[start:start + chunk] = np.argmin(distances, axis=1)
+    return assign
+
+
+class _QuantizedIndex:
+    # Shared candidate selection + exact re-rank for the quantized backends;
+    # subclasses provide approximate_scores(query, rows=None) over all or some rows.
+    def _rerank_matrix(self, matrix):
+        return matrix if self.rerank else None
+
+    def search(self, query, top_k):
+        approximate = self.approximate_scores(query)
+        if self.matrix is None or not self.rerank:
+            ids = top_k_indices(approximate, top_k)
+            return approximate[ids], ids
+        # Sorted so a memory-mapped matrix is read front to back
+        candidates = np.sort(top_k_indices(approximate, max(self.rerank, top_k)))
+        scores = np.asarray(self.matrix[candidates], dtype=np.float32) @ query
+        best = top_k_indices(scores, top_k)
+        return scores[best], candidates[best]
+
+    def nbytes(self):
+        resident = sum(array.nbytes for array in self.arrays().values())
+        # A memory-mapped matrix is only paged in for the re-ranked rows
+        if self.matrix is not None and not isinstance(self.matrix, np.memmap):
+            resident += self.matrix.nbytes
+        return resident
+
+
+class SQ8Index(_QuantizedIndex):
+    kind = "sq8"
+
+    def __init__(self, matrix, codes, low, scale, rerank=QUANTIZED_RERANK):
+        self.codes = codes
+        self.low = low
+        self.scale = scale
+        self.rerank = rerank
+        self.matrix = self._rerank_matrix(matrix)
+
+    @property
+    def rows(self):
+        return len(self.codes)
+
+    @classmethod
+    def build(cls, matrix, rerank=QUANTIZED_RERANK, chunk=65536, **params):
+        low = np.full(matrix.shape[1], np.inf, dtype=np.float32)
+        high = np.full(matrix.shape[1], -np.inf, dtype=np.float32)
+        for start in range(0, len(matrix), chunk):
+            block = np.asarray(matrix[start:start + chunk], dtype=np.float32)
+            low = np.minimum(low, block.min(axis=0))
+            high = np.maximum(high, block.max(axis=0))
+        scale = np.where(high > low, (high - low) / 255, 1.0).astype(np.float32)
+        codes = np.empty(matrix.shape, dtype=np.uint8)
+        for start in range(0, len(matrix), chunk):
+            block = np.asarray(matrix[start:start + chunk], dtype=np.float32)
+            codes[start:start + chunk] = np.clip(np.rint((block - low) / scale), 0, 255)
+        return cls(matrix, codes, low, scale, rerank)
+
+    def approximate_scores(self, query, rows=None):
+        # x ~ low + scale * code, so x.q ~ low.q + code.(scale * q)
+        codes = self.codes if rows is None else self.codes[rows]
+        return matrix_dot(codes, self.scale * query) + float(self.low @ query)
+
+    def arrays(self):
+        return {"codes": self.codes, "low": self.low, "scale": self.scale}
+
+    @classmethod
+    def from_arrays(cls, matrix, arrays, params):
+        return cls(matrix, arrays["codes"], arrays["low"], arrays["scale"], params.get("rerank", QUANTIZED_RERANK))
+
+    def params(self):
+        return {"rerank": self.rerank}
+
+
+class PQIndex(_QuantizedIndex):
+    kind = "pq"
+
+    def __init__(self, matrix, codebooks, codes, rerank=QUANTIZED_RERANK):
+        # codebooks: (m, n_centroids, dim / m); codes: (rows, m) centroid ids
+        self.codebooks = codebooks
+        self.codes = codes
+        self.rerank = rerank
+        self.matrix = self._rerank_matrix(matrix)
+
+    @property
+    def rows(self):
+        return len(self.codes)
+
+    @classmethod
+    def build(cls, matrix, m=None, n_iter=10, seed=0, sample_size=50000, rerank=QUANTIZED_RERANK, **params):
+        dim = matrix.shape[1]
+        m = m or next(m for m in (96, 64, 48, 32, 16, 8, 4, 2, 1) if dim % m == 0)
+        if dim % m:
+            raise ValueError(f"PQ needs m to divide the dimensionality ({dim})")
+        sub = dim // m
+        n_centroids = min(256, len(matrix))
+        rng = np.random.default_rng(seed)
+        sample_ids = np.arange(len(matrix)) if len(matrix) <= sample_size else \
+            np.sort(rng.choice(len(matrix), sample_size, replace=False))
+        sample = np.asarray(matrix[sample_ids], dtype=np.float32)
+        codebooks = np.empty((m, n_centroids, sub), dtype=np.float32)
+        codes = np.empty((len(matrix), m), dtype=np.uint8)
+        for j in range(m):
+            codebooks[j], _ = kmeans(sample[:, j * sub:(j + 1) * sub], n_centroids, n_iter, seed + j)
+            codes[:, j] = nearest_centroids(matrix[:, j * sub:(j + 1) * sub], codebooks[j])
+        return cls(matrix, codebooks, codes, rerank)
+
+    def approximate_scores(self, query, rows=None, chunk=65536):
+        m, _, sub = self.codebooks.shape
+        # Lookup table of each sub-query against every centroid, summed per row
+        table = np.einsum('jcs,js->jc', self.codebooks, query.reshape(m, sub))
+        codes = self.codes if rows is None else self.codes[rows]
+        columns = np.arange(m)
+        scores = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), chunk):
+            scores[start:start + chunk] = table[columns, codes[start:start + chunk]].sum(axis=1)
+        return scores
+
+    def arrays(self):
+        return {"codebooks": self.codebooks, "codes": self.codes}
+
+    @classmethod
+    def from_arrays(cls, matrix, arrays, params):
+        return cls(matrix, arrays["codebooks"], arrays["codes"], params.get("rerank", QUANTIZED_RERANK))
+
+    def params(self):
+        return {"rerank": self.rerank}
+
+
+INDEX_TYPES = {cls.kind: cls for cls in (FlatIndex, IVFIndex, HNSWIndex, SQ8Index, PQIndex)}
+
+
+def build_index(matrix, kind=VECTOR_INDEX_TYPE, **params):
+    if kind not in INDEX_TYPES:
+        raise ValueError(f"Unknown vector index type: {kind}")
+    return INDEX_TYPES[kind].build(matrix, **params)
+
+
+def save_index(index, fileobj):
+    header = json.dumps({"kind": index.kind, "params": index.params(), "rows": index.rows})
+    np.savez(fileobj, header=np.array(header), **index.arrays())
+
+
+def load_index(fileobj, matrix):
+    # `matrix` is the same row-normalized matrix the index was built over
+    if isinstance(fileobj, (bytes, bytearray)):
+        fileobj = io.BytesIO(fileobj)
+    with np.load(fileobj, allow_pickle=False) as data:
+        arrays = {key: data[key] for key in data.files}
+    header = json.loads(str(arrays.pop("header")))
+    if header["rows"] != len(matrix):
+        raise ValueError(f"Index was built over {header['rows']} rows, matrix has {len(matrix)}")
+    return INDEX_TYPES[header["kind"]].from_arrays(matrix, arrays, header["params"])
+
+
+def recall_at_k(index, queries, k=10, matrix=None):
+    # Mean overlap between the index's top-k and the exact top-k over `queries`;
+    # pass `matrix` for indexes that do not keep the float vectors
+    exact = FlatIndex(index.matrix if matrix is None else matrix)
+    hits = 0
+    for query in queries:
+        _, expected = exact.search(query, k)
+        _, found = index.search(query, k)
+        hits += len(set(expected.tolist()) & set(found.tolist()))
+    return hits / (len(queries) * k)
+
+
+def _load_matrix(path):
+    if path.endswith('.npy'):
+        return normalize_rows(np.load(path, mmap_mode='r'))
+    with open(path) as f:
+        items = json.load(f)
+    return normalize_rows([item['embeddings'] for item in items])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and evaluate vector indexes")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build = subparsers.add_parser("build", help="build an index over an embeddings file and save it")
+    build.add_argument("embeddings", help="embeddings JSON (list of {'embeddings': [...]}) or .npy matrix")
+    build.add_argument("output", help="where to write the .npz index")
+    build.add_argument("--type", default=VECTOR_INDEX_TYPE, choices=sorted(INDEX_TYPES))
+    build.add_argument("--params", default="{}", help="JSON build parameters, e.g. '{\"n_lists\": 1024}'")
+
+    evaluate = subparsers.add_parser("eval", help="report recall@k and latency against the flat baseline")
+    evaluate.add_argument("embeddings", nargs="?", help="embeddings file; omitted uses random vectors")
+    evaluate.add_argument("--index", help="saved index to evaluate instead of building one")
+    evaluate.add_argument("--type", default="ivf", choices=sorted(INDEX_TYPES))
+    evaluate.add_argument("--params", default="{}")
+    evaluate.add_argument("--rows", type=int, default=20000)
+    evaluate.add_argument("--dim", type=int, default=768)
+    evaluate.add_argument("--queries", type=int, default=100)
+    evaluate.add_argument("-k", type=int, default=10)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    rng = np.random.default_rng(0)
+    if args.command == "build":
+        matrix = _load_matrix(args.embeddings)
+        started = time.perf_counter()
+        index = build_index(matrix, args.type, **json.loads(args.params))
+        logging.info(f"Built {args.type} index over {len(matrix)} rows in {time.perf_counter() - started:.1f}s")
+        with open(args.output, 'wb') as f:
+            save_index(index, f)
+        return
+
+    if args.embeddings:
+        matrix = _load_matrix(args.embeddings)
+    else:
+        matrix = normalize_rows(rng.standard_normal((args.rows, args.dim), dtype=np.float32))
+    if args.index:
+        with open(args.index, 'rb') as f:
+            index = load_index(f, matrix)
+    else:
+        started = time.perf_counter()
+        index = build_index(matrix, args.type, **json.loads(args.params))
+        print(f"build_seconds={time.perf_counter() - started:.2f}")
+
+    # Queries are perturbed corpus rows so they have genuine near neighbours
+    picks = matrix[rng.choice(len(matrix), args.queries, replace=False)]
+    queries = picks + 0.1 * rng.standard_normal(picks.shape, dtype=np.float32) / math.sqrt(matrix.shape[1])
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    for candidate in (FlatIndex(matrix), index):
+        started = time.perf_counter()
+        for query in queries:
+            candidate.search(query, args.k)
+        latency_ms = (time.perf_counter() - started) * 1000 / len(queries)
+        print(f"{candidate.kind}: mean_latency_ms={latency_ms:.3f}")
+    print(f"recall@{args.k}={recall_at_k(index, queries, args.k, matrix):.4f}")
+
+
+if __name__ == "__main__":
+    main()
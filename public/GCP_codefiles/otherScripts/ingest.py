@@ -0,0 +1,352 @@
+# Offline ingestion: chunks a transcript or PDF, embeds the chunks and writes the
+# compact store (embedding_store.py) that the retrieval functions memory-map.
+#
+#   python ingest.py transcript lecture.vtt out/cornellLecture
+#   python ingest.py pdf IntroMLpaper.pdf out/IntroMLpaper --upload gs://nxs_bucket1/stores/IntroMLpaper
+#   python ingest.py convert transcription_embeddings.json out/cornellLecture --kind video
+#   python ingest.py pdf IntroMLpaper.pdf out/IntroMLpaper --index hnsw --index-params '{"m": 16}'
+#
+# Re-running against an existing output prefix only embeds chunks whose content
+# hash is new. Embedded batches are checkpointed to <prefix>.checkpoint.jsonl so
+# an interrupted run resumes where it stopped. --index saves a vector index over the
+# store to <prefix>.index.npz, which the functions load instead of building one (hnsw
+# is only built on load for small shards). Chunk metadata is JSON unless
+# --meta-format parquet is given; install otherScripts/requirements.txt first.
+import argparse
+import hashlib
+import json
+import logging
+import os
+import re
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'gcp_nxs-function'))
+
+from embedding_client import EMBEDDING_MODEL, FakeEmbedder, VertexEmbedder  # noqa: E402
+from embedding_store import (  # noqa: E402
+    STORE_SUFFIXES,
+    read_columns,
+    read_manifest,
+    replacing,
+    timestamp_seconds,
+    write_store,
+)
+from lexical import BM25Index, preprocess_text  # noqa: E402
+from runtime import init_vertexai  # noqa: E402
+from vector_index import INDEX_TYPES, build_index, normalize_rows, save_index  # noqa: E402
+
+EMBEDDING_TASK = "RETRIEVAL_DOCUMENT"
+EMBEDDING_DIMENSIONALITY = 768
+
+logging.basicConfig(level=logging.INFO)
+
+
+def parse_timestamp(value):
+    h, m, s = value.strip().replace(',', '.').split(':')
+    return f"{int(h):02d}:{int(m):02d}:{int(float(s)):02d}"
+
+
+def load_segments(path):
+    # Transcript segments as (text, start_time, end_time). Accepts the JSON layout of
+    # the old embeddings blobs ([{"transcript", "time_stamp": {...}}]) or WebVTT/SRT.
+    if path.endswith('.json'):
+        with open(path) as f:
+            items = json.load(f)
+        return [(item['transcript'], item['time_stamp']['start_time'], item['time_stamp']['end_time'])
+                for item in items]
+    with open(path, encoding='utf-8') as f:
+        blocks = re.split(r'\n\s*\n', f.read())
+    segments = []
+    for block in blocks:
+        lines = [line.strip() for line in block.strip().splitlines()]
+        for i, line in enumerate(lines):
+            if '-->' in line:
+                start, end = (part.split()[0] for part in line.split('-->'))
+                if start.count(':') == 1:
+                    start, end = f"00:{start}", f"00:{end}"
+                text = " ".join(lines[i + 1:])
+                if text:
+                    segments.append((text, parse_timestamp(start), parse_timestamp(end)))
+                break
+    return segments
+
+
+def chunk_transcript(segments, max_words=80):
+    # Merges consecutive segments into chunks of up to max_words, spanning from the
+    # first segment's start to the last one's end
+    columns = {"transcript": [], "start_time": [], "end_time": [], "start_seconds": [], "end_seconds": []}
+    current = []
+    words = 0
+    for segment in segments + [None]:
+        segment_words = len(segment[0].split()) if segment else 0
+        if current and (segment is None or words + segment_words > max_words):
+            columns["transcript"].append(" ".join(text for text, _, _ in current))
+            columns["start_time"].append(current[0][1])
+            columns["end_time"].append(current[-1][2])
+            columns["start_seconds"].append(timestamp_seconds(current[0][1]))
+            columns["end_seconds"].append(timestamp_seconds(current[-1][2]))
+            current, words = [], 0
+        if segment:
+            current.append(segment)
+            words += segment_words
+    return columns
+
+
+def chunk_pdf(path, max_words=120):
+    # Text blocks merged per page up to max_words; coordinates are the union bbox
+    # [x0, y0, x1, y1] of the merged blocks
+    try:
+        import fitz
+    except ImportError:
+        raise SystemExit("PDF ingestion needs PyMuPDF: pip install pymupdf")
+    columns = {"chunk": [], "page": [], "coordinates": []}
+
+    def flush(page_number, blocks):
+        if blocks:
+            columns["chunk"].append(preprocess_text(" ".join(block[4] for block in blocks)))
+            columns["page"].append(page_number)
+            columns["coordinates"].append([
+                min(block[0] for block in blocks), min(block[1] for block in blocks),
+                max(block[2] for block in blocks), max(block[3] for block in blocks),
+            ])
+
+    with fitz.open(path) as pdf:
+        for page_number, page in enumerate(pdf, start=1):
+            current, words = [], 0
+            for block in page.get_text("blocks"):
+                text = " ".join(block[4].split())
+                if not text:
+                    continue
+                block = (block[0], block[1], block[2], block[3], text)
+                if current and words + len(text.split()) > max_words:
+                    flush(page_number, current)
+                    current, words = [], 0
+                current.append(block)
+                words += len(text.split())
+            flush(page_number, current)
+    return columns
+
+
+def chunk_texts(kind, columns):
+    return columns["transcript"] if kind == "video" else columns["chunk"]
+
+
+def content_hash(text, model_name, dimensionality):
+    return hashlib.sha256(f"{model_name}|{EMBEDDING_TASK}|{dimensionality}|{text}".encode('utf-8')).hexdigest()
+
+
+class RateLimiter:
+    def __init__(self, requests_per_minute):
+        self.interval = 60.0 / requests_per_minute if requests_per_minute else 0.0
+        self.next_at = 0.0
+
+    def wait(self):
+        now = time.monotonic()
+        if now < self.next_at:
+            time.sleep(self.next_at - now)
+        self.next_at = max(now, self.next_at) + self.interval
+
+
+def embed_with_retry(embedder, texts, dimensionality, max_retries=5):
+    for attempt in range(max_retries + 1):
+        try:
+            return embedder.embed(texts, EMBEDDING_TASK, dimensionality)
+        except Exception as e:
+            if attempt == max_retries:
+                raise
+            delay = min(60.0, 2 ** attempt)
+            logging.warning(f"Embedding batch failed ({e}); retrying in {delay:.0f}s")
+            time.sleep(delay)
+
+
+def existing_vectors(prefix, model_name, dimensionality):
+    # content hash -> vector from a previous run's store, if it used the same model
+    if not os.path.exists(f"{prefix}.manifest.json"):
+        return {}
+    manifest = read_manifest(prefix)
+    if manifest.get('model') != model_name or manifest.get('dim') != dimensionality:
+        logging.info("Existing store used a different model or dimensionality; re-embedding everything")
+        return {}
+    hashes = read_columns(prefix, manifest).get('content_hash', [])
+    matrix = np.load(f"{prefix}.embeddings.npy", mmap_mode='r')
+    return {h: matrix[i] for i, h in enumerate(hashes)}
+
+
+def load_checkpoint(path):
+    vectors = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # A run killed mid-write leaves a partial last line
+                    continue
+                vectors[entry['hash']] = entry['embedding']
+        logging.info(f"Resuming with {len(vectors)} checkpointed embeddings")
+    return vectors
+
+
+def embed_chunks(texts, hashes, prefix, embedder, model_name, dimensionality, batch_size, requests_per_minute):
+    vectors = existing_vectors(prefix, model_name, dimensionality)
+    reused = sum(1 for h in set(hashes) if h in vectors)
+    checkpoint_path = f"{prefix}.checkpoint.jsonl"
+    os.makedirs(os.path.dirname(os.path.abspath(prefix)), exist_ok=True)
+    vectors.update(load_checkpoint(checkpoint_path))
+
+    pending = list(dict.fromkeys((h, text) for h, text in zip(hashes, texts) if h not in vectors))
+    logging.info(f"{len(set(hashes))} unique chunks: {reused} unchanged, {len(pending)} to embed")
+    limiter = RateLimiter(requests_per_minute)
+    with open(checkpoint_path, 'a') as checkpoint:
+        for start in range(0, len(pending), batch_size):
+            batch = pending[start:start + batch_size]
+            limiter.wait()
+            embedded = embed_with_retry(embedder, [text for _, text in batch], dimensionality)
+            for (h, _), vector in zip(batch, embedded):
+                vectors[h] = vector
+                checkpoint.write(json.dumps({"hash": h, "embedding": list(vector)}) + "\n")
+            checkpoint.flush()
+            logging.info(f"Embedded {min(start + batch_size, len(pending))}/{len(pending)}")
+    matrix = np.empty((len(hashes), dimensionality), dtype=np.float32)
+    for i, h in enumerate(hashes):
+        matrix[i] = vectors[h]
+    return matrix, checkpoint_path
+
+
+def ingest(kind, columns, prefix, embedder, model_name, dimensionality, dtype, batch_size, requests_per_minute, source,
+           index=None, index_params=None, meta_format='json'):
+    texts = chunk_texts(kind, columns)
+    hashes = [content_hash(text, model_name, dimensionality) for text in texts]
+    matrix, checkpoint_path = embed_chunks(texts, hashes, prefix, embedder, model_name, dimensionality,
+                                           batch_size, requests_per_minute)
+    columns = dict(columns, content_hash=hashes)
+    # The manifest is written last; shards reload when it changes
+    write_lexical(prefix, kind, columns)
+    matrix = normalize_rows(matrix)
+    if index:
+        write_index(prefix, matrix, index, index_params)
+    manifest = write_store(prefix, matrix, columns, kind, dtype, meta_format,
+                           model=model_name, task=EMBEDDING_TASK, source=source, text_normalized=kind == "pdf")
+    os.remove(checkpoint_path)
+    logging.info(f"Wrote {manifest['rows']} x {manifest['dim']} {manifest['dtype']} store to {prefix}")
+    return manifest
+
+
+def write_lexical(prefix, kind, columns):
+    os.makedirs(os.path.dirname(os.path.abspath(prefix)), exist_ok=True)
+    with replacing(f"{prefix}.bm25.npz") as tmp, open(tmp, 'wb') as f:
+        BM25Index.build(chunk_texts(kind, columns)).save(f)
+
+
+def write_index(prefix, matrix, kind, params=None):
+    started = time.perf_counter()
+    built = build_index(matrix, kind, **(params or {}))
+    with replacing(f"{prefix}.index.npz") as tmp, open(tmp, 'wb') as f:
+        save_index(built, f)
+    logging.info(f"Built {kind} index over {len(matrix)} rows in {time.perf_counter() - started:.1f}s")
+
+
+def convert(path, kind, prefix, dtype, model_name, index=None, index_params=None, meta_format='json'):
+    # Rewrites an existing JSON embeddings blob in the compact format without re-embedding
+    with open(path) as f:
+        items = json.load(f)
+    if kind == "video":
+        columns = {
+            "transcript": [item['transcript'] for item in items],
+            "start_time": [item['time_stamp']['start_time'] for item in items],
+            "end_time": [item['time_stamp']['end_time'] for item in items],
+        }
+        columns["start_seconds"] = [timestamp_seconds(value) for value in columns["start_time"]]
+        columns["end_seconds"] = [timestamp_seconds(value) for value in columns["end_time"]]
+    else:
+        columns = {
+            "chunk": [preprocess_text(item['chunk']) for item in items],
+            "page": [item['page'] for item in items],
+            "coordinates": [item['coordinates'] for item in items],
+        }
+    matrix = normalize_rows([item['embeddings'] for item in items])
+    columns["content_hash"] = [content_hash(text, model_name, matrix.shape[1]) for text in chunk_texts(kind, columns)]
+    write_lexical(prefix, kind, columns)
+    if index:
+        write_index(prefix, matrix, index, index_params)
+    manifest = write_store(prefix, matrix, columns, kind, dtype, meta_format, model=model_name, task=EMBEDDING_TASK,
+                           source=path, text_normalized=kind == "pdf")
+    logging.info(f"Converted {manifest['rows']} rows from {path} to {prefix}")
+    return manifest
+
+
+def upload(prefix, destination):
+    from gcs import get_bucket
+    bucket_name, blob_prefix = destination[len('gs://'):].split('/', 1)
+    bucket = get_bucket(bucket_name)
+    # The manifest goes last: the functions reload a store when its manifest changes
+    for suffix in sorted(STORE_SUFFIXES, key=lambda suffix: suffix == '.manifest.json'):
+        if os.path.exists(prefix + suffix):
+            with open(prefix + suffix, 'rb') as f:
+                bucket.blob(blob_prefix + suffix).upload_from_string(f.read())
+            logging.info(f"Uploaded {destination}{suffix}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chunk, embed and write compact embedding stores")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    def add_common(subparser):
+        subparser.add_argument("output", help="output prefix, e.g. out/cornellLecture")
+        subparser.add_argument("--dtype", choices=["float16", "float32"], default="float16")
+        subparser.add_argument("--model", default=EMBEDDING_MODEL)
+        subparser.add_argument("--upload", help="gs://bucket/prefix to copy the store to")
+        subparser.add_argument("--index", choices=sorted(INDEX_TYPES), help="also save a vector index of this type")
+        subparser.add_argument("--index-params", type=json.loads, default={}, help="JSON index build parameters")
+        subparser.add_argument("--meta-format", choices=["json", "parquet"], default="json",
+                               help="chunk metadata format; parquet needs pyarrow here and in the functions")
+
+    def add_embedding(subparser):
+        add_common(subparser)
+        subparser.add_argument("--dimensionality", type=int, default=EMBEDDING_DIMENSIONALITY)
+        subparser.add_argument("--batch-size", type=int, default=32)
+        subparser.add_argument("--requests-per-minute", type=float, default=120)
+        subparser.add_argument("--fake", action="store_true", help="use FakeEmbedder instead of Vertex AI")
+
+    transcript = subparsers.add_parser("transcript", help="ingest a transcript (.json, .vtt or .srt)")
+    transcript.add_argument("input")
+    transcript.add_argument("--max-words", type=int, default=80)
+    add_embedding(transcript)
+
+    pdf = subparsers.add_parser("pdf", help="ingest a PDF")
+    pdf.add_argument("input")
+    pdf.add_argument("--max-words", type=int, default=120)
+    add_embedding(pdf)
+
+    conversion = subparsers.add_parser("convert", help="convert a JSON embeddings blob without re-embedding")
+    conversion.add_argument("input")
+    conversion.add_argument("--kind", choices=["video", "pdf"], required=True)
+    add_common(conversion)
+
+    args = parser.parse_args()
+    if args.command == "convert":
+        convert(args.input, args.kind, args.output, args.dtype, args.model, args.index, args.index_params,
+                args.meta_format)
+    else:
+        if args.fake:
+            embedder = FakeEmbedder(args.dimensionality)
+        else:
+            # Application default credentials, e.g. from gcloud auth application-default login
+            init_vertexai()
+            embedder = VertexEmbedder(args.model)
+        if args.command == "transcript":
+            kind, columns = "video", chunk_transcript(load_segments(args.input), args.max_words)
+        else:
+            kind, columns = "pdf", chunk_pdf(args.input, args.max_words)
+        ingest(kind, columns, args.output, embedder, args.model, args.dimensionality, args.dtype,
+               args.batch_size, args.requests_per_minute, os.path.basename(args.input), args.index, args.index_params,
+               args.meta_format)
+    if args.upload:
+        upload(args.output, args.upload)
+
+
+if __name__ == "__main__":
+    main()
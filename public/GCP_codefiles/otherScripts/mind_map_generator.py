@@ -1,7 +1,63 @@
+# Mind map of the student query log. Queries are embedded and clustered into
+# topics, related queries in different topics are connected by thresholded
+# embedding similarity, and the map is laid out and written as JSON (the
+# InteractiveMindMap data shape plus layout) and/or SVG, with PNG optional.
+# Outputs are cached by content hash, so an unchanged map is never recomputed.
+#
+#   python mind_map_generator.py ../../mind_map_data.json --svg mind_map.svg --json mind_map_layout.json
+#   python mind_map_generator.py queries.json --topics 8 --svg map.svg --json map.json
+#   python mind_map_generator.py ../../mind_map_data.json --png ../../mind_map.png
+#
+# Input is either mind_map_data.json-style {"topics": [...], "connections": [...]},
+# kept as authored unless --recluster is given (--connect derives only its
+# connections), or a query log: a JSON list of strings or {"id", "text"} objects,
+# or a text file with one query per line. Only a query log, --recluster and
+# --connect embed the queries.
+import argparse
+import hashlib
+import html
 import json
-import matplotlib.pyplot as plt
-import numpy as np
+import logging
+import math
+import os
+import shutil
+import sys
 import textwrap
+from collections import Counter
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'gcp_nxs-function'))
+
+from embedding_client import EMBEDDING_MODEL, FakeEmbedder, VertexEmbedder  # noqa: E402
+from lexical import tokenize  # noqa: E402
+from runtime import init_vertexai  # noqa: E402
+from vector_index import kmeans, normalize_rows  # noqa: E402
+
+EMBEDDING_TASK = "CLUSTERING"
+EMBEDDING_DIMENSIONALITY = 768
+MIND_MAP_CACHE_DIR = os.environ.get('MIND_MAP_CACHE_DIR', '/tmp/nxs_mind_map')
+# Bump when the layout or rendering changes so cached outputs are regenerated
+MIND_MAP_VERSION = 1
+
+# Layout units: SVG user units (pixels at 100% zoom)
+QUERY_WIDTH = 140
+QUERY_HEIGHT = 100
+QUERY_SPACING = 165
+TOPIC_GAP = 60
+MARGIN = 40
+TOPIC_COLOR = '#E6E6FA'
+QUERY_COLOR = '#FFE4B5'
+
+STOPWORDS = frozenset((
+    "the", "and", "for", "are", "what", "how", "can", "does", "between", "with", "from", "that", "this",
+    "their", "terms", "used", "using", "being", "which", "when", "why", "into", "its", "role", "key",
+    "some", "there", "these", "them", "they", "have", "has", "will", "would", "should", "could", "about",
+    "differ", "different", "differences", "main", "ways", "way", "use", "make", "more", "most",
+))
+
+logging.basicConfig(level=logging.INFO)
+
 
 def truncate_text(text, max_words=6):
     words = text.split()
@@ -9,46 +65,368 @@ def truncate_text(text, max_words=6):
         return text
     return ' '.join(words[:max_words]) + '...'
 
-def generate_mind_map(data_file, output_file):
-    with open(data_file, 'r') as f:
-        data = json.load(f)
-
-    fig, ax = plt.subplots(figsize=(24, 18))  # Larger figure size for better visibility
-    ax.set_xlim(0, 100)
-    ax.set_ylim(0, 100)
-
-    topic_centers = [(25, 50), (50, 25), (75, 50)]
-    topic_colors = ['#E6E6FA', '#E6E6FA', '#E6E6FA']
-    query_color = '#FFE4B5'
-
-    query_positions = {}
-
-    for i, topic in enumerate(data['topics']):
-        x, y = topic_centers[i]
-        circle = plt.Circle((x, y), 22, color=topic_colors[i], alpha=0.5)
-        ax.add_artist(circle)
-        # Increase font size of the topic names
-        ax.text(x, y+25, textwrap.fill(topic['name'], 20), ha='center', va='center', fontweight='bold', fontsize=14)
-
-        for j, query in enumerate(topic['queries']):
-            angle = 2 * np.pi * j / len(topic['queries'])
-            qx = x + 19 * np.cos(angle)
-            qy = y + 19 * np.sin(angle)
-            query_positions[query['id']] = (qx, qy)
-            ax.add_patch(plt.Rectangle((qx-6, qy-3), 12, 6, fill=True, facecolor=query_color, edgecolor='black'))
-            truncated_text = truncate_text(query['text'])
-            # Increase font size of the questions
-            ax.text(qx, qy, textwrap.fill(truncated_text, 20), ha='center', va='center', fontsize=10, wrap=True)
-
-    for connection in data['connections']:
-        start = query_positions[connection[0]]
-        end = query_positions[connection[1]]
-        ax.plot([start[0], end[0]], [start[1], end[1]], 'k-', linewidth=0.5)
 
+def load_input(path):
+    # Returns (data, queries): data is the mind-map dict for structured input,
+    # None for a query log; queries are {"id", "text"} dicts in input order
+    with open(path, encoding='utf-8') as f:
+        raw = f.read()
+    try:
+        data = json.loads(raw)
+    except ValueError:
+        data = [line.strip() for line in raw.splitlines() if line.strip()]
+    if isinstance(data, dict):
+        return data, [query for topic in data['topics'] for query in topic['queries']]
+    queries = [item if isinstance(item, dict) else {"id": f"Q{i + 1}", "text": item} for i, item in enumerate(data)]
+    return None, queries
+
+
+def embed_queries(texts, embedder, model_name, cache_dir, batch_size=100):
+    # Embeddings are cached by text hash across runs, so adding queries to the log
+    # only embeds the new ones
+    path = os.path.join(cache_dir, f"embeddings.{model_name}.{EMBEDDING_TASK}.npz")
+    known = {}
+    if os.path.exists(path):
+        with np.load(path) as cached:
+            known = dict(zip(cached['hashes'].tolist(), cached['vectors']))
+    hashes = [hashlib.sha256(text.encode('utf-8')).hexdigest() for text in texts]
+    missing = list(dict.fromkeys(h for h in hashes if h not in known))
+    if missing:
+        by_hash = dict(zip(hashes, texts))
+        logging.info(f"Embedding {len(missing)} of {len(texts)} queries")
+        for start in range(0, len(missing), batch_size):
+            batch = missing[start:start + batch_size]
+            vectors = embedder.embed([by_hash[h] for h in batch], EMBEDDING_TASK, EMBEDDING_DIMENSIONALITY)
+            known.update(zip(batch, np.asarray(vectors, dtype=np.float32)))
+        os.makedirs(cache_dir, exist_ok=True)
+        np.savez(path, hashes=np.array(list(known)), vectors=np.stack(list(known.values())))
+    return normalize_rows(np.stack([known[h] for h in hashes]))
+
+
+def default_topic_count(n_queries):
+    return int(min(12, max(2, round(math.sqrt(n_queries / 2)))))
+
+
+def cluster_queries(vectors, n_topics, seed=0):
+    # k-means over the unit-length embeddings; topics are numbered largest first
+    n_topics = min(n_topics, len(vectors))
+    centroids, labels = kmeans(vectors, n_topics, n_iter=25, seed=seed)
+    order = np.argsort(-np.bincount(labels, minlength=n_topics), kind="stable")
+    rank = np.empty_like(order)
+    rank[order] = np.arange(n_topics)
+    return rank[labels], centroids[order]
+
+
+def name_topics(texts, labels, n_topics, terms=3):
+    # Each topic is named after the words most specific to its queries: frequency
+    # within the topic weighted by how few other topics use the word
+    counts = [Counter() for _ in range(n_topics)]
+    for text, label in zip(texts, labels):
+        counts[label].update({token for token in tokenize(text) if len(token) > 2 and token not in STOPWORDS
+                              and not token.isdigit()})
+    spread = Counter(token for counter in counts for token in counter)
+    names = []
+    for topic, counter in enumerate(counts):
+        scored = sorted(counter, key=lambda token: (-counter[token] * math.log(1 + n_topics / spread[token]), token))
+        names.append(" / ".join(token.capitalize() for token in scored[:terms]) or f"Topic {topic + 1}")
+    return names
+
+
+def similarity_connections(vectors, labels, threshold, max_per_query=2, block=1024):
+    # Pairs of queries in different topics whose cosine similarity reaches the
+    # threshold, at most max_per_query strongest per query, computed block by
+    # block so thousands of queries never need the full n x n matrix at once
+    pairs = set()
+    for start in range(0, len(vectors), block):
+        scores = vectors[start:start + block] @ vectors.T
+        scores[labels[start:start + block][:, None] == labels[None, :]] = -np.inf
+        k = min(max_per_query, scores.shape[1])
+        best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        for row, columns in enumerate(best):
+            i = start + row
+            for j in columns:
+                if scores[row, j] >= threshold:
+                    pairs.add((min(i, int(j)), max(i, int(j))))
+    return sorted(pairs)
+
+
+def topic_radii(sizes):
+    # Area grows with the number of queries, so query spacing stays constant
+    return QUERY_SPACING * np.sqrt(np.maximum(sizes, 1)) * 0.62 + QUERY_WIDTH / 2
+
+
+def pack_topics(radii, anchors=None, iterations=400, seed=0):
+    # Vectorized force relaxation: overlapping circles push each other apart
+    # (pairwise, all at once) while a weak pull keeps the map compact. `anchors`
+    # (e.g. the topics' centroids projected to 2-D) set the starting arrangement
+    # so related topics end up near each other.
+    n = len(radii)
+    if n == 1:
+        return np.zeros((1, 2))
+    if anchors is None:
+        angles = 2 * np.pi * np.arange(n) / n
+        anchors = np.stack([np.cos(angles), np.sin(angles)], axis=1)
+    anchors = anchors - anchors.mean(axis=0)
+    scale = np.abs(anchors).max() or 1.0
+    positions = anchors / scale * radii.sum() / 2
+    positions += np.random.default_rng(seed).normal(scale=1e-3, size=positions.shape)
+    min_distance = radii[:, None] + radii[None, :] + TOPIC_GAP
+    np.fill_diagonal(min_distance, 0)
+    for _ in range(iterations):
+        delta = positions[:, None, :] - positions[None, :, :]
+        distance = np.sqrt((delta ** 2).sum(axis=2)) + 1e-9
+        overlap = np.maximum(min_distance - distance, 0)
+        positions += (delta / distance[:, :, None] * overlap[:, :, None]).sum(axis=1) * 0.5
+        positions -= positions * 0.01
+    # Resolve whatever overlap the pull left behind
+    for _ in range(iterations):
+        delta = positions[:, None, :] - positions[None, :, :]
+        distance = np.sqrt((delta ** 2).sum(axis=2)) + 1e-9
+        overlap = np.maximum(min_distance - distance, 0)
+        if overlap.max() < 1e-6:
+            break
+        positions += (delta / distance[:, :, None] * overlap[:, :, None]).sum(axis=1) * 0.5
+    return positions
+
+
+def sunflower(count, radius):
+    # Evenly spread points inside a circle (Vogel's spiral), relative to its center
+    k = np.arange(count)
+    rho = radius * np.sqrt((k + 0.5) / count) if count > 1 else np.zeros(1)
+    theta = k * math.pi * (3 - math.sqrt(5))
+    return np.stack([rho * np.cos(theta), rho * np.sin(theta)], axis=1)
+
+
+def project_2d(centroids):
+    centered = centroids - centroids.mean(axis=0)
+    _, _, vt = np.linalg.svd(centered, full_matrices=False)
+    return centered @ vt[:2].T if vt.shape[0] >= 2 else None
+
+
+def layout_map(data, centroids=None):
+    # Adds x/y/r to every topic and x/y (relative to the topic center, as
+    # InteractiveMindMap expects) to every query, plus the canvas width/height
+    sizes = np.array([len(topic['queries']) for topic in data['topics']])
+    radii = topic_radii(sizes)
+    anchors = project_2d(centroids) if centroids is not None and len(centroids) > 2 else None
+    centers = pack_topics(radii, anchors)
+    centers -= (centers - radii[:, None]).min(axis=0) - MARGIN
+    for topic, (x, y), r in zip(data['topics'], centers, radii):
+        topic['x'], topic['y'], topic['r'] = round(float(x), 1), round(float(y), 1), round(float(r), 1)
+        offsets = sunflower(len(topic['queries']), r - QUERY_WIDTH / 2 - 10)
+        for query, (dx, dy) in zip(topic['queries'], offsets):
+            query['x'], query['y'] = round(float(dx), 1), round(float(dy), 1)
+    extent = (centers + radii[:, None]).max(axis=0) + MARGIN
+    data['width'], data['height'] = int(math.ceil(extent[0])), int(math.ceil(extent[1]))
+    return data
+
+
+def build_map(data, queries, embed=None, n_topics=None, threshold=0.75, max_per_query=2, recluster=False,
+              seed=0):
+    # Returns the laid-out map. Structured input keeps its topics, and its
+    # connections unless `embed` is given to derive them; a query log, or
+    # --recluster, derives both from the embeddings.
+    centroids = None
+    if data is None or recluster:
+        texts = [query['text'] for query in queries]
+        vectors = embed(texts)
+        labels, centroids = cluster_queries(vectors, n_topics or default_topic_count(len(queries)), seed)
+        names = name_topics(texts, labels, len(centroids))
+        data = {"topics": [{"id": f"T{t + 1}", "name": names[t], "queries": []} for t in range(len(centroids))]}
+        for query, label in zip(queries, labels):
+            data['topics'][label]['queries'].append({"id": query['id'], "text": query['text']})
+        data['connections'] = [[queries[i]['id'], queries[j]['id']]
+                               for i, j in similarity_connections(vectors, labels, threshold, max_per_query)]
+    else:
+        data = json.loads(json.dumps(data))
+        if embed is not None:
+            vectors = embed([query['text'] for query in queries])
+            labels = np.array([t for t, topic in enumerate(data['topics']) for _ in topic['queries']])
+            data['connections'] = [[queries[i]['id'], queries[j]['id']]
+                                   for i, j in similarity_connections(vectors, labels, threshold, max_per_query)]
+    data.setdefault('connections', [])
+    return layout_map(data, centroids)
+
+
+def query_positions(data):
+    return {query['id']: (topic['x'] + query['x'], topic['y'] + query['y'])
+            for topic in data['topics'] for query in topic['queries']}
+
+
+def render_svg(data):
+    # One string join for the whole document; thousands of queries stay cheap
+    positions = query_positions(data)
+    parts = [f'<svg xmlns="http://www.w3.org/2000/svg" width="{data["width"]}" height="{data["height"]}" '
+             f'viewBox="0 0 {data["width"]} {data["height"]}" font-family="sans-serif">']
+    for topic in data['topics']:
+        parts.append(f'<circle cx="{topic["x"]}" cy="{topic["y"]}" r="{topic["r"]}" fill="{TOPIC_COLOR}" '
+                     f'fill-opacity="0.5" stroke="#000"/>')
+    parts.append('<g fill="none" stroke="#999" stroke-width="2">')
+    for source, target in data['connections']:
+        if source in positions and target in positions:
+            (x1, y1), (x2, y2) = positions[source], positions[target]
+            parts.append(f'<path d="M{x1:.1f},{y1:.1f}L{x2:.1f},{y2:.1f}"/>')
+    parts.append('</g>')
+    for topic in data['topics']:
+        parts.append(f'<text x="{topic["x"]}" y="{topic["y"] - topic["r"] + 40:.1f}" text-anchor="middle" '
+                     f'font-size="24" font-weight="bold">{html.escape(topic["name"])}</text>')
+        for query in topic['queries']:
+            x, y = topic['x'] + query['x'], topic['y'] + query['y']
+            lines = textwrap.wrap(truncate_text(query['text'], 12), 18)[:5]
+            tspans = "".join(f'<tspan x="{x:.1f}" dy="{"1.2em" if i else f"{-0.6 * (len(lines) - 1):.1f}em"}">'
+                             f'{html.escape(line)}</tspan>' for i, line in enumerate(lines))
+            parts.append(f'<g><title>{html.escape(query["text"])}</title>'
+                         f'<rect x="{x - QUERY_WIDTH / 2:.1f}" y="{y - QUERY_HEIGHT / 2:.1f}" width="{QUERY_WIDTH}" '
+                         f'height="{QUERY_HEIGHT}" rx="10" fill="{QUERY_COLOR}" stroke="#000"/>'
+                         f'<text y="{y:.1f}" text-anchor="middle" font-size="12">{tspans}</text></g>')
+    parts.append('</svg>')
+    return "\n".join(parts)
+
+
+def render_png(data, output_file, dpi=150, max_labels=300):
+    # Shapes and connections are drawn as three collections rather than one artist
+    # per item; query labels are skipped past max_labels, where they would be
+    # unreadable at any dpi anyway
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    from matplotlib.collections import LineCollection, PatchCollection
+
+    width, height = data['width'], data['height']
+    fig, ax = plt.subplots(figsize=(width / 100, height / 100))
+    ax.set_xlim(0, width)
+    ax.set_ylim(height, 0)
+    positions = query_positions(data)
+    ax.add_collection(PatchCollection([plt.Circle((t['x'], t['y']), t['r']) for t in data['topics']],
+                                      facecolor=TOPIC_COLOR, alpha=0.5, edgecolor='black'))
+    segments = [(positions[s], positions[t]) for s, t in data['connections'] if s in positions and t in positions]
+    ax.add_collection(LineCollection(segments, colors='#999999', linewidths=0.8))
+    boxes = [plt.Rectangle((x - QUERY_WIDTH / 2, y - QUERY_HEIGHT / 2), QUERY_WIDTH, QUERY_HEIGHT)
+             for x, y in positions.values()]
+    ax.add_collection(PatchCollection(boxes, facecolor=QUERY_COLOR, edgecolor='black', linewidths=0.5))
+    for topic in data['topics']:
+        ax.text(topic['x'], topic['y'] - topic['r'] + 40, textwrap.fill(topic['name'], 30), ha='center',
+                va='center', fontweight='bold', fontsize=14)
+    if len(positions) <= max_labels:
+        for topic in data['topics']:
+            for query in topic['queries']:
+                ax.text(topic['x'] + query['x'], topic['y'] + query['y'], textwrap.fill(truncate_text(query['text']), 20),
+                        ha='center', va='center', fontsize=8)
     ax.axis('off')
     plt.tight_layout()
-    plt.savefig(output_file, dpi=300, bbox_inches='tight')
-    plt.close()
+    plt.savefig(output_file, dpi=dpi, bbox_inches='tight')
+    plt.close(fig)
+
+
+def map_cache_key(path, params):
+    with open(path, 'rb') as f:
+        content = f.read()
+    payload = json.dumps({"version": MIND_MAP_VERSION, "params": params}, sort_keys=True).encode('utf-8')
+    return hashlib.sha256(content + b"\0" + payload).hexdigest()[:24]
+
+
+def cached_map(path, params, build, cache_dir=MIND_MAP_CACHE_DIR):
+    # The laid-out map for this exact input and parameters, built at most once
+    key = map_cache_key(path, params)
+    cached = os.path.join(cache_dir, f"{key}.json")
+    if os.path.exists(cached):
+        logging.info(f"Mind map {key} served from cache")
+        with open(cached) as f:
+            return key, json.load(f)
+    data = build()
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(f"{cached}.tmp", 'w') as f:
+        json.dump(data, f)
+    os.replace(f"{cached}.tmp", cached)
+    return key, data
+
+
+def write_outputs(key, data, json_file=None, svg_file=None, png_file=None, dpi=150, cache_dir=MIND_MAP_CACHE_DIR):
+    # Rendered files are cached next to the map under the same key
+    if json_file:
+        with open(json_file, 'w') as f:
+            json.dump(data, f, indent=2)
+    renders = [(svg_file, f"{key}.svg", lambda target: _write_text(target, render_svg(data))),
+               (png_file, f"{key}.{dpi}.png", lambda target: render_png(data, target, dpi))]
+    for output, name, render in renders:
+        if not output:
+            continue
+        cached = os.path.join(cache_dir, name)
+        if not os.path.exists(cached):
+            render(f"{cached}.tmp")
+            os.replace(f"{cached}.tmp", cached)
+        shutil.copyfile(cached, output)
+        logging.info(f"Wrote {output}")
+
+
+def _write_text(path, text):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
+
+
+def make_embed(fake=False, model_name=EMBEDDING_MODEL, cache_dir=MIND_MAP_CACHE_DIR):
+    state = {}
+
+    def embed(texts):
+        if 'embedder' not in state:
+            if fake:
+                state['embedder'] = FakeEmbedder(EMBEDDING_DIMENSIONALITY)
+            else:
+                # Application default credentials, e.g. from gcloud auth application-default login
+                init_vertexai()
+                state['embedder'] = VertexEmbedder(model_name)
+        return embed_queries(texts, state['embedder'], "fake" if fake else model_name, cache_dir)
+
+    return embed
+
+
+def generate_mind_map(data_file, output_file=None, dpi=150, cache_dir=MIND_MAP_CACHE_DIR, json_file=None,
+                      svg_file=None, png_file=None, n_topics=None, threshold=0.75, max_per_query=2, recluster=False,
+                      connect=False, seed=0, model=EMBEDDING_MODEL, fake=False):
+    # Renders data_file to output_file (.png, .svg or .json by extension) and to
+    # any of json_file/svg_file/png_file; returns the laid-out map
+    outputs = {"json_file": json_file, "svg_file": svg_file, "png_file": png_file}
+    if output_file:
+        extension = os.path.splitext(output_file)[1].lower()
+        outputs[{".json": "json_file", ".svg": "svg_file"}.get(extension, "png_file")] = output_file
+    params = {"n_topics": n_topics, "threshold": threshold, "max_per_query": max_per_query, "recluster": recluster,
+              "connect": connect, "seed": seed, "model": model, "fake": fake}
+    data, queries = load_input(data_file)
+    embed = make_embed(fake, model, cache_dir) if data is None or recluster or connect else None
+    key, laid_out = cached_map(data_file, params, lambda: build_map(data, queries, embed, n_topics, threshold,
+                                                                    max_per_query, recluster, seed), cache_dir)
+    write_outputs(key, laid_out, dpi=dpi, cache_dir=cache_dir, **outputs)
+    return laid_out
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cluster the query log into a mind map and render it")
+    parser.add_argument("input", help="mind_map_data.json-style file or a query log (.json list or .txt)")
+    parser.add_argument("--json", help="write the laid-out map (InteractiveMindMap data) here")
+    parser.add_argument("--svg", help="write an SVG rendering here")
+    parser.add_argument("--png", help="write a PNG rendering here (needs matplotlib)")
+    parser.add_argument("--dpi", type=int, default=150)
+    parser.add_argument("--topics", type=int, help="number of topics (default grows with the query count)")
+    parser.add_argument("--threshold", type=float, default=0.75, help="cosine similarity needed for a connection")
+    parser.add_argument("--max-connections", type=int, default=2, help="connections kept per query")
+    parser.add_argument("--recluster", action="store_true", help="re-derive the topics of a structured input")
+    parser.add_argument("--connect", action="store_true",
+                        help="replace a structured input's connections with similarity connections")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--model", default=EMBEDDING_MODEL)
+    parser.add_argument("--fake", action="store_true", help="use FakeEmbedder instead of Vertex AI")
+    parser.add_argument("--cache-dir", default=MIND_MAP_CACHE_DIR)
+    args = parser.parse_args()
+    if not (args.json or args.svg or args.png):
+        parser.error("give at least one of --json, --svg, --png")
+
+    laid_out = generate_mind_map(args.input, dpi=args.dpi, cache_dir=args.cache_dir, json_file=args.json,
+                                 svg_file=args.svg, png_file=args.png, n_topics=args.topics, threshold=args.threshold,
+                                 max_per_query=args.max_connections, recluster=args.recluster, connect=args.connect,
+                                 seed=args.seed, model=args.model, fake=args.fake)
+    queries = sum(len(topic['queries']) for topic in laid_out['topics'])
+    logging.info(f"{len(laid_out['topics'])} topics, {queries} queries, {len(laid_out['connections'])} connections")
+
 
 if __name__ == "__main__":
-    generate_mind_map('C:/Users/yalov/nexus-ai/src/data/mind_map_data.json', 'C:/Users/yalov/nexus-ai/src/assets/mind_map.png')
+    main()
@@ -0,0 +1,72 @@
+# Precomputes the answers to the course query catalogue (the questions in the mind
+# map) into the artifact the functions pin in their response caches at startup
+# (precomputed.py).
+#
+#   python warm_cache.py ../../mind_map_data.json --out gs://nxs_bucket1/precomputed_answers.json.gz
+#   python warm_cache.py ../../mind_map_data.json --out gs://nxs_bucket1/precomputed_answers.json.gz --if-stale
+#
+# Point PRECOMPUTED_ANSWERS of both functions at --out. With --if-stale only queries
+# new to the catalogue or answered against an older corpus version are recomputed,
+# so it is cheap to run after every deploy or corpus update.
+import argparse
+import logging
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'gcp_nxs-function'))
+
+from mind_map_generator import load_input  # noqa: E402
+from precomputed import PRECOMPUTE_WORKERS, precompute, read_artifact, refresh_artifact, write_artifact  # noqa: E402
+from runtime import set_credentials  # noqa: E402
+from summary_cache import normalize_query  # noqa: E402
+
+logging.basicConfig(level=logging.INFO)
+
+
+def catalogue_queries(path):
+    # mind_map_data.json or a plain query list; repeats (after normalization) are dropped
+    _, queries = load_input(path)
+    unique = {}
+    for query in queries:
+        unique.setdefault(normalize_query(query['text']), query['text'])
+    return list(unique.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute answers for the course query catalogue")
+    parser.add_argument("catalogue", help="mind_map_data.json or a query list (.json or .txt)")
+    parser.add_argument("--out", required=True, help="artifact path or gs://bucket/blob (.gz to compress)")
+    parser.add_argument("--if-stale", action="store_true", help="only recompute new or out-of-date answers")
+    parser.add_argument("--workers", type=int, default=PRECOMPUTE_WORKERS)
+    args = parser.parse_args()
+
+    queries = catalogue_queries(args.catalogue)
+    # Application default credentials, e.g. from gcloud auth application-default login
+    set_credentials(None)
+    from main import answer_catalogue_query
+
+    existing = None
+    if args.if_stale:
+        try:
+            existing = read_artifact(args.out)
+        except Exception as e:
+            logging.info(f"No usable artifact at {args.out} ({e}); computing every answer")
+
+    if existing is None:
+        artifact = precompute(queries, answer_catalogue_query, args.workers)
+    else:
+        # Queries dropped from the catalogue are dropped from the artifact too
+        wanted = {normalize_query(query) for query in queries}
+        current = dict(existing, queries=queries,
+                       entries=[entry for entry in existing["entries"] if entry["query"] in wanted],
+                       embeddings={query: vector for query, vector in existing["embeddings"].items()
+                                   if normalize_query(query) in wanted})
+        artifact = refresh_artifact(current, answer_catalogue_query, max_workers=args.workers)
+        if artifact is current and current["entries"] == existing["entries"] and queries == existing["queries"]:
+            logging.info(f"All {len(queries)} catalogue answers are up to date")
+            return
+    write_artifact(artifact, args.out)
+
+
+if __name__ == "__main__":
+    main()
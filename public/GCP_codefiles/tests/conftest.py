@@ -0,0 +1,12 @@
+import os
+import sys
+
+# Lets the tests import the benchmarks package, which puts the shared function modules on sys.path
+CODEFILES_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if CODEFILES_DIR not in sys.path:
+    sys.path.insert(0, CODEFILES_DIR)
+
+from benchmarks.fakes import configure_environment  # noqa: E402
+
+# Offline defaults (no prewarm, Cloud Logging, trace export or disk caches) before any shared module reads them
+configure_environment()
@@ -0,0 +1,102 @@
+# EmbeddingClient against FakeEmbedder: the LRU+TTL query cache and the
+# micro-batching of concurrent embed() calls.
+import threading
+import time
+
+from embedding_client import EmbeddingClient, FakeEmbedder
+
+
+def test_repeated_text_is_served_from_cache():
+    backend = FakeEmbedder(dimensionality=16)
+    client = EmbeddingClient(backend, cache_ttl=60)
+    first = client.embed(["what is  gradient descent"], dimensionality=16)
+    # Whitespace differences normalize to the same key
+    second = client.embed(["what is gradient descent "], dimensionality=16)
+    assert first == second
+    assert backend.calls == 1
+    assert client.stats()["hits"] == 1 and client.stats()["misses"] == 1
+
+
+def test_expired_entries_are_embedded_again():
+    backend = FakeEmbedder(dimensionality=16)
+    client = EmbeddingClient(backend, cache_ttl=0.05)
+    client.embed(["query"], dimensionality=16)
+    client.embed(["query"], dimensionality=16)
+    assert backend.calls == 1
+    time.sleep(0.06)
+    client.embed(["query"], dimensionality=16)
+    assert backend.calls == 2
+
+
+def test_least_recently_used_entries_are_evicted():
+    backend = FakeEmbedder(dimensionality=8)
+    client = EmbeddingClient(backend, cache_entries=2)
+    client.embed(["a", "b"], dimensionality=8)
+    client.embed(["a"], dimensionality=8)
+    client.embed(["c"], dimensionality=8)
+    client.embed(["a"], dimensionality=8)
+    assert backend.texts_embedded == 3
+    client.embed(["b"], dimensionality=8)
+    assert backend.texts_embedded == 4
+
+
+def test_task_and_dimensionality_have_their_own_entries():
+    backend = FakeEmbedder()
+    client = EmbeddingClient(backend)
+    query = client.embed(["kernel trick"], "RETRIEVAL_QUERY", 16)[0]
+    document = client.embed(["kernel trick"], "RETRIEVAL_DOCUMENT", 16)[0]
+    wide = client.embed(["kernel trick"], "RETRIEVAL_QUERY", 32)[0]
+    assert backend.calls == 3
+    assert query != document
+    assert len(query) == 16 and len(wide) == 32
+    assert client.embed(["kernel trick"], "RETRIEVAL_QUERY", 16)[0] == query
+    assert backend.calls == 3
+
+
+def test_duplicate_texts_in_one_call_are_embedded_once():
+    backend = FakeEmbedder(dimensionality=8)
+    client = EmbeddingClient(backend)
+    vectors = client.embed(["same", "same", "other"], dimensionality=8)
+    assert vectors[0] == vectors[1]
+    assert backend.texts_embedded == 2
+
+
+def test_concurrent_calls_in_the_window_share_one_backend_call():
+    backend = FakeEmbedder(dimensionality=8)
+    client = EmbeddingClient(backend, batch_window_ms=100)
+    texts = [f"query {i}" for i in range(8)]
+    results = {}
+    start = threading.Barrier(len(texts))
+
+    def embed(text):
+        start.wait()
+        results[text] = client.embed([text], dimensionality=8)[0]
+
+    threads = [threading.Thread(target=embed, args=(text,)) for text in texts]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert backend.calls == 1
+    assert backend.texts_embedded == len(texts)
+    # Each caller gets its own text's vector back
+    expected = FakeEmbedder(dimensionality=8).embed(texts, "RETRIEVAL_QUERY", 8)
+    assert [results[text] for text in texts] == expected
+
+
+def test_batches_are_split_at_max_batch():
+    backend = FakeEmbedder(dimensionality=8)
+    client = EmbeddingClient(backend, batch_window_ms=100, max_batch=2)
+    start = threading.Barrier(4)
+
+    def embed(i):
+        start.wait()
+        client.embed([f"query {i}"], dimensionality=8)
+
+    threads = [threading.Thread(target=embed, args=(i,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert backend.texts_embedded == 4
+    assert backend.calls == 2
@@ -0,0 +1,34 @@
+# Rewriting a store next to a shard that has the old one memory-mapped.
+import os
+
+import numpy as np
+import pytest
+
+from embedding_store import read_store, replacing, write_store
+
+COLUMNS = {"chunk": ["a", "b"], "page": [1, 2], "coordinates": [[0, 0, 1, 1], [0, 1, 1, 2]]}
+
+
+def test_rewriting_a_store_leaves_the_mapped_matrix_intact(tmp_path):
+    prefix = str(tmp_path / "paper")
+    old = np.eye(2, 4, dtype=np.float32)
+    write_store(prefix, old, COLUMNS, "pdf", dtype="float32")
+    mapped, _, _ = read_store(prefix)
+
+    new = np.eye(2, 4, k=2, dtype=np.float32)
+    manifest = write_store(prefix, new, COLUMNS, "pdf", dtype="float32")
+    assert np.array_equal(mapped, old)
+    assert np.array_equal(read_store(prefix)[0], new)
+    assert manifest["rows"] == 2
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
+
+
+def test_a_failed_write_keeps_the_previous_file(tmp_path):
+    path = tmp_path / "paper.manifest.json"
+    path.write_text("old")
+    with pytest.raises(RuntimeError):
+        with replacing(str(path)) as tmp, open(tmp, "w") as f:
+            f.write("partial")
+            raise RuntimeError("interrupted")
+    assert path.read_text() == "old"
+    assert os.listdir(tmp_path) == ["paper.manifest.json"]
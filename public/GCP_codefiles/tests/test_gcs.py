@@ -0,0 +1,129 @@
+# Signed URL caching and the shared storage client, against the local fake GCS.
+import datetime
+import sys
+import threading
+import types
+
+import pytest
+
+import gcs
+from gcs import LocalBlob, LocalStorageClient, SignedUrlCache, set_storage_client
+
+
+class Clock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(gcs, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def signings(tmp_path, monkeypatch):
+    # Signed URLs of a fake bucket under tmp_path, counting every signature
+    calls = []
+    sign = LocalBlob.generate_signed_url
+
+    def counting(self, *args, **kwargs):
+        calls.append(self.name)
+        return f"{sign(self, *args, **kwargs)}&n={len(calls)}"
+
+    monkeypatch.setattr(LocalBlob, "generate_signed_url", counting)
+    credentials = object()
+    monkeypatch.setattr(gcs, "_clients", {})
+    set_storage_client(LocalStorageClient(str(tmp_path)), credentials)
+    return calls, credentials
+
+
+def test_cached_url_is_reused(clock, signings):
+    calls, credentials = signings
+    cache = SignedUrlCache(expiration=datetime.timedelta(minutes=15), safety_margin=120)
+    url = cache.get("bucket", "lecture.mp4", credentials)
+    clock.now += 600
+    assert cache.get("bucket", "lecture.mp4", credentials) == url
+    assert calls == ["lecture.mp4"]
+    # Other blobs are signed separately
+    assert cache.get("bucket", "paper.pdf", credentials) != url
+    assert calls == ["lecture.mp4", "paper.pdf"]
+
+
+def test_url_is_resigned_once_inside_the_safety_margin(clock, signings):
+    calls, credentials = signings
+    cache = SignedUrlCache(expiration=datetime.timedelta(minutes=15), safety_margin=120)
+    first = cache.get("bucket", "lecture.mp4", credentials)
+    clock.now += 15 * 60 - 120 - 1
+    assert cache.get("bucket", "lecture.mp4", credentials) == first
+    clock.now += 2
+    second = cache.get("bucket", "lecture.mp4", credentials)
+    assert second != first
+    clock.now += 60
+    assert cache.get("bucket", "lecture.mp4", credentials) == second
+    assert len(calls) == 2
+
+
+def test_concurrent_requests_sign_an_expiring_url_once(clock, signings):
+    calls, credentials = signings
+    cache = SignedUrlCache(expiration=datetime.timedelta(minutes=15), safety_margin=120)
+    cache.get("bucket", "lecture.mp4", credentials)
+    clock.now += 15 * 60
+    start = threading.Barrier(8)
+    urls = []
+
+    def fetch():
+        start.wait()
+        urls.append(cache.get("bucket", "lecture.mp4", credentials))
+
+    threads = [threading.Thread(target=fetch) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 2
+    assert len(set(urls)) == 1
+
+
+def test_storage_client_is_created_once(monkeypatch):
+    created = []
+
+    class Client:
+        def __init__(self, credentials=None):
+            created.append(credentials)
+
+    # google-cloud-storage stand-in, so the test needs no Google packages
+    storage = types.ModuleType("google.cloud.storage")
+    storage.Client = Client
+    cloud = types.ModuleType("google.cloud")
+    cloud.storage = storage
+    google = types.ModuleType("google")
+    google.cloud = cloud
+    monkeypatch.setitem(sys.modules, "google", google)
+    monkeypatch.setitem(sys.modules, "google.cloud", cloud)
+    monkeypatch.setitem(sys.modules, "google.cloud.storage", storage)
+    monkeypatch.setattr(gcs, "_clients", {})
+
+    start = threading.Barrier(8)
+    clients = []
+
+    def get():
+        start.wait()
+        clients.append(gcs.get_storage_client())
+
+    threads = [threading.Thread(target=get) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(created) == 1
+    assert all(client is clients[0] for client in clients)
+    assert gcs.get_storage_client() is clients[0]
+    # Other credentials get their own client
+    credentials = object()
+    assert gcs.get_storage_client(credentials) is not clients[0]
+    assert created == [None, credentials]
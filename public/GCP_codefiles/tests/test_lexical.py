@@ -0,0 +1,40 @@
+# BM25 split across shards: with the summed statistics every shard scores its
+# documents as one index over all of them would.
+import numpy as np
+
+from lexical import BM25Index, combine_statistics
+
+TEXTS = [
+    "gradient descent minimizes the loss",
+    "stochastic gradient descent uses mini batches",
+    "the loss of a support vector machine is the hinge loss",
+    "backpropagation computes the gradient of the loss",
+    "kernels map inputs to a feature space",
+    "a support vector machine maximizes the margin",
+    "dropout regularizes deep networks during training",
+]
+QUERY = "support vector machine loss"
+
+
+def test_combined_statistics_match_a_single_index():
+    whole = BM25Index.build(TEXTS)
+    shards = [BM25Index.build(TEXTS[:2]), BM25Index.build(TEXTS[2:])]
+    statistics = combine_statistics([shard.statistics(QUERY) for shard in shards])
+    split = np.concatenate([shard.scores(QUERY, statistics) for shard in shards])
+    assert np.allclose(split, whole.scores(QUERY), atol=1e-5)
+
+
+def test_shard_local_statistics_do_not_compare():
+    # A term rare in its own small shard gets a larger IDF than it has corpus-wide
+    whole = BM25Index.build(TEXTS)
+    shards = [BM25Index.build(TEXTS[:2]), BM25Index.build(TEXTS[2:])]
+    local = np.concatenate([shard.scores(QUERY) for shard in shards])
+    assert not np.allclose(local, whole.scores(QUERY), atol=1e-5)
+
+
+def test_search_ranks_with_the_given_statistics():
+    shards = [BM25Index.build(TEXTS[:3]), BM25Index.build(TEXTS[3:])]
+    statistics = combine_statistics([shard.statistics(QUERY) for shard in shards])
+    scores, ids = shards[1].search(QUERY, 2, statistics)
+    assert list(ids) == [2, 0]
+    assert np.allclose(scores, shards[1].scores(QUERY, statistics)[[2, 0]])
@@ -0,0 +1,210 @@
+# llm.py against a model that fails or stalls on a fixed schedule: retries with
+# jittered backoff, the AIMD limit, the circuit breaker and the request deadline,
+# and the placeholders the callers fall back to.
+import threading
+import time
+
+import pytest
+
+from benchmarks.fakes import FakeResponse, ResourceExhausted, ServiceUnavailable
+import llm
+from llm import AdaptiveLimiter, CircuitBreaker, CircuitOpenError, DeadlinePassedError, LLMClient, deadline, generate
+from summarization import summarize_concurrently
+
+
+class BadRequest(Exception):
+    code = 400
+
+
+class ScheduledModel:
+    # Each call takes the next outcome: an exception to raise, a number of seconds
+    # to stall before answering, or the text to answer with. Past the end it answers "ok".
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def generate_content(self, prompt, generation_config=None, stream=False):
+        with self._lock:
+            outcome = self.outcomes[self.calls] if self.calls < len(self.outcomes) else "ok"
+            self.calls += 1
+        if isinstance(outcome, BaseException):
+            raise outcome
+        if isinstance(outcome, (int, float)):
+            time.sleep(outcome)
+            outcome = "ok"
+        return FakeResponse(outcome)
+
+
+@pytest.fixture
+def client():
+    # A fresh client with near-zero backoff for every test
+    previous = llm.get_llm_client()
+    client = LLMClient(limiter=AdaptiveLimiter(initial=4, max_limit=8, decrease_interval=0.0),
+                       breaker=CircuitBreaker(failure_threshold=3, reset_timeout=0.05),
+                       backoff_base=0.001, backoff_max=0.002, seed=0)
+    llm.set_llm_client(client)
+    yield client
+    llm.set_llm_client(previous)
+
+
+def test_retries_retryable_errors_then_succeeds(client):
+    model = ScheduledModel(ServiceUnavailable("503"), ServiceUnavailable("503"), "answer")
+    assert generate(model, "prompt").text == "answer"
+    assert model.calls == 3
+    assert client.counters["attempts"] == 3
+    assert client.counters["retries"] == 2
+    assert client.counters["succeeded"] == 1
+    assert client.breaker.state == "closed"
+
+
+def test_gives_up_after_max_attempts(client):
+    client.breaker.failure_threshold = 10
+    model = ScheduledModel(*[ServiceUnavailable("503")] * 10)
+    with pytest.raises(ServiceUnavailable):
+        generate(model, "prompt")
+    assert model.calls == client.max_attempts
+    assert client.counters["retries"] == client.max_attempts - 1
+    assert client.counters["failed"] == 1
+    assert client.breaker.failures == client.max_attempts
+
+
+def test_client_errors_are_not_retried(client):
+    model = ScheduledModel(BadRequest("blocked prompt"))
+    with pytest.raises(BadRequest):
+        generate(model, "prompt")
+    assert model.calls == 1
+    assert client.counters["retries"] == 0
+    assert client.breaker.failures == 0
+
+
+def test_backoff_is_full_jitter():
+    client = LLMClient(backoff_base=0.5, backoff_max=8, seed=1)
+    for attempt in range(1, 8):
+        cap = min(8, 0.5 * 2 ** (attempt - 1))
+        delays = [client.backoff(attempt) for _ in range(200)]
+        assert all(0 <= delay <= cap for delay in delays)
+        assert len(set(delays)) > 1
+
+
+def test_limit_halves_on_overload_and_grows_on_success():
+    limiter = AdaptiveLimiter(initial=8, min_limit=1, max_limit=16, decrease_interval=0.0)
+    for expected in (4, 2, 1, 1):
+        assert limiter.acquire()
+        limiter.release(succeeded=False, overloaded=True)
+        assert limiter.limit == expected
+    for _ in range(3):
+        assert limiter.acquire()
+        limiter.release()
+    assert limiter.limit > 2
+    assert limiter.decreases == 4
+
+
+def test_limit_caps_calls_in_flight():
+    limiter = AdaptiveLimiter(initial=2, max_limit=2)
+    assert limiter.try_acquire() and limiter.try_acquire()
+    assert not limiter.try_acquire()
+    assert not limiter.acquire(timeout=0.01)
+    limiter.release()
+    assert limiter.try_acquire()
+
+
+def test_quota_errors_shrink_the_limit_but_never_open_the_circuit(client):
+    model = ScheduledModel(*[ResourceExhausted("429")] * 20)
+    for _ in range(3):
+        with pytest.raises(ResourceExhausted):
+            generate(model, "prompt")
+    assert client.breaker.state == "closed"
+    assert client.limiter.limit == 1
+    assert client.counters["overloaded"] == model.calls
+
+
+def test_slow_calls_count_as_overload(client):
+    client.slow_call = 0.01
+    assert generate(ScheduledModel(0.03), "prompt").text == "ok"
+    assert client.limiter.limit == 2
+
+
+def test_breaker_opens_fails_fast_and_half_opens(client):
+    client.max_attempts = 1
+    failing = ScheduledModel(*[ServiceUnavailable("503")] * 3)
+    for _ in range(3):
+        with pytest.raises(ServiceUnavailable):
+            generate(failing, "prompt")
+    assert client.breaker.state == "open"
+    assert client.breaker.trips == 1
+
+    # Open: rejected without calling the model
+    healthy = ScheduledModel()
+    with pytest.raises(CircuitOpenError):
+        generate(healthy, "prompt")
+    assert healthy.calls == 0
+    assert client.counters["rejected_open"] == 1
+
+    # After the cool-down one probe goes through; its failure opens the circuit again
+    time.sleep(0.06)
+    with pytest.raises(ServiceUnavailable):
+        generate(ScheduledModel(ServiceUnavailable("503")), "prompt")
+    assert client.breaker.state == "open"
+
+    # A successful probe closes it
+    time.sleep(0.06)
+    assert generate(healthy, "prompt").text == "ok"
+    assert client.breaker.state == "closed"
+    assert client.breaker.trips == 1
+
+
+def test_half_open_lets_one_probe_through():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.0)
+    breaker.record(False)
+    assert breaker.state == "open"
+    assert breaker.allow()
+    assert breaker.state == "half_open"
+    assert not breaker.allow()
+
+
+def test_passed_deadline_starts_no_call(client):
+    model = ScheduledModel()
+    with deadline(0.0):
+        with pytest.raises(DeadlinePassedError):
+            generate(model, "prompt")
+    assert model.calls == 0
+    assert client.counters["deadline_exceeded"] == 1
+
+
+def test_no_retry_that_would_end_after_the_deadline(client):
+    client.backoff_base = client.backoff_max = 5.0
+    model = ScheduledModel(*[ServiceUnavailable("503")] * 10)
+    started = time.monotonic()
+    with deadline(1.0):
+        with pytest.raises(ServiceUnavailable):
+            generate(model, "prompt")
+    assert time.monotonic() - started < 1.0
+    assert model.calls == 1
+    assert client.counters["deadline_exceeded"] == 1
+
+
+def test_deadline_ends_late_summaries_with_placeholders(client):
+    model = ScheduledModel(0.0, 2.0, 2.0)
+
+    def summarize(item):
+        return generate(model, item).text
+
+    started = time.monotonic()
+    with deadline(0.3):
+        results = summarize_concurrently(["a", "b", "c"], summarize, max_concurrency=3, timeout=10.0,
+                                         placeholder="placeholder")
+    assert time.monotonic() - started < 1.0
+    assert sorted(results) == ["ok", "placeholder", "placeholder"]
+
+
+def test_relation_summary_falls_back_to_placeholder(client):
+    from pdf_search import RELATION_SUMMARY_PLACEHOLDER, generate_relation_summary
+
+    client.max_attempts = 2
+    snippets = [{"chunk_text": "gradient descent lowers the loss", "document_id": "pdf", "page": 1, "similarity": 0.9}]
+    model = ScheduledModel(ServiceUnavailable("503"), ServiceUnavailable("503"))
+    summary = generate_relation_summary("what does gradient descent do (placeholder test)", snippets, model=model,
+                                        corpus=object())
+    assert summary == RELATION_SUMMARY_PLACEHOLDER
+    assert model.calls == 2
@@ -0,0 +1,25 @@
+# lexical.preprocess_text must return exactly what the original regex implementation
+# did, since PDF chunk texts and their BM25 indexes are built with it.
+import random
+
+import pytest
+
+from benchmarks.preprocess_text import EDGE_CASES, pdf_like_chunk, random_cases, reference_preprocess_text
+from lexical import preprocess_text
+
+
+@pytest.mark.parametrize("text", EDGE_CASES)
+def test_edge_cases(text):
+    assert preprocess_text(text) == reference_preprocess_text(text)
+
+
+def test_random_inputs():
+    mismatches = [text for text in random_cases(5000) if preprocess_text(text) != reference_preprocess_text(text)]
+    assert mismatches == []
+
+
+def test_pdf_like_chunks():
+    rng = random.Random(1)
+    for _ in range(200):
+        chunk = pdf_like_chunk(rng)
+        assert preprocess_text(chunk) == reference_preprocess_text(chunk)
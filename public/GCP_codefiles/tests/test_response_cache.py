@@ -0,0 +1,38 @@
+# ResponseCache lookups as the functions make them: an exact lookup first, then
+# one with the query embedding, counted as a single hit or miss.
+import numpy as np
+
+from response_cache import ResponseCache
+
+FILTERS = {"course": "ml"}
+
+
+def lookup(cache, query, embedding, version=1):
+    cached = cache.get("pdf:20", query, FILTERS, version, count_miss=False)
+    if cached is None:
+        cached = cache.get("pdf:20", query, FILTERS, version, embedding)
+    return cached
+
+
+def test_a_query_missing_both_lookups_counts_one_miss():
+    cache = ResponseCache(max_entries=8)
+    assert lookup(cache, "what is backpropagation", np.ones(4)) is None
+    assert cache.stats()["misses"] == 1 and cache.stats()["hits"] == 0
+
+
+def test_exact_and_paraphrased_queries_hit():
+    cache = ResponseCache(max_entries=8)
+    cache.set("pdf:20", "what is backpropagation", FILTERS, 1, {"answer": 1}, np.array([1.0, 0.0, 0.0, 0.0]))
+    assert lookup(cache, "What is  backpropagation", None) == {"answer": 1}
+    assert lookup(cache, "explain backpropagation", np.array([1.0, 0.01, 0.0, 0.0])) == {"answer": 1}
+    assert lookup(cache, "what is dropout", np.array([0.0, 1.0, 0.0, 0.0])) is None
+    stats = cache.stats()
+    assert (stats["hits"], stats["semantic_hits"], stats["misses"]) == (2, 1, 1)
+
+
+def test_entries_of_an_older_corpus_version_are_dropped():
+    cache = ResponseCache(max_entries=8)
+    cache.set("pdf:20", "what is backpropagation", FILTERS, 1, {"answer": 1}, np.ones(4))
+    assert lookup(cache, "what is backpropagation", np.ones(4), version=2) is None
+    assert cache.stats()["invalidations"] == 1 and cache.stats()["misses"] == 1
+    assert len(cache) == 0
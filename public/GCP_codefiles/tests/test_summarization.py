@@ -0,0 +1,111 @@
+# summarize_concurrently / stream_concurrently with slow and hanging fake models:
+# input order, per-call timeouts, the concurrency cap and the speedup over
+# summarizing one group at a time.
+import threading
+import time
+
+import pytest
+
+from benchmarks.fakes import FakeGenerativeModel
+from summarization import stream_concurrently, summarize_concurrently
+
+
+@pytest.fixture
+def hang():
+    # Calls that wait on this event never finish on their own; released at teardown
+    release = threading.Event()
+    yield release
+    release.set()
+
+
+def test_results_keep_input_order():
+    # Later items finish first
+    delays = [0.2, 0.15, 0.1, 0.05, 0.0]
+
+    def summarize(i):
+        time.sleep(delays[i])
+        return f"summary {i}"
+
+    results = summarize_concurrently(list(range(5)), summarize, max_concurrency=5, timeout=5.0)
+    assert results == [f"summary {i}" for i in range(5)]
+
+
+def test_timed_out_and_failed_calls_return_the_placeholder(hang):
+    def summarize(item):
+        if item == "hangs":
+            hang.wait()
+        if item == "fails":
+            raise RuntimeError("model error")
+        return item.upper()
+
+    started = time.monotonic()
+    results = summarize_concurrently(["a", "hangs", "fails", "b"], summarize, max_concurrency=4, timeout=0.2,
+                                     placeholder="placeholder")
+    assert results == ["A", "placeholder", "placeholder", "B"]
+    assert time.monotonic() - started < 1.0
+
+
+def test_timeout_counts_from_the_start_of_each_call():
+    # Queued behind the first call, the second finishes 0.3 s after submission but 0.15 s after it starts
+    def summarize(item):
+        time.sleep(0.15)
+        return item
+
+    results = summarize_concurrently(["a", "b"], summarize, max_concurrency=1, timeout=0.25, placeholder="placeholder")
+    assert results == ["a", "b"]
+
+
+def test_items_queued_behind_hung_workers_are_abandoned(hang):
+    def summarize(item):
+        if item == "hangs":
+            hang.wait()
+        return item
+
+    started = time.monotonic()
+    results = summarize_concurrently(["hangs", "b", "c"], summarize, max_concurrency=1, timeout=0.1,
+                                     placeholder="placeholder")
+    assert results == ["placeholder", "placeholder", "placeholder"]
+    assert time.monotonic() - started < 1.0
+
+
+def test_at_most_max_concurrency_calls_run_at_once():
+    model = FakeGenerativeModel(latency=0.05, jitter=0.0)
+    results = summarize_concurrently([f"group {i}" for i in range(12)],
+                                     lambda text: model.generate_content(text).text, max_concurrency=3, timeout=5.0)
+    assert all(results)
+    assert model.calls == 12
+    assert model.peak_in_flight == 3
+
+
+def test_concurrent_summaries_beat_sequential_ones():
+    model = FakeGenerativeModel(latency=0.1, jitter=0.0)
+    started = time.monotonic()
+    summarize_concurrently([f"group {i}" for i in range(8)], lambda text: model.generate_content(text).text,
+                           max_concurrency=4, timeout=5.0)
+    # Two rounds of 0.1 s instead of eight
+    assert time.monotonic() - started < 0.5
+
+
+def test_stream_yields_one_summary_per_item_and_times_out_hanging_ones(hang):
+    def summarize_stream(item):
+        yield f"{item} part one"
+        if item == "hangs":
+            hang.wait()
+        yield " and two"
+
+    events = list(stream_concurrently(["a", "hangs", "b"], summarize_stream, max_concurrency=2, timeout=0.2,
+                                      placeholder="placeholder"))
+    summaries = {i: text for kind, i, text in events if kind == "summary"}
+    assert summaries == {0: "a part one and two", 1: "placeholder", 2: "b part one and two"}
+    assert [i for kind, i, _ in events if kind == "summary"].count(1) == 1
+
+
+def test_stream_abandons_items_queued_behind_hung_workers(hang):
+    def summarize_stream(item):
+        if item == "hangs":
+            hang.wait()
+        yield item
+
+    events = list(stream_concurrently(["hangs", "b"], summarize_stream, max_concurrency=1, timeout=0.1,
+                                      placeholder="placeholder"))
+    assert sorted((i, text) for kind, i, text in events if kind == "summary") == [(0, "placeholder"), (1, "placeholder")]
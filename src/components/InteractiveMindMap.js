@@ -22,20 +22,29 @@ const InteractiveMindMap = ({ data }) => {
 
       svg.call(zoom);
 
+      // Maps written by otherScripts/mind_map_generator.py --json are already laid out:
+      // topic x/y/r, query x/y relative to its topic, and the canvas width/height
+      const laidOut = data.topics.every(t => t.r != null && t.x != null && t.y != null &&
+        t.queries.every(q => q.x != null && q.y != null));
+      svg.attr("viewBox", laidOut && data.width && data.height ? `0 0 ${data.width} ${data.height}` : null);
+
       // Size bubbles based on number of questions
       const bubbleScale = d3.scaleSqrt()
         .domain([0, d3.max(data.topics, d => d.queries.length)])
         .range([600, 800]);
+      const topicRadius = d => laidOut ? d.r : bubbleScale(d.queries.length) / 2;
+
+      if (!laidOut) {
+        // Create topic bubbles
+        const topicSimulation = d3.forceSimulation(data.topics)
+          .force("charge", d3.forceManyBody().strength(-15000))
+          .force("center", d3.forceCenter(width / 2, height / 2))
+          .force("collision", d3.forceCollide().radius(d => topicRadius(d) + 20))
+          .stop();
 
-      // Create topic bubbles
-      const topicSimulation = d3.forceSimulation(data.topics)
-        .force("charge", d3.forceManyBody().strength(-15000))
-        .force("center", d3.forceCenter(width / 2, height / 2))
-        .force("collision", d3.forceCollide().radius(d => bubbleScale(d.queries.length) / 2 + 20))
-        .stop();
-
-      // Run the simulation
-      for (let i = 0; i < 300; ++i) topicSimulation.tick();
+        // Run the simulation
+        for (let i = 0; i < 300; ++i) topicSimulation.tick();
+      }
 
       const topicNodes = g.selectAll(".topic")
         .data(data.topics)
@@ -44,12 +53,12 @@ const InteractiveMindMap = ({ data }) => {
         .attr("transform", d => `translate(${d.x},${d.y})`);
 
       topicNodes.append("circle")
-        .attr("r", d => bubbleScale(d.queries.length) / 2)
+        .attr("r", topicRadius)
         .attr("fill", "#E6E6FA")
         .attr("stroke", "#000");
 
       topicNodes.append("text")
-        .attr("dy", d => -bubbleScale(d.queries.length) / 2 + 40)
+        .attr("dy", d => -topicRadius(d) + 40)
         .attr("text-anchor", "middle")
         .attr("font-size", "24px")
         .attr("font-weight", "bold")
@@ -59,17 +68,19 @@ const InteractiveMindMap = ({ data }) => {
       topicNodes.each(function(topicData) {
         const topic = d3.select(this);
         const queries = topicData.queries;
-        const bubbleRadius = bubbleScale(queries.length) / 2;
-
-        const querySimulation = d3.forceSimulation(queries)
-          .force("charge", d3.forceManyBody().strength(-500))
-          .force("center", d3.forceCenter(0, 50))
-          .force("collision", d3.forceCollide().radius(60))
-          .force("radius", d3.forceRadial(bubbleRadius * 0.6).strength(0.8))
-          .stop();
-
-        // Run the simulation
-        for (let i = 0; i < 300; ++i) querySimulation.tick();
+        const bubbleRadius = topicRadius(topicData);
+
+        if (!laidOut) {
+          const querySimulation = d3.forceSimulation(queries)
+            .force("charge", d3.forceManyBody().strength(-500))
+            .force("center", d3.forceCenter(0, 50))
+            .force("collision", d3.forceCollide().radius(60))
+            .force("radius", d3.forceRadial(bubbleRadius * 0.6).strength(0.8))
+            .stop();
+
+          // Run the simulation
+          for (let i = 0; i < 300; ++i) querySimulation.tick();
+        }
 
         const queryNodes = topic.selectAll(".query")
           .data(queries)
@@ -58,20 +58,34 @@ const MainPage = () => {
         setIsLoading(true);
         setMessages(prevMessages => [...prevMessages, { text: input, isUser: true }]);
 
-        // Make both API calls
-        const videoResponse = await fetch(process.env.REACT_APP_VIDEO_API_ENDPOINT, {
-          method: 'POST',
-          headers: { 'Content-Type': 'application/json' },
-          body: JSON.stringify({ input }),
-        });
-        const videoData = await videoResponse.json();
+        let videoData;
+        let pdfData;
+        if (process.env.REACT_APP_QUERY_API_ENDPOINT) {
+          // One combined call: the query is embedded once and both results come back together
+          const queryResponse = await fetch(process.env.REACT_APP_QUERY_API_ENDPOINT, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ input }),
+          });
+          const queryData = await queryResponse.json();
+          videoData = queryData.video;
+          pdfData = queryData.pdf;
+        } else {
+          // Make both API calls
+          const videoResponse = await fetch(process.env.REACT_APP_VIDEO_API_ENDPOINT, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ input }),
+          });
+          videoData = await videoResponse.json();
 
-        const pdfResponse = await fetch(process.env.REACT_APP_PDF_API_ENDPOINT, {
-          method: 'POST',
-          headers: { 'Content-Type': 'application/json' },
-          body: JSON.stringify({ input }),
-        });
-        const pdfData = await pdfResponse.json();
+          const pdfResponse = await fetch(process.env.REACT_APP_PDF_API_ENDPOINT, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ input }),
+          });
+          pdfData = await pdfResponse.json();
+        }
 
         setVideoUrl(videoData.video_url);
         setPdfUrl(pdfData.pdf_url);